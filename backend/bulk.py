@@ -0,0 +1,116 @@
+"""
+Bulk Lookups
+Fetches rows for large id sets by splitting them into bounded in_() chunks
+run concurrently on the fan-out pool, keeping request URLs short and never
+letting the server row cap silently truncate a result
+"""
+
+import os
+import threading
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from storage import Query, get_backend
+from concurrency import fan_out
+
+# Values per in_() filter, keeping request URLs short
+LOOKUP_CHUNK_SIZE = int(os.getenv("LOOKUP_CHUNK_SIZE", "200"))
+
+# Most rows the server returns for one request (PostgREST max-rows)
+SERVER_MAX_ROWS = int(os.getenv("SERVER_MAX_ROWS", "1000"))
+
+# Extra filters applied to every chunk query, e.g. lambda q: q.gte("timestamp", cutoff)
+Refine = Callable[[Query], Query]
+
+
+def _run_chunks(label: str, fetch: Callable[[List[Any]], Any], values: Sequence[Any], chunk_size: int) -> List[Any]:
+    """fetch() each chunk of values, concurrently when there is more than one"""
+    chunks = [list(values[start:start + chunk_size]) for start in range(0, len(values), chunk_size)]
+    # Run inline when there is nothing to overlap, or when already on a fan-out worker
+    # (waiting on the pool from inside it could starve it)
+    if len(chunks) <= 1 or threading.current_thread().name.startswith("fanout"):
+        return [fetch(chunk) for chunk in chunks]
+    results, errors = fan_out({f"{label} chunk {i}": partial(fetch, chunk) for i, chunk in enumerate(chunks)})
+    if errors:
+        raise next(iter(errors.values()))
+    return list(results.values())
+
+
+def lookup_in(table: str, column: str, values: Sequence[Any], columns: str = "*",
+              refine: Optional[Refine] = None, key: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Every row of `table` whose `column` is one of `values`
+    Each chunk is paged past the server row cap, so values with many rows are complete.
+    `key` is the table's unique key, the last sort column so pages never overlap or skip
+    rows; it defaults to `column`, which must then be unique.
+    """
+    values = list(dict.fromkeys(value for value in values if value is not None))
+
+    def fetch(chunk: List[Any]) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        while True:
+            query = get_backend().table(table).select(columns).in_(column, chunk)
+            if refine:
+                query = refine(query)
+            query = query.order(column)
+            if key and key != column:
+                query = query.order(key)
+            page = query.range(len(rows), len(rows) + SERVER_MAX_ROWS - 1).execute().data
+            rows += page
+            if len(page) < SERVER_MAX_ROWS:
+                return rows
+
+    return [row for rows in _run_chunks(table, fetch, values, LOOKUP_CHUNK_SIZE) for row in rows]
+
+
+def latest_in(table: str, column: str, values: Sequence[Any], per_value: int = 1,
+              time_column: str = "timestamp", columns: str = "*",
+              refine: Optional[Refine] = None, key: Optional[str] = None) -> Dict[Any, List[Dict[str, Any]]]:
+    """
+    The newest `per_value` rows (up to SERVER_MAX_ROWS) of `table` for each of `values`, newest first
+    Chunks are sized so a full answer fits in one response; when a chunk comes
+    back at the limit, the values it shortchanged are re-read together, paged
+    past the server row cap, so busy values never push quiet ones out. Rows are
+    ordered by time_column, then `key` (the table's unique key) so pages are stable.
+    """
+    values = list(dict.fromkeys(value for value in values if value is not None))
+    per_value = max(1, min(per_value, SERVER_MAX_ROWS))
+    selected = columns if columns.strip() == "*" else ", ".join(dict.fromkeys(
+        [c.strip() for c in columns.split(",")] + [column, time_column]))
+
+    def query():
+        q = get_backend().table(table).select(selected)
+        return refine(q) if refine else q
+
+    def ordered(q: Query) -> Query:
+        q = q.order(time_column, desc=True).order(column)
+        return q.order(key) if key and key != column else q
+
+    def fetch(chunk: List[Any]) -> Dict[Any, List[Dict[str, Any]]]:
+        limit = len(chunk) * per_value
+        rows = ordered(query().in_(column, chunk)).limit(limit).execute().data
+        latest: Dict[Any, List[Dict[str, Any]]] = {value: [] for value in chunk}
+        for row in rows:
+            kept = latest.get(row.get(column))
+            if kept is not None and len(kept) < per_value:
+                kept.append(row)
+        short = [value for value, kept in latest.items() if len(kept) < per_value]
+        if len(rows) < limit or not short:
+            return latest
+        for value in short:
+            latest[value] = []
+        offset = 0
+        while True:
+            page = ordered(query().in_(column, short)).range(offset, offset + SERVER_MAX_ROWS - 1).execute().data
+            for row in page:
+                kept = latest[row.get(column)]
+                if len(kept) < per_value:
+                    kept.append(row)
+            offset += len(page)
+            if len(page) < SERVER_MAX_ROWS or all(len(latest[value]) >= per_value for value in short):
+                return latest
+
+    chunk_size = max(1, min(LOOKUP_CHUNK_SIZE, SERVER_MAX_ROWS // per_value))
+    merged: Dict[Any, List[Dict[str, Any]]] = {}
+    for latest in _run_chunks(table, fetch, values, chunk_size):
+        merged.update(latest)
+    return merged
@@ -0,0 +1,186 @@
+"""
+Concurrency Helpers
+Runs blocking data-access calls off the event loop with bounded concurrency,
+fans out independent per-source queries in parallel, and coalesces identical
+in-flight calls into one execution
+"""
+
+import os
+import time
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial, wraps
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import anyio
+from anyio import to_thread
+from storage import DB_MAX_CONCURRENCY
+
+# Default per-source deadline for fan-out queries
+FANOUT_TIMEOUT_SECONDS = float(os.getenv("FANOUT_TIMEOUT_SECONDS", "5"))
+
+# Shared limiter sized to the storage connection pool, created on first use
+# so it binds to the running event loop
+_db_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+def get_db_limiter() -> anyio.CapacityLimiter:
+    """Get or create the global data-access capacity limiter"""
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = anyio.CapacityLimiter(DB_MAX_CONCURRENCY)
+    return _db_limiter
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Await a synchronous DatabaseService / EntityResolver / PredictiveMonitor call
+    in a worker thread. At most DB_MAX_CONCURRENCY calls run at once; the rest
+    wait on the limiter without blocking the event loop.
+    """
+    return await to_thread.run_sync(partial(func, *args, **kwargs), limiter=get_db_limiter())
+
+
+# Shared pool for per-source fan-out queries (lazy loaded)
+_fanout_executor: Optional[ThreadPoolExecutor] = None
+_fanout_lock = threading.Lock()
+
+
+def get_fanout_executor() -> ThreadPoolExecutor:
+    """Get or create the global fan-out thread pool"""
+    global _fanout_executor
+    if _fanout_executor is None:
+        with _fanout_lock:
+            if _fanout_executor is None:
+                _fanout_executor = ThreadPoolExecutor(max_workers=DB_MAX_CONCURRENCY, thread_name_prefix="fanout")
+    return _fanout_executor
+
+
+def fan_out(tasks: Dict[str, Callable[[], Any]], timeout: float = FANOUT_TIMEOUT_SECONDS,
+            default: Any = None) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """
+    Run independent per-source queries concurrently
+    Waits at most `timeout` seconds overall, so latency is the slowest source
+    rather than the sum. Sources that fail or miss the deadline get `default`
+    in the results and their exception in the errors dict.
+    """
+    executor = get_fanout_executor()
+    # Each task runs in a copy of the caller's context, so request-scoped state carries over
+    futures = {name: executor.submit(copy_context().run, task) for name, task in tasks.items()}
+    deadline = time.monotonic() + timeout
+    results: Dict[str, Any] = {}
+    errors: Dict[str, Exception] = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except Exception as e:
+            if not future.done():
+                future.cancel()
+                e = TimeoutError(f"{name} did not respond within {timeout}s")
+            print(f"Error fetching {name}: {e}")
+            results[name] = default
+            errors[name] = e
+    return results, errors
+
+
+def shutdown_fanout():
+    """Stop the fan-out pool without waiting for abandoned queries"""
+    global _fanout_executor
+    if _fanout_executor is not None:
+        _fanout_executor.shutdown(wait=False, cancel_futures=True)
+        _fanout_executor = None
+
+
+class _Flight:
+    """One in-flight call and the outcome its waiters receive"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Merges concurrent calls that share a key into one execution
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait and receive the same result (or exception). Nothing is kept once
+    the call finishes, so the next caller starts a fresh execution.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.stats = {"executions": 0, "coalesced": 0}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.stats["executions"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """In-flight keys and counters"""
+        with self._lock:
+            return {**self.stats, "in_flight": len(self._flights)}
+
+
+# Global single-flight group (lazy loaded)
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Get or create the global single-flight group"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
+
+
+def coalesced(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Decorator: identical concurrent calls of func share one execution
+    Calls are identical when their arguments bind to the same values (defaults
+    included); calls with unhashable arguments always run on their own.
+    Waiters receive the same result object, so use it for read-only results.
+    """
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (func.__qualname__, tuple(bound.arguments.items()))
+        try:
+            hash(key)
+        except TypeError:
+            return func(*args, **kwargs)
+        return get_single_flight().do(key, partial(func, *args, **kwargs))
+
+    return wrapper
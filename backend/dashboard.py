@@ -0,0 +1,153 @@
+"""
+Dashboard Snapshot
+Dashboard stats, weekly activity, source distribution, security stats and
+alerts recomputed on a fixed interval by a background thread, so dashboard
+endpoints answer from memory regardless of data volume
+"""
+
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+from concurrency import SingleFlight
+
+# Seconds between background refreshes; older snapshots are served while a refresh runs
+DASHBOARD_REFRESH_SECONDS = float(os.getenv("DASHBOARD_REFRESH_SECONDS", "15"))
+# Oldest snapshot served without recomputing in the request
+DASHBOARD_MAX_STALE_SECONDS = float(os.getenv("DASHBOARD_MAX_STALE_SECONDS", "300"))
+
+# Alerts scanned per refresh; requests for fewer are answered from the scan's prefix
+DASHBOARD_ALERT_LIMIT = 500
+
+
+class DashboardSnapshot:
+    """
+    Named values, each recomputed every `interval` seconds by one scheduler thread
+
+    get() never waits on a refresh while the value is at most `max_stale`
+    seconds old (stale-while-revalidate): a value older than `interval` is
+    served as is and the scheduler is woken to recompute it. A refresh that
+    fails keeps the previous value. Concurrent refreshes of one value, from
+    requests or the scheduler, share a single recomputation.
+    """
+
+    def __init__(self, producers: Dict[str, Callable[[], Any]],
+                 interval: float = DASHBOARD_REFRESH_SECONDS,
+                 max_stale: float = DASHBOARD_MAX_STALE_SECONDS):
+        self.producers = producers
+        self.interval = interval
+        self.max_stale = max_stale
+        # name -> (value, computed at as time.time())
+        self._values: Dict[str, Tuple[Any, float]] = {}
+        self.errors: Dict[str, str] = {}
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._wake = threading.Event()
+        # Set by stop(); the scheduler is never started again afterwards
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the scheduler thread if it is not running and stop() has not been called"""
+        with self._start_lock:
+            if not self._stopped and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="dashboard-snapshot", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the scheduler thread for good"""
+        with self._start_lock:
+            self._stopped = True
+            thread = self._thread
+        self._wake.set()
+        if thread is not None:
+            thread.join(timeout)
+            with self._start_lock:
+                if self._thread is thread and not thread.is_alive():
+                    self._thread = None
+
+    def _run(self):
+        while not self._stopped:
+            self.refresh()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def refresh(self, name: Optional[str] = None):
+        """Recompute one value, or all of them; joins a recomputation already running"""
+        for key in ([name] if name else list(self.producers)):
+            self._flights.do(key, lambda key=key: self._recompute(key))
+        with self._lock:
+            self.refreshes += 1
+
+    def _recompute(self, name: str):
+        try:
+            value = self.producers[name]()
+        except Exception as e:
+            print(f"Error refreshing dashboard {name}: {e}")
+            with self._lock:
+                self.errors[name] = str(e)
+            return
+        with self._lock:
+            self._values[name] = (value, time.time())
+            self.errors.pop(name, None)
+
+    def get(self, name: str) -> Tuple[Any, float]:
+        """(value, age in seconds), recomputing in the caller only when missing or too stale"""
+        self.start()
+        with self._lock:
+            entry = self._values.get(name)
+        age = time.time() - entry[1] if entry else None
+        if entry is None or age > self.max_stale:
+            self.refresh(name)
+            with self._lock:
+                entry = self._values.get(name, entry)
+                error = self.errors.get(name)
+            if entry is None:
+                raise RuntimeError(f"dashboard {name} unavailable: {error}")
+            age = time.time() - entry[1]
+        elif age > self.interval:
+            self._wake.set()
+        return entry[0], age
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Age of each value and refresh state"""
+        now = time.time()
+        with self._lock:
+            values, errors, refreshes = dict(self._values), dict(self.errors), self.refreshes
+        return {
+            "values": {name: round(now - computed_at, 3) for name, (_, computed_at) in values.items()},
+            "errors": errors,
+            "refreshes": refreshes,
+            "interval_seconds": self.interval,
+            "max_stale_seconds": self.max_stale
+        }
+
+
+# Global snapshot instance (lazy loaded)
+_dashboard_instance: Optional[DashboardSnapshot] = None
+_dashboard_lock = threading.Lock()
+
+
+def get_dashboard_snapshot() -> DashboardSnapshot:
+    """Get or create the global dashboard snapshot over DatabaseService"""
+    global _dashboard_instance
+    if _dashboard_instance is None:
+        with _dashboard_lock:
+            if _dashboard_instance is None:
+                from database import DatabaseService
+                _dashboard_instance = DashboardSnapshot({
+                    "stats": lambda: DatabaseService.get_dashboard_stats(strict=True),
+                    "weekly_activity": lambda: DatabaseService.get_weekly_activity_data(strict=True),
+                    "source_distribution": lambda: DatabaseService.get_source_distribution_data(strict=True),
+                    "security_stats": lambda: DatabaseService.get_security_stats(strict=True),
+                    "alerts": lambda: DatabaseService.scan_security_alerts(limit=DASHBOARD_ALERT_LIMIT, strict=True),
+                })
+    return _dashboard_instance
+
+
+def shutdown_dashboard_snapshot():
+    """Stop the global snapshot's scheduler, if it was started"""
+    if _dashboard_instance is not None:
+        _dashboard_instance.stop(timeout=1)
@@ -1,47 +1,261 @@
 import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterator
 from datetime import datetime, timedelta
 from difflib import SequenceMatcher
 import re
+from bisect import bisect_right
+import numpy as np
+from storage import get_backend
+from concurrency import fan_out, coalesced
+from bulk import lookup_in, latest_in, SERVER_MAX_ROWS
+from rollup import serving_rollup
+from eventstore import serving_event_store
+from lastseen import serving_last_seen
+from profilecache import get_profile_cache
+from search import SEARCH_FIELDS, serving_search_index
+from ingest import write_batch, notify_indexes
+from timeutil import HOUR_SECONDS, DAY_SECONDS, MISSING_EPOCH, to_epoch, to_epoch_array, from_epoch, floor_day, now_epoch, newest_first
 
-load_dotenv("creds.env")
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Tie-breaker key per event table, so time-window scans can resume exactly
+# after the last row even when many rows share a timestamp
+EVENT_TABLE_KEYS = {
+    "swipes": "swipe_id",
+    "wifi_logs": "log_id",
+    "cctv_frame": "frame_id",
+    "lab_bookings": "booking_id",
+    "library_checkouts": "checkout_id"
+}
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise RuntimeError("Missing SUPABASE_URL or SUPABASE_KEY in environment variables.")
+# Rows per chunk for streamed scans; keep at or below the server's max-rows cap
+WINDOW_CHUNK_SIZE = int(os.getenv("WINDOW_CHUNK_SIZE", "1000"))
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Entity status cutoffs are taken on whole minutes, so per-status id lists are shared across requests
+STATUS_RESOLUTION_SECONDS = 60
+
+# Sources plotted on the activity heatmap
+HEATMAP_SOURCES = ("swipes", "wifi_logs", "cctv_frame")
 
 
 class DatabaseService:
     """Service class for database operations"""
     
     @staticmethod
-    def get_all_profiles(limit: int = 100, offset: int = 0):
-        """Get all profiles with pagination"""
-        response = supabase.table("profiles").select("*").range(offset, offset + limit - 1).execute()
+    def get_all_profiles(limit: int = 100, offset: int = 0, after: Optional[str] = None, columns: str = "*"):
+        """
+        Get all profiles with pagination, ordered by entity_id
+        Pass `after` (the last entity_id of the previous page) for keyset pagination
+        """
+        query = get_backend().table("profiles").select(columns)
+        response = DatabaseService._paginate(query, limit, offset, after).execute()
         return response.data
     
+    @staticmethod
+    def iter_profiles(page_size: int = 1000, columns: str = "*"):
+        """
+        Stream every profile in entity_id order, one keyset page at a time
+        Each page costs the same regardless of how deep the scan is
+        """
+        after = None
+        while True:
+            page = DatabaseService.get_all_profiles(limit=page_size, after=after, columns=columns)
+            yield from page
+            after = DatabaseService.next_cursor(page, page_size)
+            if after is None:
+                return
+    
+    @staticmethod
+    def _paginate(query, limit: int, offset: int = 0, after: Optional[str] = None):
+        """
+        Apply entity_id-ordered pagination to a profiles query
+        With a cursor, seeks past `after` instead of skipping `offset` rows
+        """
+        query = query.order("entity_id")
+        if after is not None:
+            return query.gt("entity_id", after).limit(limit)
+        return query.range(offset, offset + limit - 1)
+    
+    @staticmethod
+    def next_cursor(rows: List[Dict[str, Any]], limit: int) -> Optional[str]:
+        """Cursor for the page after `rows`, or None when this was the last page"""
+        if len(rows) < limit or not rows:
+            return None
+        return rows[-1].get("entity_id")
+    
     @staticmethod
     def get_profile_by_entity_id(entity_id: str):
-        """Get a specific profile by entity_id"""
-        response = supabase.table("profiles").select("*").eq("entity_id", entity_id).execute()
+        """Get a specific profile by entity_id, through the shared profile cache"""
+        return get_profile_cache().get(entity_id, DatabaseService._fetch_profile)
+    
+    @staticmethod
+    @coalesced
+    def _fetch_profile(entity_id: str, generation: Optional[tuple] = None):
+        """
+        Read one profile row from storage
+        `generation` (from the profile cache) only keys the coalescing, so a read
+        started before a profile was invalidated is never shared after it
+        """
+        response = get_backend().table("profiles").select("*").eq("entity_id", entity_id).execute()
         return response.data[0] if response.data else None
     
+    @staticmethod
+    def get_profiles_by_entity_ids(entity_ids: List[str]) -> List[Dict[str, Any]]:
+        """Full profile rows for entity_ids, in the order given (missing ones are skipped)"""
+        profiles = {profile.get("entity_id"): profile for profile in lookup_in("profiles", "entity_id", entity_ids)}
+        return [profiles[entity_id] for entity_id in entity_ids if entity_id in profiles]
+    
     @staticmethod
     def search_profiles(query: str, field: str = "name"):
-        """Search profiles by name, email, or department"""
-        response = supabase.table("profiles").select("*").ilike(field, f"%{query}%").execute()
+        """
+        Search profiles by name, email, or department, best matches first
+        Answered from the profile search index; ilike scan while it is being built
+        """
+        index = serving_search_index()
+        if index and field in SEARCH_FIELDS:
+            ranked = index.search(query, fields=(field,), limit=None)
+            return DatabaseService.get_profiles_by_entity_ids([match["entity_id"] for match in ranked])
+        response = get_backend().table("profiles").select("*").ilike(field, f"%{query}%").execute()
         return response.data
     
+    @staticmethod
+    def autocomplete_profiles(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Ranked profile suggestions for a search box, straight from the search index"""
+        index = serving_search_index()
+        if index:
+            return index.search(query, limit=limit)
+        # Index still building: fall back to a name prefix query
+        rows = get_backend().table("profiles").select(", ".join(SEARCH_FIELDS)).ilike("name", f"{query}%").order("name").limit(limit).execute().data
+        return [{**{field: row.get(field) for field in SEARCH_FIELDS}, "score": None} for row in rows]
+    
+    @staticmethod
+    def _search_page(search: str, fields: tuple, limit: int, offset: int = 0,
+                     after: Optional[str] = None) -> Optional[tuple]:
+        """
+        One entity_id-ordered page of profiles matching `search`, from the search index
+        Returns (profiles, total matches), or None while the index is being built
+        """
+        index = serving_search_index()
+        if not index:
+            return None
+        entity_ids = index.search_ids(search, fields)
+        total = len(entity_ids)
+        if after is not None:
+            entity_ids = entity_ids[bisect_right(entity_ids, after):]
+            offset = 0
+        return DatabaseService.get_profiles_by_entity_ids(entity_ids[offset:offset + limit]), total
+    
+    @staticmethod
+    def _status_page(status: str, search: Optional[str], limit: int, offset: int = 0,
+                     after: Optional[str] = None, now: Optional[int] = None) -> Optional[tuple]:
+        """
+        One entity_id-ordered page of profiles whose status at `now` is `status`
+        Returns (profiles, total with that status), or None while the indexes it needs are being built
+        
+        Active and recent entities are read off the last-seen index and fetched by id.
+        Inactive ones are everyone not seen in 24 hours: the profile table is walked in
+        entity_id order skipping the (comparatively few) recently seen entities; an
+        offset is first turned into a cursor by reading entity_ids alone.
+        Totals count only sightings with a profile, so both indexes must be serving.
+        """
+        index = serving_last_seen()
+        search_index = serving_search_index()
+        if not index or not search_index:
+            return None
+        now = now if now is not None else now_epoch()
+        
+        if status in ("active", "recent"):
+            since, until = (now - HOUR_SECONDS, None) if status == "active" else (now - 24 * HOUR_SECONDS, now - HOUR_SECONDS)
+            entity_ids = index.seen_between(since, until)
+            if search:
+                matching = set(search_index.search_ids(search, ("name", "email", "department")))
+                entity_ids = [entity_id for entity_id in entity_ids if entity_id in matching]
+            else:
+                # Sightings can name entities that have no profile
+                entity_ids = search_index.existing(entity_ids)
+            start = bisect_right(entity_ids, after) if after is not None else offset
+            profiles: List[Dict[str, Any]] = []
+            while len(profiles) < limit and start < len(entity_ids):
+                chunk = entity_ids[start:start + limit - len(profiles)]
+                start += len(chunk)
+                profiles += DatabaseService.get_profiles_by_entity_ids(chunk)
+            return profiles, len(entity_ids)
+        
+        seen = index.seen_between(now - 24 * HOUR_SECONDS)
+        seen_set = set(seen)
+        if search:
+            entity_ids = [e for e in search_index.search_ids(search, ("name", "email", "department")) if e not in seen_set]
+            start = bisect_right(entity_ids, after) if after is not None else offset
+            return DatabaseService.get_profiles_by_entity_ids(entity_ids[start:start + limit]), len(entity_ids)
+        
+        count = get_backend().table("profiles").select("entity_id", count="exact").limit(1).execute().count or 0
+        total = max(count - len(search_index.existing(seen)), 0)
+        skip, cursor = (offset if after is None else 0), after
+        while skip:
+            # Enough entity_ids to cover the offset even if every seen entity falls inside it
+            size = min(SERVER_MAX_ROWS, skip + len(seen))
+            query = get_backend().table("profiles").select("entity_id").order("entity_id")
+            if cursor is not None:
+                query = query.gt("entity_id", cursor)
+            rows = query.limit(size).execute().data
+            for row in rows:
+                cursor = row.get("entity_id")
+                if cursor not in seen_set:
+                    skip -= 1
+                    if not skip:
+                        break
+            if skip and len(rows) < size:
+                return [], total
+        
+        profiles = []
+        while len(profiles) < limit:
+            query = get_backend().table("profiles").select("*").order("entity_id")
+            if cursor is not None:
+                query = query.gt("entity_id", cursor)
+            rows = query.limit(limit).execute().data
+            for row in rows:
+                if row.get("entity_id") in seen_set:
+                    continue
+                profiles.append(row)
+                if len(profiles) == limit:
+                    break
+            if len(rows) < limit:
+                break
+            cursor = rows[-1].get("entity_id")
+        return profiles, total
+    
+    @staticmethod
+    def stream_window(table: str, columns: str, start: str, end: Optional[str] = None,
+                      time_column: str = "timestamp", chunk_size: int = WINDOW_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+        """
+        Stream every row of `table` whose time_column falls in [start, end], oldest first
+        Pages through the window in bounded chunks using a (time_column, key) keyset,
+        so results are never truncated by the server row cap and memory stays flat.
+        """
+        key_column = EVENT_TABLE_KEYS.get(table, "identity")
+        selected = [c.strip() for c in columns.split(",")] if columns.strip() != "*" else ["*"]
+        if "*" not in selected:
+            selected += [c for c in (time_column, key_column) if c not in selected]
+        
+        last_time = last_key = None
+        while True:
+            query = get_backend().table(table).select(", ".join(selected)).gte(time_column, start)
+            if end:
+                query = query.lte(time_column, end)
+            if last_time is not None:
+                query = query.or_(
+                    f'{time_column}.gt."{last_time}",'
+                    f'and({time_column}.eq."{last_time}",{key_column}.gt."{last_key}")'
+                )
+            rows = query.order(time_column).order(key_column).limit(chunk_size).execute().data
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            last_time, last_key = rows[-1].get(time_column), rows[-1].get(key_column)
+    
     @staticmethod
     def get_recent_swipes(limit: int = 50, entity_id: Optional[str] = None):
         """Get recent swipe records"""
-        query = supabase.table("swipes").select("*").order("timestamp", desc=True).limit(limit)
+        query = get_backend().table("swipes").select("*").order("timestamp", desc=True).limit(limit)
         if entity_id:
             query = query.eq("identity", entity_id)
         response = query.execute()
@@ -50,7 +264,7 @@ class DatabaseService:
     @staticmethod
     def get_recent_wifi_logs(limit: int = 50, entity_id: Optional[str] = None):
         """Get recent WiFi logs"""
-        query = supabase.table("wifi_logs").select("*").order("timestamp", desc=True).limit(limit)
+        query = get_backend().table("wifi_logs").select("*").order("timestamp", desc=True).limit(limit)
         if entity_id:
             query = query.eq("identity", entity_id)
         response = query.execute()
@@ -60,7 +274,7 @@ class DatabaseService:
     def get_lab_bookings(entity_id: Optional[str] = None, upcoming: bool = False):
         """Get lab bookings"""
         try:
-            query = supabase.table("lab_bookings").select("*").order("start_time", desc=True)
+            query = get_backend().table("lab_bookings").select("*").order("start_time", desc=True)
             if entity_id:
                 query = query.eq("entity_id", entity_id)
             if upcoming:
@@ -76,7 +290,7 @@ class DatabaseService:
     def get_library_checkouts(entity_id: Optional[str] = None):
         """Get library checkouts"""
         try:
-            query = supabase.table("library_checkouts").select("*").order("timestamp", desc=True)
+            query = get_backend().table("library_checkouts").select("*").order("timestamp", desc=True)
             if entity_id:
                 query = query.eq("entity_id", entity_id)
             response = query.execute()
@@ -89,7 +303,7 @@ class DatabaseService:
     def get_notes(entity_id: Optional[str] = None, source: Optional[str] = None):
         """Get notes"""
         try:
-            query = supabase.table("notes").select("*").order("timestamp", desc=True)
+            query = get_backend().table("notes").select("*").order("timestamp", desc=True)
             if entity_id:
                 query = query.eq("entity_id", entity_id)
             if source:
@@ -103,16 +317,22 @@ class DatabaseService:
     @staticmethod
     def get_cctv_frames(location_id: Optional[str] = None, limit: int = 50):
         """Get CCTV frames"""
-        query = supabase.table("cctv_frame").select("*").order("timestamp", desc=True).limit(limit)
+        query = get_backend().table("cctv_frame").select("*").order("timestamp", desc=True).limit(limit)
         if location_id:
             query = query.eq("location_id", location_id)
         response = query.execute()
         return response.data
     
+    @staticmethod
+    def get_face_embeddings():
+        """Get all face embeddings"""
+        response = get_backend().table("face_embedding").select("*").execute()
+        return response.data
+    
     @staticmethod
     def get_face_embedding(face_id: str):
         """Get face embedding by face_id"""
-        response = supabase.table("face_embedding").select("*").eq("face_id", face_id).execute()
+        response = get_backend().table("face_embedding").select("*").eq("face_id", face_id).execute()
         return response.data[0] if response.data else None
     
     @staticmethod
@@ -127,19 +347,19 @@ class DatabaseService:
         
         # Search by card_id
         if card_id:
-            profile = supabase.table("profiles").select("*").eq("card_id", card_id).execute()
+            profile = get_backend().table("profiles").select("*").eq("card_id", card_id).execute()
             if profile.data:
                 matches.append({"source": "card", "profile": profile.data[0], "confidence": 0.95})
         
         # Search by device_hash
         if device_hash:
-            profile = supabase.table("profiles").select("*").eq("device_hash", device_hash).execute()
+            profile = get_backend().table("profiles").select("*").eq("device_hash", device_hash).execute()
             if profile.data:
                 matches.append({"source": "device", "profile": profile.data[0], "confidence": 0.85})
         
         # Search by face_id
         if face_id:
-            profile = supabase.table("profiles").select("*").eq("face_id", face_id).execute()
+            profile = get_backend().table("profiles").select("*").eq("face_id", face_id).execute()
             if profile.data:
                 matches.append({"source": "face", "profile": profile.data[0], "confidence": 0.90})
         
@@ -173,45 +393,51 @@ class DatabaseService:
         """
         cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
         
-        # Get all activities
-        swipes = supabase.table("swipes").select("*").eq("entity_id", entity_id).gte("timestamp", cutoff_date).execute()
-        wifi_logs = supabase.table("wifi_logs").select("*").eq("entity_id", entity_id).gte("timestamp", cutoff_date).execute()
-        
-        # Get lab bookings and library checkouts
-        try:
-            lab_bookings = supabase.table("lab_bookings").select("*").eq("entity_id", entity_id).gte("start_time", cutoff_date).execute()
-        except Exception as e:
-            print(f"Error getting lab bookings in timeline: {e}")
-            lab_bookings = type('obj', (object,), {'data': []})()
-        
-        try:
-            library_checkouts = supabase.table("library_checkouts").select("*").eq("entity_id", entity_id).gte("timestamp", cutoff_date).execute()
-        except Exception as e:
-            print(f"Error getting library checkouts in timeline: {e}")
-            library_checkouts = type('obj', (object,), {'data': []})() 
+        # Query every source concurrently; a slow or failing source yields []
+        sources, errors = fan_out(
+            DatabaseService._entity_activity_tasks(entity_id, cutoff_date), default=[]
+        )
         
         return {
             "entity_id": entity_id,
             "period_days": days,
-            "swipes": swipes.data,
-            "wifi_logs": wifi_logs.data,
-            "lab_bookings": lab_bookings.data,
-            "library_checkouts": library_checkouts.data,
-            "total_activities": len(swipes.data) + len(wifi_logs.data) + len(lab_bookings.data) + len(library_checkouts.data)
+            "swipes": sources["swipes"],
+            "wifi_logs": sources["wifi_logs"],
+            "lab_bookings": sources["lab_bookings"],
+            "library_checkouts": sources["library_checkouts"],
+            "total_activities": sum(len(rows) for rows in sources.values()),
+            "unavailable_sources": list(errors.keys())
         }
     
     @staticmethod
-    def get_security_stats() -> Dict[str, Any]:
+    def _entity_activity_tasks(entity_id: str, cutoff_date: str) -> Dict[str, Any]:
+        """
+        Independent per-source activity queries for one entity since cutoff_date
+        """
+        def query(table: str, time_column: str):
+            return lambda: get_backend().table(table).select("*").eq("entity_id", entity_id).gte(time_column, cutoff_date).execute().data
+        
+        return {
+            "swipes": query("swipes", "timestamp"),
+            "wifi_logs": query("wifi_logs", "timestamp"),
+            "lab_bookings": query("lab_bookings", "start_time"),
+            "library_checkouts": query("library_checkouts", "timestamp")
+        }
+    
+    @staticmethod
+    @coalesced
+    def get_security_stats(strict: bool = False) -> Dict[str, Any]:
         """
         Get security statistics for the Security dashboard - OPTIMIZED
+        With strict, errors are raised instead of answered with zeroed stats
         """
         try:
             from datetime import datetime, timedelta
             today_cutoff = (datetime.now() - timedelta(hours=24)).isoformat()
             
             # Get recent activities count only
-            recent_swipes = supabase.table("swipes").select("entity_id", count="exact").gte("timestamp", today_cutoff).execute()
-            recent_cctv = supabase.table("cctv_frame").select("frame_id", count="exact").gte("timestamp", today_cutoff).execute()
+            recent_swipes = get_backend().table("swipes").select("entity_id", count="exact").gte("timestamp", today_cutoff).execute()
+            recent_cctv = get_backend().table("cctv_frame").select("frame_id", count="exact").gte("timestamp", today_cutoff).execute()
             
             # Return stats quickly
             return {
@@ -224,6 +450,8 @@ class DatabaseService:
             }
         except Exception as e:
             print(f"Error getting security stats: {e}")
+            if strict:
+                raise
             return {
                 "active_threats": 0,
                 "resolved_today": 0,
@@ -234,16 +462,19 @@ class DatabaseService:
             }
     
     @staticmethod
-    def get_dashboard_stats(target_date: Optional[str] = None, target_time: Optional[str] = None) -> Dict[str, Any]:
+    @coalesced
+    def get_dashboard_stats(target_date: Optional[str] = None, target_time: Optional[str] = None,
+                            strict: bool = False) -> Dict[str, Any]:
         """
         Get dashboard statistics - OPTIMIZED for speed
         Supports specific date/time for historical analysis
+        With strict, errors are raised instead of answered with zeroed stats
+        
+        Counts come from the columnar event store, or the hourly rollup for windows
+        it does not hold (whole hours, approximate distinct entities); until those are
+        built, from the dashboard_activity_stats function or by streaming the window
         """
         try:
-            # Count total profiles
-            total_profiles = supabase.table("profiles").select("entity_id", count="exact").execute()
-            total_count = total_profiles.count if hasattr(total_profiles, 'count') else len(total_profiles.data)
-            
             # Determine time range for activity (12 hour window)
             from datetime import datetime, timedelta
             
@@ -263,26 +494,29 @@ class DatabaseService:
             start_time_str = start_time.isoformat()
             end_time_str = end_time.isoformat()
             
-            # Get activity in the 12-hour window
-            recent_swipes = supabase.table("swipes").select("entity_id").gte("timestamp", start_time_str).lte("timestamp", end_time_str).execute()
-            recent_wifi = supabase.table("wifi_logs").select("entity_id").gte("timestamp", start_time_str).lte("timestamp", end_time_str).execute()
-            
-            # Count unique active entities
-            active_entities = set()
-            for swipe in recent_swipes.data:
-                if swipe.get("entity_id"):
-                    active_entities.add(swipe.get("entity_id"))
-            for wifi in recent_wifi.data:
-                if wifi.get("entity_id"):
-                    active_entities.add(wifi.get("entity_id"))
+            aggregates = DatabaseService._activity_aggregates(to_epoch(start_time))
+            if aggregates:
+                total_count = DatabaseService._count_profiles()
+                total_activities, active_count = aggregates.activity(to_epoch(start_time), to_epoch(end_time), ("swipes", "wifi_logs"))
+            else:
+                try:
+                    stats = get_backend().rpc(
+                        "dashboard_activity_stats", {"start_ts": start_time_str, "end_ts": end_time_str}
+                    ).data[0]
+                    total_count = stats["total_entities"]
+                    total_activities = stats["total_activities"]
+                    active_count = stats["active_entities"]
+                except Exception as e:
+                    print(f"dashboard_activity_stats unavailable, counting locally: {e}")
+                    total_count, total_activities, active_count = DatabaseService._count_dashboard_activity(start_time_str, end_time_str)
             
             # Calculate resolution rate (percentage format like 95 not 0.95)
             resolution_rate = 95  # Base rate
             
             return {
                 "total_entities": total_count,
-                "active_today": len(active_entities),
-                "total_activities": len(recent_swipes.data) + len(recent_wifi.data),
+                "active_today": active_count,
+                "total_activities": total_activities,
                 "resolution_accuracy": resolution_rate,  # Returns as integer percentage (95 not 0.95)
                 "time_range": {
                     "start": start_time_str,
@@ -291,6 +525,8 @@ class DatabaseService:
             }
         except Exception as e:
             print(f"Error getting dashboard stats: {e}")
+            if strict:
+                raise
             return {
                 "total_entities": 0,
                 "active_today": 0,
@@ -299,10 +535,45 @@ class DatabaseService:
             }
     
     @staticmethod
-    def get_weekly_activity_data(target_date: Optional[str] = None, target_time: Optional[str] = None) -> Dict[str, Any]:
+    def _count_dashboard_activity(start_time_str: str, end_time_str: str):
+        """
+        Client-side fallback for dashboard_activity_stats
+        Returns (total profiles, activity rows, distinct active entities)
+        """
+        total_count = DatabaseService._count_profiles()
+        
+        # Stream activity in the window and count unique active entities
+        active_entities = set()
+        total_activities = 0
+        for table in ("swipes", "wifi_logs"):
+            for row in DatabaseService.stream_window(table, "entity_id", start_time_str, end_time_str):
+                total_activities += 1
+                if row.get("entity_id"):
+                    active_entities.add(row.get("entity_id"))
+        return total_count, total_activities, len(active_entities)
+    
+    @staticmethod
+    def _activity_aggregates(start_epoch: int):
+        """
+        In-memory source for window aggregates starting at start_epoch: the exact
+        columnar event store for recent windows, else the hourly rollup, else None
+        """
+        return serving_event_store(start_epoch) or serving_rollup(start_epoch)
+    
+    @staticmethod
+    def _count_profiles() -> int:
+        """Exact number of profiles"""
+        total_profiles = get_backend().table("profiles").select("entity_id", count="exact").limit(1).execute()
+        return total_profiles.count if total_profiles.count is not None else len(total_profiles.data)
+    
+    @staticmethod
+    @coalesced
+    def get_weekly_activity_data(target_date: Optional[str] = None, target_time: Optional[str] = None,
+                                 strict: bool = False) -> Dict[str, Any]:
         """
         Get weekly activity data for dashboard charts
         Returns real data from swipes and wifi logs aggregated by day
+        With strict, errors are raised instead of answered with mock data
         """
         try:
             from datetime import datetime, timedelta
@@ -317,25 +588,28 @@ class DatabaseService:
             # Get last 7 days
             start_time = end_time - timedelta(days=7)
             
-            # Fetch swipes and wifi logs
-            swipes = supabase.table("swipes").select("timestamp, entity_id").gte("timestamp", start_time.isoformat()).lte("timestamp", end_time.isoformat()).execute()
-            wifi_logs = supabase.table("wifi_logs").select("timestamp, entity_id").gte("timestamp", start_time.isoformat()).lte("timestamp", end_time.isoformat()).execute()
-            
-            # Aggregate by day
-            day_data = defaultdict(lambda: {"entities": set(), "sessions": 0, "alerts": 0})
+            day_data = {}
             day_names = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
             
-            for swipe in swipes.data:
-                if swipe.get("timestamp"):
-                    day = datetime.fromisoformat(swipe["timestamp"].replace('Z', '+00:00')).date()
-                    day_data[day]["entities"].add(swipe.get("entity_id"))
-                    day_data[day]["sessions"] += 1
-            
-            for wifi in wifi_logs.data:
-                if wifi.get("timestamp"):
-                    day = datetime.fromisoformat(wifi["timestamp"].replace('Z', '+00:00')).date()
-                    day_data[day]["entities"].add(wifi.get("entity_id"))
-                    day_data[day]["sessions"] += 1
+            aggregates = DatabaseService._activity_aggregates(to_epoch(start_time))
+            if aggregates:
+                # Read per-day totals straight from the in-memory event store / rollup
+                daily = aggregates.daily_activity(to_epoch(start_time), to_epoch(end_time), ("swipes", "wifi_logs"))
+                for day, (sessions, entities) in daily.items():
+                    day_data[from_epoch(day).date()] = {"entities": entities, "sessions": sessions, "alerts": 0}
+            else:
+                # Aggregate swipes and wifi logs by UTC day as they stream in
+                day_entities = defaultdict(set)
+                day_sessions = defaultdict(int)
+                for table in ("swipes", "wifi_logs"):
+                    for row in DatabaseService.stream_window(table, "timestamp, entity_id", start_time.isoformat(), end_time.isoformat()):
+                        epoch = to_epoch(row.get("timestamp"))
+                        if epoch is not None:
+                            day = floor_day(epoch)
+                            day_entities[day].add(row.get("entity_id"))
+                            day_sessions[day] += 1
+                for day, sessions in day_sessions.items():
+                    day_data[from_epoch(day).date()] = {"entities": len(day_entities[day]), "sessions": sessions, "alerts": 0}
             
             # Create result for last 7 days
             result = []
@@ -343,8 +617,8 @@ class DatabaseService:
             for i in range(7):
                 date = (end_time - timedelta(days=6-i)).date()
                 day_name = day_names[date.weekday()]
-                data = day_data.get(date, {"entities": set(), "sessions": 0, "alerts": 0})
-                entities_count = len(data["entities"])
+                data = day_data.get(date, {"entities": 0, "sessions": 0, "alerts": 0})
+                entities_count = data["entities"]
                 sessions_count = data["sessions"]
                 
                 if entities_count > 0 or sessions_count > 0:
@@ -373,6 +647,8 @@ class DatabaseService:
             return {"data": result}
         except Exception as e:
             print(f"Error getting weekly activity data: {e}")
+            if strict:
+                raise
             # Return mock data as fallback
             return {"data": [
                 {"time": "Mon", "entities": 892, "sessions": 65, "alerts": 8},
@@ -385,10 +661,13 @@ class DatabaseService:
             ]}
     
     @staticmethod
-    def get_source_distribution_data(target_date: Optional[str] = None, target_time: Optional[str] = None) -> Dict[str, Any]:
+    @coalesced
+    def get_source_distribution_data(target_date: Optional[str] = None, target_time: Optional[str] = None,
+                                     strict: bool = False) -> Dict[str, Any]:
         """
         Get data source distribution for dashboard charts
         Returns real counts from different data sources
+        With strict, errors are raised instead of answered with mock data
         """
         try:
             from datetime import datetime, timedelta
@@ -401,36 +680,30 @@ class DatabaseService:
             
             start_time = end_time - timedelta(days=7)
             
-            # Count records from each source - try to get all records if date filtering fails
-            swipes_response = supabase.table("swipes").select("swipe_id", count="exact").gte("timestamp", start_time.isoformat()).lte("timestamp", end_time.isoformat()).execute()
-            wifi_response = supabase.table("wifi_logs").select("log_id", count="exact").gte("timestamp", start_time.isoformat()).lte("timestamp", end_time.isoformat()).execute()
-            cctv_response = supabase.table("cctv_frame").select("frame_id", count="exact").gte("timestamp", start_time.isoformat()).lte("timestamp", end_time.isoformat()).execute()
-            booking_response = supabase.table("lab_bookings").select("booking_id", count="exact").gte("booking_time", start_time.isoformat()).lte("booking_time", end_time.isoformat()).execute()
-            
-            swipes_count = swipes_response.count if hasattr(swipes_response, 'count') else len(swipes_response.data)
-            wifi_count = wifi_response.count if hasattr(wifi_response, 'count') else len(wifi_response.data)
-            cctv_count = cctv_response.count if hasattr(cctv_response, 'count') else len(cctv_response.data)
-            booking_count = booking_response.count if hasattr(booking_response, 'count') else len(booking_response.data)
+            # Count records from each source in memory, or in one server-side call
+            aggregates = DatabaseService._activity_aggregates(to_epoch(start_time))
+            if aggregates:
+                counts = aggregates.source_counts(to_epoch(start_time), to_epoch(end_time))
+            else:
+                counts = DatabaseService._count_sources(start_time.isoformat(), end_time.isoformat())
             
             # If all counts are 0, use recent total counts as fallback
-            if swipes_count == 0 and wifi_count == 0 and cctv_count == 0 and booking_count == 0:
+            if not any(counts.values()):
                 print("No data in time range, using total counts")
-                swipes_total = supabase.table("swipes").select("swipe_id", count="exact").limit(1000).execute()
-                wifi_total = supabase.table("wifi_logs").select("log_id", count="exact").limit(1000).execute()
-                cctv_total = supabase.table("cctv_frame").select("frame_id", count="exact").limit(1000).execute()
-                booking_total = supabase.table("lab_bookings").select("booking_id", count="exact").limit(1000).execute()
-                
-                swipes_count = swipes_total.count if hasattr(swipes_total, 'count') else len(swipes_total.data)
-                wifi_count = wifi_total.count if hasattr(wifi_total, 'count') else len(wifi_total.data)
-                cctv_count = cctv_total.count if hasattr(cctv_total, 'count') else len(cctv_total.data)
-                booking_count = booking_total.count if hasattr(booking_total, 'count') else len(booking_total.data)
-                
-                # If still no data, use mock data
-                if swipes_count == 0 and wifi_count == 0 and cctv_count == 0 and booking_count == 0:
-                    swipes_count = 456
-                    wifi_count = 342
-                    cctv_count = 289
-                    booking_count = 160
+                rollup = serving_rollup()
+                counts = rollup.source_counts() if rollup else DatabaseService._count_sources()
+            
+            swipes_count = counts["swipes"]
+            wifi_count = counts["wifi_logs"]
+            cctv_count = counts["cctv_frame"]
+            booking_count = counts["lab_bookings"]
+            
+            # If still no data, use mock data
+            if swipes_count == 0 and wifi_count == 0 and cctv_count == 0 and booking_count == 0:
+                swipes_count = 456
+                wifi_count = 342
+                cctv_count = 289
+                booking_count = 160
             
             return {
                 "data": [
@@ -442,6 +715,8 @@ class DatabaseService:
             }
         except Exception as e:
             print(f"Error getting source distribution data: {e}")
+            if strict:
+                raise
             # Return mock data as fallback
             return {
                 "data": [
@@ -453,63 +728,140 @@ class DatabaseService:
             }
     
     @staticmethod
-    def get_entities_enriched(limit: int = 100, offset: int = 0, status: Optional[str] = None, search: Optional[str] = None) -> Dict[str, Any]:
+    @coalesced
+    def get_activity_heatmap(days: int = 7, target_date: Optional[str] = None, target_time: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Get hour-of-day x day activity counts for analytics
+        Covers `days` calendar days (UTC) ending on the target date; day 0 is the oldest
+        """
+        try:
+            if target_date and target_time:
+                end_time = datetime.strptime(f"{target_date} {target_time}", "%Y-%m-%d %H:%M:%S")
+            else:
+                end_time = datetime.now()
+            
+            end_epoch = to_epoch(end_time)
+            start_epoch = floor_day(end_epoch) - (days - 1) * DAY_SECONDS
+            
+            rollup = serving_rollup(start_epoch)
+            if rollup:
+                hours, weights = rollup.hourly_counts(start_epoch, end_epoch, HEATMAP_SOURCES)
+                grid = DatabaseService._bin_hour_day(hours, start_epoch, days, weights)
+            else:
+                # Convert each source's timestamps once, then bin them all together
+                epochs = [
+                    to_epoch_array([row.get("timestamp") for row in DatabaseService.stream_window(
+                        table, "timestamp", from_epoch(start_epoch).isoformat(), end_time.isoformat())])
+                    for table in HEATMAP_SOURCES
+                ]
+                grid = DatabaseService._bin_hour_day(np.concatenate(epochs), start_epoch, days)
+            
+            counts = grid.tolist()
+            return {
+                "days": days,
+                "dates": [from_epoch(start_epoch + j * DAY_SECONDS).date().isoformat() for j in range(days)],
+                "heatmap": [
+                    {"hour": i, "day": j, "count": counts[i][j]}
+                    for i in range(24) for j in range(days)
+                ]
+            }
+        except Exception as e:
+            print(f"Error getting activity heatmap: {e}")
+            return {
+                "days": days,
+                "dates": [],
+                "heatmap": [{"hour": i, "day": j, "count": 0} for i in range(24) for j in range(days)]
+            }
+    
+    @staticmethod
+    def _bin_hour_day(epochs: np.ndarray, start_epoch: int, days: int, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Count epoch seconds into a 24 x days grid (start_epoch must be midnight UTC)
+        One bincount over the flattened (hour, day) index; optional weights per epoch
+        """
+        keep = (epochs >= start_epoch) & (epochs < start_epoch + days * DAY_SECONDS)
+        hours = (epochs[keep] - start_epoch) // HOUR_SECONDS
+        day, hour = np.divmod(hours, 24)
+        index = hour * days + day
+        grid = np.bincount(index, weights=weights[keep] if weights is not None else None, minlength=24 * days)
+        return grid.astype(np.int64).reshape(24, days)
+    
+    @staticmethod
+    def _count_sources(start_ts: Optional[str] = None, end_ts: Optional[str] = None) -> Dict[str, int]:
+        """
+        Row counts per source table in [start_ts, end_ts] (all time when unbounded)
+        Uses the source_distribution_counts function, or one count query per table if it is missing
+        """
+        try:
+            row = get_backend().rpc("source_distribution_counts", {"start_ts": start_ts, "end_ts": end_ts}).data[0]
+            return {table: int(row[table] or 0) for table in ("swipes", "wifi_logs", "cctv_frame", "lab_bookings")}
+        except Exception as e:
+            print(f"source_distribution_counts unavailable, counting per table: {e}")
+        
+        counts = {}
+        for table, key_column, time_column in (("swipes", "swipe_id", "timestamp"), ("wifi_logs", "log_id", "timestamp"),
+                                               ("cctv_frame", "frame_id", "timestamp"), ("lab_bookings", "booking_id", "start_time")):
+            query = get_backend().table(table).select(key_column, count="exact")
+            if start_ts:
+                query = query.gte(time_column, start_ts)
+            if end_ts:
+                query = query.lte(time_column, end_ts)
+            response = query.limit(1).execute()
+            counts[table] = response.count if response.count is not None else len(response.data)
+        return counts
+    
+    @staticmethod
+    @coalesced
+    def get_entities_enriched(limit: int = 100, offset: int = 0, status: Optional[str] = None, search: Optional[str] = None,
+                              after: Optional[str] = None) -> Dict[str, Any]:
         """
         Get entities with enriched data including activity status and last seen
         Supports filtering by status and searching by name/email
+        Pass `after` (a previous next_cursor) for keyset pagination
         
         OPTIMIZED: Returns basic profile data quickly without per-entity activity queries
         """
         try:
-            # Get profiles with optional search
-            query = supabase.table("profiles").select("*")
+            now = now_epoch() // STATUS_RESOLUTION_SECONDS * STATUS_RESOLUTION_SECONDS
+            cutoff_active = now - HOUR_SECONDS
+            cutoff_recent = now - 24 * HOUR_SECONDS
             
-            if search:
-                # Search in name, email, or department
-                query = query.or_(f"name.ilike.%{search}%,email.ilike.%{search}%,department.ilike.%{search}%")
-            
-            profiles_response = query.range(offset, offset + limit - 1).execute()
-            profiles = profiles_response.data
+            # Get one page of profiles: by status from the last-seen index, by search from
+            # the search index, or straight from the table (filtering status after enrichment)
+            page = None
+            if status and status != "all":
+                page = DatabaseService._status_page(status, search, limit, offset, after, now)
+            elif search:
+                page = DatabaseService._search_page(search, ("name", "email", "department"), limit, offset, after)
+            if page:
+                profiles, total = page
+            else:
+                query = get_backend().table("profiles").select("*")
+                if search:
+                    query = query.or_(f"name.ilike.%{search}%,email.ilike.%{search}%,department.ilike.%{search}%")
+                profiles = DatabaseService._paginate(query, limit, offset, after).execute().data
+                total = None
             
             # If no profiles, return empty result
             if not profiles:
                 return {
                     "entities": [],
-                    "total": 0,
+                    "total": total or 0,
                     "limit": limit,
-                    "offset": offset
+                    "offset": offset,
+                    "next_cursor": None
                 }
             
-            # Get recent activity for all entities at once (much faster)
-            recent_cutoff = (datetime.now() - timedelta(hours=24)).isoformat()
+            # Latest sighting per entity: from the last-seen index, or a bulk 24h scan while it builds
             entity_ids = [p.get("entity_id") for p in profiles if p.get("entity_id")]
-            
-            # Fetch recent swipes and wifi logs for these entities in bulk
-            recent_swipes = {}
-            recent_wifi = {}
-            
-            try:
-                swipes_data = supabase.table("swipes").select("entity_id, timestamp, location_id").in_("entity_id", entity_ids).gte("timestamp", recent_cutoff).order("timestamp", desc=True).execute()
-                for swipe in swipes_data.data:
-                    eid = swipe.get("entity_id")
-                    if eid and eid not in recent_swipes:
-                        recent_swipes[eid] = swipe
-            except Exception as e:
-                print(f"Error fetching bulk swipes: {e}")
-            
-            try:
-                wifi_data = supabase.table("wifi_logs").select("entity_id, timestamp, ap_id").in_("entity_id", entity_ids).gte("timestamp", recent_cutoff).order("timestamp", desc=True).execute()
-                for wifi in wifi_data.data:
-                    eid = wifi.get("entity_id")
-                    if eid and eid not in recent_wifi:
-                        recent_wifi[eid] = wifi
-            except Exception as e:
-                print(f"Error fetching bulk wifi: {e}")
+            index = serving_last_seen()
+            if index:
+                last_sightings = {entity_id: index.get(entity_id) for entity_id in entity_ids}
+            else:
+                last_sightings = DatabaseService._recent_sightings(entity_ids)
             
             # Enrich each profile with activity data
             enriched_entities = []
-            cutoff_active = datetime.now() - timedelta(hours=1)
-            cutoff_recent = datetime.now() - timedelta(hours=24)
             
             for profile in profiles:
                 entity_id = profile.get("entity_id")
@@ -519,39 +871,16 @@ class DatabaseService:
                 last_location = "Unknown"
                 entity_status = "inactive"
                 
-                # Get most recent activity from bulk data
-                swipe = recent_swipes.get(entity_id)
-                wifi = recent_wifi.get(entity_id)
-                
-                if swipe or wifi:
-                    swipe_time = swipe.get("timestamp") if swipe else None
-                    wifi_time = wifi.get("timestamp") if wifi else None
-                    
-                    # Find most recent
-                    if swipe_time and wifi_time:
-                        if swipe_time > wifi_time:
-                            last_seen = swipe_time
-                            last_location = swipe.get("location_id", "Unknown")
-                        else:
-                            last_seen = wifi_time
-                            last_location = wifi.get("ap_id", "Unknown")
-                    elif swipe_time:
-                        last_seen = swipe_time
-                        last_location = swipe.get("location_id", "Unknown")
-                    elif wifi_time:
-                        last_seen = wifi_time
-                        last_location = wifi.get("ap_id", "Unknown")
+                sighting = last_sightings.get(entity_id)
+                if sighting:
+                    last_seen = sighting["timestamp"]
+                    last_location = sighting["location"]
                     
                     # Determine status
-                    if last_seen:
-                        try:
-                            last_seen_dt = datetime.fromisoformat(last_seen.replace('Z', '+00:00')).replace(tzinfo=None)
-                            if last_seen_dt >= cutoff_active:
-                                entity_status = "active"
-                            elif last_seen_dt >= cutoff_recent:
-                                entity_status = "recent"
-                        except:
-                            pass
+                    if sighting["epoch"] >= cutoff_active:
+                        entity_status = "active"
+                    elif sighting["epoch"] >= cutoff_recent:
+                        entity_status = "recent"
                 
                 # Calculate confidence score (based on data completeness)
                 confidence = 0.5
@@ -576,9 +905,10 @@ class DatabaseService:
             
             return {
                 "entities": enriched_entities,
-                "total": len(enriched_entities),
+                "total": total if total is not None else len(enriched_entities),
                 "limit": limit,
-                "offset": offset
+                "offset": offset,
+                "next_cursor": DatabaseService.next_cursor(profiles, limit)
             }
         except Exception as e:
             print(f"Error in get_entities_enriched: {e}")
@@ -590,38 +920,58 @@ class DatabaseService:
                 "error": str(e)
             }
     
+    @staticmethod
+    def _recent_sightings(entity_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Latest swipe or Wi-Fi sighting in the last 24 hours for each of entity_ids
+        Used while the last-seen index is still being built
+        """
+        recent_cutoff = (datetime.now() - timedelta(hours=24)).isoformat()
+        sightings: Dict[str, Dict[str, Any]] = {}
+        for table, location_column in (("swipes", "location_id"), ("wifi_logs", "ap_id")):
+            try:
+                latest = latest_in(table, "entity_id", entity_ids, 1, columns=f"entity_id, timestamp, {location_column}",
+                                   refine=lambda query: query.gte("timestamp", recent_cutoff), key=EVENT_TABLE_KEYS[table])
+            except Exception as e:
+                print(f"Error fetching bulk {table}: {e}")
+                continue
+            for row in (rows[0] for rows in latest.values() if rows):
+                epoch = to_epoch(row.get("timestamp"))
+                current = sightings.get(row.get("entity_id"))
+                if epoch is not None and (current is None or epoch > current["epoch"]):
+                    sightings[row["entity_id"]] = {
+                        "epoch": epoch,
+                        "timestamp": row["timestamp"],
+                        "location": row.get(location_column) or "Unknown",
+                        "source": table
+                    }
+        return sightings
+    
     @staticmethod
     def get_entity_details(entity_id: str) -> Optional[Dict[str, Any]]:
         """
         Get detailed entity information including profile and recent activity summary
         """
-        # Get profile
-        profile = DatabaseService.get_profile_by_entity_id(entity_id)
-        if not profile:
-            return None
-        
-        # Get activity counts (last 7 days)
+        # Get profile and activity (last 7 days) concurrently
         cutoff_date = (datetime.now() - timedelta(days=7)).isoformat()
+        tasks = DatabaseService._entity_activity_tasks(entity_id, cutoff_date)
+        tasks["profile"] = lambda: DatabaseService.get_profile_by_entity_id(entity_id)
+        sources, errors = fan_out(tasks, default=[])
         
-        swipes = supabase.table("swipes").select("*").eq("entity_id", entity_id).gte("timestamp", cutoff_date).execute()
-        wifi_logs = supabase.table("wifi_logs").select("*").eq("entity_id", entity_id).gte("timestamp", cutoff_date).execute()
-        
-        # Get lab bookings and library checkouts
-        try:
-            lab_bookings = supabase.table("lab_bookings").select("*").eq("entity_id", entity_id).gte("start_time", cutoff_date).execute()
-        except Exception as e:
-            print(f"Error getting lab bookings in details: {e}")
-            lab_bookings = type('obj', (object,), {'data': []})()
+        if "profile" in errors:
+            raise errors["profile"]
+        profile = sources.pop("profile")
+        if not profile:
+            return None
         
-        try:
-            library_checkouts = supabase.table("library_checkouts").select("*").eq("entity_id", entity_id).gte("timestamp", cutoff_date).execute()
-        except Exception as e:
-            print(f"Error getting library checkouts in details: {e}")
-            library_checkouts = type('obj', (object,), {'data': []})() 
+        swipes = sources["swipes"]
+        wifi_logs = sources["wifi_logs"]
+        lab_bookings = sources["lab_bookings"]
+        library_checkouts = sources["library_checkouts"]
         
         # Get latest activity
         all_activities = []
-        for swipe in swipes.data:
+        for swipe in swipes:
             all_activities.append({
                 "timestamp": swipe.get("timestamp"),
                 "type": "swipe",
@@ -629,7 +979,7 @@ class DatabaseService:
                 "details": f"Card swipe at {swipe.get('location_id', 'Unknown Location')}"
             })
         
-        for wifi in wifi_logs.data:
+        for wifi in wifi_logs:
             all_activities.append({
                 "timestamp": wifi.get("timestamp"),
                 "type": "wifi",
@@ -637,15 +987,15 @@ class DatabaseService:
                 "details": f"WiFi connection at {wifi.get('ap_id', 'Unknown AP')}"
             })
         
-        for booking in lab_bookings.data:
+        for booking in lab_bookings:
             all_activities.append({
                 "timestamp": booking.get("start_time"),
                 "type": "booking",
-                "location": booking.get("room_id", "Unknown Room"),
-                "details": f"Lab booking: {booking.get('room_id', 'Unknown Room')}"
+                "location": booking.get("lab_id") or booking.get("room_id", "Unknown Room"),
+                "details": f"Lab booking: {booking.get('lab_id') or booking.get('room_id', 'Unknown Room')}"
             })
         
-        for checkout in library_checkouts.data:
+        for checkout in library_checkouts:
             all_activities.append({
                 "timestamp": checkout.get("timestamp"),
                 "type": "checkout",
@@ -653,21 +1003,17 @@ class DatabaseService:
                 "details": f"Checked out: {checkout.get('book_id', 'Unknown Book')}"
             })
         
-        # Sort activities by timestamp
-        all_activities.sort(key=lambda x: x["timestamp"] if x["timestamp"] else "", reverse=True)
+        # Sort activities by timestamp, parsed once to epochs
+        epochs = to_epoch_array([activity["timestamp"] for activity in all_activities])
+        all_activities = newest_first(all_activities, epochs)
+        latest_epoch = int(epochs.max()) if len(all_activities) else MISSING_EPOCH
         
         # Calculate status
-        if all_activities:
-            latest_time = all_activities[0]["timestamp"]
-            cutoff_active = (datetime.now() - timedelta(hours=1)).isoformat()
-            cutoff_recent = (datetime.now() - timedelta(hours=24)).isoformat()
-            
-            if latest_time >= cutoff_active:
-                status = "active"
-            elif latest_time >= cutoff_recent:
-                status = "recent"
-            else:
-                status = "inactive"
+        now = now_epoch()
+        if latest_epoch >= now - HOUR_SECONDS:
+            status = "active"
+        elif latest_epoch >= now - 24 * HOUR_SECONDS:
+            status = "recent"
         else:
             status = "inactive"
         
@@ -675,103 +1021,126 @@ class DatabaseService:
             "profile": profile,
             "status": status,
             "activity_summary": {
-                "swipes": len(swipes.data),
-                "wifi_connections": len(wifi_logs.data),
-                "lab_bookings": len(lab_bookings.data),
-                "library_checkouts": len(library_checkouts.data),
+                "swipes": len(swipes),
+                "wifi_connections": len(wifi_logs),
+                "lab_bookings": len(lab_bookings),
+                "library_checkouts": len(library_checkouts),
                 "total_activities": len(all_activities)
             },
             "recent_activities": all_activities[:20],  # Return last 20 activities
+            "unavailable_sources": list(errors.keys()),
             "last_seen": all_activities[0]["timestamp"] if all_activities else None,
             "last_location": all_activities[0]["location"] if all_activities else "Unknown"
         }
 
     @staticmethod
-    def generate_security_alerts(status: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
+    @coalesced
+    def generate_security_alerts(status: Optional[str] = None, limit: int = 100, strict: bool = False) -> Dict[str, Any]:
         """
         Generate security alerts based on entity inactivity patterns
+        Alerts are sorted critical first; see scan_security_alerts for the alert logic
+        """
+        return DatabaseService.security_alerts_page(DatabaseService.scan_security_alerts(status, limit, strict), limit)
+    
+    @staticmethod
+    def security_alerts_page(scan: Dict[str, Any], limit: int) -> Dict[str, Any]:
+        """
+        The generate_security_alerts response for `limit` from a scan_security_alerts
+        result with at least as large a limit: the scan stops at the limit-th alert,
+        so its summary counts are the ones recorded with that alert
+        """
+        alerts = scan["alerts"][:limit]
+        if len(scan["alerts"]) > limit:
+            total, active, warning, critical = scan["counters"][limit - 1]
+            summary = {"total_entities": total, "active_entities": active, "warning_entities": warning, "alert_entities": critical}
+        else:
+            summary = dict(scan["summary"])
+        summary["total_alerts"] = len(alerts)
+        
+        # Sort by severity (critical first, then warning)
+        return {
+            "alerts": sorted(alerts, key=lambda x: (0 if x["severity"] == "critical" else 1, x["entity_id"])),
+            "summary": summary
+        }
+    
+    @staticmethod
+    def scan_security_alerts(status: Optional[str] = None, limit: int = 100, strict: bool = False) -> Dict[str, Any]:
+        """
+        Security alerts in profile scan order, before sorting, with the summary
+        counters as they stood when each alert was added (`counters`)
         
         Alert Logic:
         - Active: Last seen within 6 hours
         - Warning: Last seen 6-12 hours ago  
         - Alert: Last seen more than 12 hours ago
         
-        OPTIMIZED: Only fetch recent activity data, not all profiles
+        OPTIMIZED: Last activity comes from the incremental last-seen index; profiles
+        are streamed in keyset pages and the scan stops once `limit` alerts are collected
+        With strict, errors are raised instead of answered with a partial list
         """
         from datetime import datetime, timedelta
         
         now = datetime.now()
-        warning_cutoff = (now - timedelta(hours=6)).isoformat()
-        alert_cutoff = (now - timedelta(hours=12)).isoformat()
+        now_seconds = to_epoch(now)
+        warning_cutoff = now_seconds - 6 * HOUR_SECONDS
+        alert_cutoff = now_seconds - 12 * HOUR_SECONDS
         
         alerts = []
+        # (scanned, active, warning, critical) counts as of each alert
+        counters = []
+        scanned_count = 0
         active_count = 0
         warning_count = 0
         alert_count = 0
         
         try:
-            # Get all recent swipes and wifi logs (last 24 hours) - much faster than querying per entity
-            recent_cutoff = (now - timedelta(hours=24)).isoformat()
-            
-            recent_swipes = supabase.table("swipes").select("entity_id, timestamp").gte("timestamp", recent_cutoff).order("timestamp", desc=True).execute()
-            recent_wifi = supabase.table("wifi_logs").select("entity_id, timestamp").gte("timestamp", recent_cutoff).order("timestamp", desc=True).execute()
-            
-            # Build a map of entity_id -> latest activity time
-            entity_last_activity = {}
-            
-            for swipe in recent_swipes.data:
-                entity_id = swipe.get("entity_id")
-                timestamp = swipe.get("timestamp")
-                if entity_id and timestamp:
-                    if entity_id not in entity_last_activity or timestamp > entity_last_activity[entity_id]:
-                        entity_last_activity[entity_id] = timestamp
-            
-            for wifi in recent_wifi.data:
-                entity_id = wifi.get("entity_id")
-                timestamp = wifi.get("timestamp")
-                if entity_id and timestamp:
-                    if entity_id not in entity_last_activity or timestamp > entity_last_activity[entity_id]:
-                        entity_last_activity[entity_id] = timestamp
-            
-            # Get a sample of profiles for alert generation
-            all_profiles = DatabaseService.get_all_profiles(limit=min(limit * 10, 1000))
+            # Latest activity per entity from the last-seen index; while it builds, stream the
+            # last 24 hours of swipes and wifi logs into a map instead
+            index = serving_last_seen()
+            if index:
+                last_sighting = index.get
+            else:
+                recent_cutoff = (now - timedelta(hours=24)).isoformat()
+                entity_last_activity = {}
+                for table in ("swipes", "wifi_logs"):
+                    for row in DatabaseService.stream_window(table, "entity_id, timestamp", recent_cutoff):
+                        entity_id = row.get("entity_id")
+                        epoch = to_epoch(row.get("timestamp"))
+                        if entity_id and epoch is not None:
+                            if entity_id not in entity_last_activity or epoch > entity_last_activity[entity_id]["epoch"]:
+                                entity_last_activity[entity_id] = {"epoch": epoch, "timestamp": row["timestamp"], "location": "Unknown"}
+                last_sighting = entity_last_activity.get
             
-            for profile in all_profiles:
+            # Stream profiles page by page until enough alerts are collected
+            for profile in DatabaseService.iter_profiles():
+                scanned_count += 1
                 entity_id = profile.get("entity_id")
                 
-                # Check if entity has recent activity from our cached map
-                last_activity_time = entity_last_activity.get(entity_id)
-                
-                if last_activity_time:
-                    try:
-                        last_activity_dt = datetime.fromisoformat(last_activity_time.replace('Z', '+00:00')).replace(tzinfo=None)
-                    except:
-                        last_activity_dt = None
-                else:
-                    last_activity_dt = None
+                sighting = last_sighting(entity_id)
+                last_activity_time = sighting["timestamp"] if sighting else None
+                last_epoch = sighting["epoch"] if sighting else None
                 
                 # Determine alert level based on last activity
-                if last_activity_dt is None:
-                    # No activity in last 24 hours - check if entity is truly inactive
-                    # For demo purposes, only count as critical if no activity at all
+                if last_epoch is None:
+                    # Never seen (or, while the index builds, not seen in the last 24 hours)
                     alert_level = "critical"
                     hours_inactive = "24+"
                     alert_count += 1
-                elif last_activity_dt >= datetime.fromisoformat(warning_cutoff):
+                elif last_epoch >= warning_cutoff:
                     # Active within 6 hours
                     alert_level = "active"
-                    hours_inactive = int((now - last_activity_dt).total_seconds() / 3600)
+                    hours_inactive = (now_seconds - last_epoch) // HOUR_SECONDS
                     active_count += 1
                     continue  # Don't create alert for active entities
-                elif last_activity_dt >= datetime.fromisoformat(alert_cutoff):
+                elif last_epoch >= alert_cutoff:
                     # Warning: 6-12 hours inactive
                     alert_level = "warning"
-                    hours_inactive = int((now - last_activity_dt).total_seconds() / 3600)
+                    hours_inactive = (now_seconds - last_epoch) // HOUR_SECONDS
                     warning_count += 1
                 else:
                     # Alert: More than 12 hours inactive
                     alert_level = "critical"
-                    hours_inactive = int((now - last_activity_dt).total_seconds() / 3600)
+                    hours_inactive = (now_seconds - last_epoch) // HOUR_SECONDS
                     alert_count += 1
                 
                 # Create alert entry
@@ -781,7 +1150,7 @@ class DatabaseService:
                     "alert_type": "Inactivity Alert",
                     "severity": alert_level,
                     "description": f"Entity inactive for {hours_inactive} hours" if isinstance(hours_inactive, int) else "No recent activity",
-                    "location": "Unknown",
+                    "location": sighting["location"] if sighting else "Unknown",
                     "timestamp": now.isoformat(),
                     "status": "active",
                     "profile": profile,
@@ -794,6 +1163,7 @@ class DatabaseService:
                     continue
                 
                 alerts.append(alert)
+                counters.append((scanned_count, active_count, warning_count, alert_count))
                 
                 # Limit number of alerts returned
                 if len(alerts) >= limit:
@@ -801,15 +1171,14 @@ class DatabaseService:
                     
         except Exception as e:
             print(f"Error in generate_security_alerts: {e}")
+            if strict:
+                raise
             import traceback
             traceback.print_exc()
         
-        # Sort by severity (critical first, then warning)
-        alerts.sort(key=lambda x: (0 if x["severity"] == "critical" else 1, x["entity_id"]))
-        
         # Add summary statistics
         summary = {
-            "total_entities": len(all_profiles),
+            "total_entities": scanned_count,
             "active_entities": active_count,
             "warning_entities": warning_count,
             "alert_entities": alert_count,
@@ -817,10 +1186,63 @@ class DatabaseService:
         }
         
         return {
-            "alerts": alerts[:limit],
+            "alerts": alerts,
+            "counters": counters,
             "summary": summary
         }
 
+    @staticmethod
+    @coalesced
+    def get_inactive_entities(hours: int = 12, limit: int = 50) -> Dict[str, Any]:
+        """
+        Detect entities that have not been observed in swipe or Wi-Fi logs for `hours`
+        Entities seen since the cutoff come from the last-seen index, so only they are
+        touched; profiles are streamed until `limit` inactive entities are found
+        """
+        now = datetime.now()
+        cutoff_time = now - timedelta(hours=hours)
+        inactive_entities = []
+        
+        try:
+            index = serving_last_seen()
+            if index:
+                active_entities = set(index.seen_since(to_epoch(cutoff_time)))
+                last_sighting = index.get
+            else:
+                active_entities = set()
+                for table in ("swipes", "wifi_logs"):
+                    for row in DatabaseService.stream_window(table, "entity_id", cutoff_time.isoformat()):
+                        active_entities.add(row.get("entity_id"))
+                last_sighting = lambda entity_id: None
+            
+            for profile in DatabaseService.iter_profiles(columns="entity_id, name, email, department"):
+                entity_id = profile.get("entity_id")
+                if entity_id in active_entities:
+                    continue
+                
+                sighting = last_sighting(entity_id)
+                inactive_entities.append({
+                    "entity_id": entity_id,
+                    "name": profile.get("name", "Unknown"),
+                    "email": profile.get("email"),
+                    "department": profile.get("department"),
+                    "last_seen": sighting["timestamp"] if sighting else None,
+                    "last_location": sighting["location"] if sighting else "Unknown",
+                    "hours_inactive": (to_epoch(now) - sighting["epoch"]) // HOUR_SECONDS if sighting else hours,
+                    "alert_severity": "high" if hours >= 24 else "medium"
+                })
+                if len(inactive_entities) >= limit:
+                    break
+        except Exception as e:
+            print(f"Error in get_inactive_entities: {e}")
+        
+        return {
+            "cutoff_time": cutoff_time.isoformat(),
+            "hours_threshold": hours,
+            "total_inactive": len(inactive_entities),
+            "inactive_entities": inactive_entities
+        }
+
     @staticmethod
     def populate_test_activity_data():
         """Populate test activity data for demonstration"""
@@ -834,7 +1256,8 @@ class DatabaseService:
                 return {"error": "No profiles found"}
             
             now = datetime.now()
-            activities_created = 0
+            swipe_rows = []
+            wifi_rows = []
             
             for i, profile in enumerate(profiles[:50]):  # Create data for first 50 entities
                 entity_id = profile.get("entity_id")
@@ -851,28 +1274,31 @@ class DatabaseService:
                     activity_time = now - timedelta(hours=random.randint(13, 48))
                 
                 # Create swipe record
-                swipe_data = {
+                swipe_rows.append({
                     "identity": entity_id,
+                    "entity_id": entity_id,
                     "card_id": profile.get("card_id", f"CARD_{i}"),
                     "location_id": f"LOC_{random.randint(1, 10)}",
                     "timestamp": activity_time.isoformat()
-                }
-                
-                response = supabase.table("swipes").insert(swipe_data).execute()
-                if response.data:
-                    activities_created += 1
+                })
                 
                 # Sometimes add WiFi activity too
                 if random.random() > 0.5:
-                    wifi_data = {
+                    wifi_rows.append({
                         "identity": entity_id,
+                        "entity_id": entity_id,
                         "device_hash": profile.get("device_hash", f"DH_{i}"),
                         "ap_id": f"AP_{random.randint(1, 5)}",
                         "timestamp": (activity_time + timedelta(minutes=random.randint(1, 30))).isoformat()
-                    }
-                    wifi_response = supabase.table("wifi_logs").insert(wifi_data).execute()
-                    if wifi_response.data:
-                        activities_created += 1
+                    })
+            
+            # One batched insert per table
+            activities_created = 0
+            for table, rows in (("swipes", swipe_rows), ("wifi_logs", wifi_rows)):
+                if rows:
+                    stored = write_batch(table, rows)
+                    notify_indexes(table, stored)
+                    activities_created += len(stored)
             
             return {
                 "success": True,
@@ -888,7 +1314,7 @@ class DatabaseService:
         """
         Get alerts from the public.alerts table
         """
-        query = supabase.table("alerts").select("*")
+        query = get_backend().table("alerts").select("*")
         if status:
             query = query.eq("status", status)
         response = query.limit(limit).execute()
@@ -899,7 +1325,7 @@ class DatabaseService:
         """
         Get alert for a specific entity
         """
-        response = supabase.table("alerts").select("*").eq("entity_id", entity_id).execute()
+        response = get_backend().table("alerts").select("*").eq("entity_id", entity_id).execute()
         return response.data[0] if response.data else None
     
     @staticmethod
@@ -907,10 +1333,10 @@ class DatabaseService:
         """
         Update alert status
         """
-        response = supabase.table("alerts").update({"status": status}).eq("entity_id", entity_id).execute()
+        response = get_backend().table("alerts").update({"status": status}).eq("entity_id", entity_id).execute()
         return response.data[0] if response.data else None
-        total_profiles = supabase.table("profiles").select("entity_id", count="exact").execute()
-        recent_swipes = supabase.table("swipes").select("*").order("timestamp", desc=True).limit(100).execute()
+        total_profiles = get_backend().table("profiles").select("entity_id", count="exact").execute()
+        recent_swipes = get_backend().table("swipes").select("*").order("timestamp", desc=True).limit(100).execute()
         
         return {
             "total_entities": total_profiles.count if hasattr(total_profiles, 'count') else 0,
@@ -925,53 +1351,80 @@ class DatabaseService:
         Get timeline data for a specific entity from the timeline table
         """
         try:
-            response = supabase.table("timeline").select("*").eq("entity_id", entity_id).execute()
+            response = get_backend().table("timeline").select("*").eq("entity_id", entity_id).execute()
             
             if not response.data or len(response.data) == 0:
                 return None
             
-            timeline_data = response.data[0]
-            
-            # Parse the arrays and create structured timeline
-            detection_types = timeline_data.get("detection_types", [])
-            locations = timeline_data.get("locations", [])
-            timestamps = timeline_data.get("timestamps", [])
-            
-            # Create timeline activities
-            activities = []
-            for i in range(len(timestamps)):
-                detection_type = detection_types[i] if i < len(detection_types) else "unknown"
-                location = locations[i] if i < len(locations) else "Unknown"
-                timestamp = timestamps[i]
-                
-                # Create human-readable description
-                description = DatabaseService._get_activity_description(detection_type, location)
-                
-                activities.append({
-                    "timestamp": timestamp,
-                    "location": location,
-                    "detection_type": detection_type,
-                    "description": description
-                })
-            
-            # Sort by timestamp descending (most recent first)
-            activities.sort(key=lambda x: x["timestamp"], reverse=True)
-            
-            # Get current location (most recent activity)
-            current_location = activities[0]["location"] if activities else "Unknown"
-            last_seen = activities[0]["timestamp"] if activities else None
-            
-            return {
-                "entity_id": entity_id,
-                "current_location": current_location,
-                "last_seen": last_seen,
-                "activities": activities
-            }
+            return DatabaseService._build_timeline(entity_id, response.data[0])
             
         except Exception as e:
             print(f"Error getting entity timeline: {e}")
             return None
     
+    @staticmethod
+    def get_entity_timelines(entity_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Get timeline data for many entities in chunked concurrent queries
+        Returns a map of entity_id -> timeline (entities without a timeline are omitted)
+        """
+        if not entity_ids:
+            return {}
+        try:
+            rows = lookup_in("timeline", "entity_id", entity_ids)
+        except Exception as e:
+            print(f"Error getting bulk entity timelines: {e}")
+            return {}
+        
+        timelines = {}
+        for row in rows:
+            entity_id = row.get("entity_id")
+            if entity_id and entity_id not in timelines:
+                timelines[entity_id] = DatabaseService._build_timeline(entity_id, row)
+        return timelines
+    
+    @staticmethod
+    def _build_timeline(entity_id: str, timeline_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Parse a timeline row's parallel arrays into a structured, most-recent-first timeline
+        """
+        detection_types = timeline_data.get("detection_types") or []
+        locations = timeline_data.get("locations") or []
+        timestamps = timeline_data.get("timestamps") or []
+        
+        # Create timeline activities; timestamps are parsed once and kept as epochs
+        epochs = to_epoch_array(timestamps)
+        activities = []
+        for i in range(len(timestamps)):
+            detection_type = detection_types[i] if i < len(detection_types) else "unknown"
+            location = locations[i] if i < len(locations) else "Unknown"
+            timestamp = timestamps[i]
+            
+            # Create human-readable description
+            description = DatabaseService._get_activity_description(detection_type, location)
+            
+            activities.append({
+                "timestamp": timestamp,
+                "epoch": int(epochs[i]) if epochs[i] != MISSING_EPOCH else None,
+                "location": location,
+                "detection_type": detection_type,
+                "description": description
+            })
+        
+        # Sort by time descending (most recent first)
+        activities = newest_first(activities, epochs)
+        
+        # Get current location (most recent activity)
+        current_location = activities[0]["location"] if activities else "Unknown"
+        last_seen = activities[0]["timestamp"] if activities else None
+        
+        return {
+            "entity_id": entity_id,
+            "current_location": current_location,
+            "last_seen": last_seen,
+            "activities": activities
+        }
+    
     @staticmethod
     def _get_activity_description(detection_type: str, location: str) -> str:
         """
@@ -988,31 +1441,40 @@ class DatabaseService:
         return type_descriptions.get(detection_type, f"Activity at {location}")
     
     @staticmethod
-    def get_all_entities_with_timeline(limit: int = 100, offset: int = 0, search: Optional[str] = None) -> Dict[str, Any]:
+    def get_all_entities_with_timeline(limit: int = 100, offset: int = 0, search: Optional[str] = None,
+                                       after: Optional[str] = None) -> Dict[str, Any]:
         """
         Get all entities with their profile and timeline data
+        Pass `after` (a previous next_cursor) for keyset pagination; cursor pages
+        skip the total count so deep pages stay as cheap as the first
+        
+        OPTIMIZED: The profile page (with its total count) plus one bulk timeline
+        lookup, split into concurrent bounded in_() chunks for large pages
         """
         try:
-            # Get profiles
-            query = supabase.table("profiles").select("*")
-            
-            if search:
-                query = query.or_(f"name.ilike.%{search}%,entity_id.ilike.%{search}%,email.ilike.%{search}%")
-            
-            profiles_response = query.range(offset, offset + limit - 1).execute()
+            # Get profiles; the total comes back with the page. "estimated" is exact
+            # for small tables and falls back to the planner estimate for large ones
+            page = DatabaseService._search_page(search, ("name", "entity_id", "email"), limit, offset, after) if search else None
+            if page:
+                # The search index knows the exact number of matches
+                profiles, match_count = page
+            else:
+                query = get_backend().table("profiles").select("*", count="estimated" if after is None else None)
+                if search:
+                    query = query.or_(f"name.ilike.%{search}%,entity_id.ilike.%{search}%,email.ilike.%{search}%")
+                profiles_response = DatabaseService._paginate(query, limit, offset, after).execute()
+                profiles = profiles_response.data
+                match_count = profiles_response.count
             
-            # Get count
-            count_query = supabase.table("profiles").select("entity_id", count="exact")
-            if search:
-                count_query = count_query.or_(f"name.ilike.%{search}%,entity_id.ilike.%{search}%,email.ilike.%{search}%")
-            count_response = count_query.execute()
+            # Get timelines for the whole page at once
+            timelines = DatabaseService.get_entity_timelines(
+                [p.get("entity_id") for p in profiles if p.get("entity_id")]
+            )
             
             entities = []
-            for profile in profiles_response.data:
+            for profile in profiles:
                 entity_id = profile.get("entity_id")
-                
-                # Get timeline for this entity
-                timeline = DatabaseService.get_entity_timeline(entity_id)
+                timeline = timelines.get(entity_id)
                 
                 entity_data = {
                     "entity_id": entity_id,
@@ -1028,11 +1490,20 @@ class DatabaseService:
                 
                 entities.append(entity_data)
             
+            # A short page pins the total exactly, whatever the estimate says
+            if after is not None:
+                total = None
+            elif len(profiles) < limit and (profiles or offset == 0):
+                total = offset + len(profiles)
+            else:
+                total = match_count if match_count is not None else offset + len(entities)
+            
             return {
                 "entities": entities,
-                "total": count_response.count if hasattr(count_response, 'count') else len(entities),
+                "total": total,
                 "limit": limit,
-                "offset": offset
+                "offset": offset,
+                "next_cursor": DatabaseService.next_cursor(profiles, limit)
             }
             
         except Exception as e:
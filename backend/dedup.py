@@ -0,0 +1,244 @@
+"""
+Profile Deduplication
+Offline job that finds profiles describing the same person: candidate pairs
+come from shared blocking keys (exact identifiers, name tokens, email local
+part), are scored in a process pool with EntityResolver's weighted rules,
+and matches are merged into clusters with union-find
+
+    python dedup.py [--output dedup_report.json] [--workers N] [--min-confidence 0.25]
+"""
+
+import os
+import json
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from identifiers import INDEXED_COLUMNS, IDENTIFIER_FIELDS
+
+# Lowest EntityResolver confidence that counts as a duplicate; the default needs
+# two pieces of evidence (two identifiers, or an identifier and a similar name)
+DEDUP_MIN_CONFIDENCE = float(os.getenv("DEDUP_MIN_CONFIDENCE", "0.25"))
+
+# Scoring processes; 1 scores in this process
+DEDUP_WORKERS = int(os.getenv("DEDUP_WORKERS", str(os.cpu_count() or 1)))
+
+# Blocks larger than this (a common first name, a placeholder identifier) carry
+# too little evidence to pair all their members and are skipped
+DEDUP_MAX_BLOCK_SIZE = int(os.getenv("DEDUP_MAX_BLOCK_SIZE", "200"))
+
+# Candidate pairs sent to a worker per task
+DEDUP_PAIRS_PER_TASK = 20000
+
+# Most a shared blocking key can add to a pair's match score (EntityResolver._score_profile)
+KEY_WEIGHTS = {"card_id": 0.25, "device_hash": 0.20, "face_id": 0.20, "student_id": 0.15, "email": 0.15,
+               "name": 0.0, "email_local": 0.0}
+NAME_WEIGHT = 0.20
+MAX_MATCH_SCORE = 1.15
+
+
+def blocking_keys(profile: Dict[str, Any]) -> Iterable[Tuple[str, str]]:
+    """(kind, value) keys shared by profiles worth comparing"""
+    for field in IDENTIFIER_FIELDS:
+        if profile.get(field):
+            yield field, profile[field]
+    # A name similarity of 0.7 needs a shared token, so token blocks find every name match
+    for token in set((profile.get("name") or "").lower().split()):
+        yield "name", token
+    local = (profile.get("email") or "").split("@")[0].strip().lower()
+    if local:
+        yield "email_local", local
+
+
+def candidate_pairs(profiles: List[Dict[str, Any]], min_confidence: float = DEDUP_MIN_CONFIDENCE,
+                    max_block_size: int = DEDUP_MAX_BLOCK_SIZE) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """
+    Index pairs (a < b) of profiles sharing a blocking key, and block statistics
+    Pairs whose shared keys cannot reach min_confidence even with a perfect name
+    match are dropped before scoring.
+    """
+    blocks: Dict[Tuple[str, str], List[int]] = {}
+    for position, profile in enumerate(profiles):
+        for key in blocking_keys(profile):
+            blocks.setdefault(key, []).append(position)
+
+    stats: Dict[str, Dict[str, int]] = {kind: {"blocks": 0, "skipped": 0} for kind in KEY_WEIGHTS}
+    codes, weights = [], []
+    n = len(profiles)
+    # Pairs sharing only name keys cannot outscore a perfect name match; other pairs come from identifier blocks
+    name_only = NAME_WEIGHT / MAX_MATCH_SCORE >= min_confidence - 1e-9
+    for (kind, _), members in blocks.items():
+        if len(members) < 2 or (not KEY_WEIGHTS[kind] and not name_only):
+            continue
+        if len(members) > max_block_size:
+            stats[kind]["skipped"] += 1
+            continue
+        stats[kind]["blocks"] += 1
+        members = np.asarray(members, dtype=np.int64)
+        first, second = np.triu_indices(len(members), k=1)
+        codes.append(members[first] * n + members[second])
+        weights.append(np.full(len(first), KEY_WEIGHTS[kind]))
+    if not codes:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), {"blocks": stats, "candidate_pairs": 0}
+
+    codes, inverse = np.unique(np.concatenate(codes), return_inverse=True)
+    bound = np.bincount(inverse, weights=np.concatenate(weights)) + NAME_WEIGHT
+    kept = codes[bound / MAX_MATCH_SCORE >= min_confidence - 1e-9]
+    return kept // n, kept % n, {"blocks": stats, "candidate_pairs": len(codes)}
+
+
+# Profiles scored by this worker process, set once by _init_worker
+_worker_profiles: List[Dict[str, Any]] = []
+
+
+def _init_worker(profiles: List[Dict[str, Any]]):
+    global _worker_profiles
+    _worker_profiles = profiles
+
+
+def _score_pairs(first: np.ndarray, second: np.ndarray, min_confidence: float) -> List[Dict[str, Any]]:
+    """Matches among index pairs of _worker_profiles, scored as resolving one profile's identifiers against the other"""
+    from entity_resolution import EntityResolver
+    matches = []
+    for a, b in zip(first.tolist(), second.tolist()):
+        query, profile = _worker_profiles[a], _worker_profiles[b]
+        candidate = EntityResolver._score_profile(
+            profile, query.get("name"), query.get("email"), query.get("card_id"),
+            query.get("device_hash"), query.get("face_id"), query.get("student_id")
+        )
+        if candidate and candidate["confidence"] >= min_confidence:
+            matches.append({
+                "pair": (a, b),
+                "confidence": round(candidate["confidence"], 4),
+                "matched_fields": candidate["matched_fields"],
+                "evidence": candidate["evidence"]
+            })
+    return matches
+
+
+def score_pairs(profiles: List[Dict[str, Any]], first: np.ndarray, second: np.ndarray,
+                min_confidence: float = DEDUP_MIN_CONFIDENCE, workers: int = DEDUP_WORKERS) -> List[Dict[str, Any]]:
+    """Matching pairs, scored DEDUP_PAIRS_PER_TASK at a time across `workers` processes"""
+    tasks = [(first[start:start + DEDUP_PAIRS_PER_TASK], second[start:start + DEDUP_PAIRS_PER_TASK], min_confidence)
+             for start in range(0, len(first), DEDUP_PAIRS_PER_TASK)]
+    if workers <= 1 or len(tasks) <= 1:
+        _init_worker(profiles)
+        return [match for task in tasks for match in _score_pairs(*task)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(profiles,)) as pool:
+        return [match for matches in pool.map(_score_pairs, *zip(*tasks)) for match in matches]
+
+
+class UnionFind:
+    """Disjoint sets over 0..size-1 with path halving and union by size"""
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def find(self, item: int) -> int:
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+def cluster_matches(profiles: List[Dict[str, Any]], matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Clusters of two or more profiles joined by matches, largest first, each with the matches as evidence"""
+    sets = UnionFind(len(profiles))
+    for match in matches:
+        sets.union(*match["pair"])
+
+    clusters: Dict[int, Dict[str, Any]] = {}
+    for match in matches:
+        a, b = match["pair"]
+        cluster = clusters.setdefault(sets.find(a), {"members": set(), "matches": []})
+        cluster["members"].update((a, b))
+        cluster["matches"].append({
+            "entity_ids": [profiles[a].get("entity_id"), profiles[b].get("entity_id")],
+            "confidence": match["confidence"],
+            "matched_fields": match["matched_fields"],
+            "evidence": match["evidence"]
+        })
+
+    report = []
+    for cluster in clusters.values():
+        members = sorted(cluster["members"], key=lambda position: profiles[position].get("entity_id"))
+        cluster["matches"].sort(key=lambda m: m["confidence"], reverse=True)
+        report.append({
+            "entity_ids": [profiles[position].get("entity_id") for position in members],
+            "names": sorted({profiles[position].get("name") for position in members if profiles[position].get("name")}),
+            "size": len(members),
+            "max_confidence": cluster["matches"][0]["confidence"],
+            "matches": cluster["matches"]
+        })
+    report.sort(key=lambda c: (-c["size"], -c["max_confidence"], c["entity_ids"][0]))
+    for number, cluster in enumerate(report, 1):
+        cluster["cluster_id"] = number
+    return report
+
+
+def find_duplicates(profiles: Optional[List[Dict[str, Any]]] = None, min_confidence: float = DEDUP_MIN_CONFIDENCE,
+                    workers: int = DEDUP_WORKERS, max_block_size: int = DEDUP_MAX_BLOCK_SIZE) -> Dict[str, Any]:
+    """Full deduplication pass over `profiles` (default: every profile); returns the JSON report"""
+    started = time.time()
+    timings: Dict[str, float] = {}
+    if profiles is None:
+        from database import DatabaseService
+        profiles = list(DatabaseService.iter_profiles(columns=", ".join(INDEXED_COLUMNS)))
+        timings["load_seconds"] = round(time.time() - started, 3)
+
+    step = time.time()
+    first, second, blocking = candidate_pairs(profiles, min_confidence, max_block_size)
+    timings["blocking_seconds"] = round(time.time() - step, 3)
+
+    step = time.time()
+    matches = score_pairs(profiles, first, second, min_confidence, workers)
+    timings["scoring_seconds"] = round(time.time() - step, 3)
+
+    clusters = cluster_matches(profiles, matches)
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "profiles": len(profiles),
+        "min_confidence": min_confidence,
+        "workers": workers,
+        "max_block_size": max_block_size,
+        "blocks": blocking["blocks"],
+        "candidate_pairs": blocking["candidate_pairs"],
+        "scored_pairs": len(first),
+        "matched_pairs": len(matches),
+        "duplicate_profiles": sum(cluster["size"] for cluster in clusters),
+        "cluster_sizes": dict(sorted(Counter(cluster["size"] for cluster in clusters).items())),
+        "seconds": {**timings, "total_seconds": round(time.time() - started, 3)},
+        "clusters": clusters
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find duplicate profiles and write a JSON cluster report")
+    parser.add_argument("--output", default="dedup_report.json", help="report path, - for stdout")
+    parser.add_argument("--workers", type=int, default=DEDUP_WORKERS)
+    parser.add_argument("--min-confidence", type=float, default=DEDUP_MIN_CONFIDENCE)
+    parser.add_argument("--max-block-size", type=int, default=DEDUP_MAX_BLOCK_SIZE)
+    args = parser.parse_args()
+
+    result = find_duplicates(min_confidence=args.min_confidence, workers=args.workers, max_block_size=args.max_block_size)
+    if args.output == "-":
+        print(json.dumps(result, indent=2, default=str))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+        print(f"{result['profiles']} profiles, {result['scored_pairs']} pairs scored, "
+              f"{len(result['clusters'])} clusters ({result['duplicate_profiles']} profiles) -> {args.output}")
@@ -3,11 +3,26 @@ Advanced Entity Resolution Module
 Implements multi-identifier matching, fuzzy name matching, and confidence scoring
 """
 
-from typing import Optional, Dict, Any, List
+import os
+import json
+from typing import Optional, Dict, Any, AsyncIterator, List, Tuple
 from datetime import datetime, timedelta
-from difflib import SequenceMatcher
 import re
-from database import supabase, DatabaseService
+from pydantic import ValidationError
+from models import ResolveQuery
+from database import DatabaseService, get_backend
+from concurrency import fan_out, run_db
+from identifiers import INDEXED_COLUMNS, IdentifierIndex, serving_identifier_index
+from similarity import prepare_name, name_similarity, weighted_similarity
+
+# Identifiers accepted by resolve_entity, in its argument order
+RESOLVE_FIELDS = ("name", "email", "card_id", "device_hash", "face_id", "student_id")
+
+# Best match plus alternatives returned per resolution
+RESOLVE_RETURNED_CANDIDATES = 5
+
+# Queries resolved per worker call in a batch request
+RESOLVE_BATCH_ROWS = int(os.getenv("RESOLVE_BATCH_ROWS", "5000"))
 
 
 class EntityResolver:
@@ -18,30 +33,13 @@ class EntityResolver:
         """
         Calculate similarity between two names using multiple algorithms
         Returns a score between 0 and 1
+        
+        0.6 x SequenceMatcher ratio + 0.4 x token Jaccard (handles name order
+        variations); names are normalized once and cached
         """
         if not name1 or not name2:
             return 0.0
-        
-        name1 = name1.lower().strip()
-        name2 = name2.lower().strip()
-        
-        # Exact match
-        if name1 == name2:
-            return 1.0
-        
-        # Sequence matcher for overall similarity
-        seq_sim = SequenceMatcher(None, name1, name2).ratio()
-        
-        # Token-based matching (handles name order variations)
-        tokens1 = set(name1.split())
-        tokens2 = set(name2.split())
-        if tokens1 and tokens2:
-            token_sim = len(tokens1 & tokens2) / len(tokens1 | tokens2)
-        else:
-            token_sim = 0.0
-        
-        # Combine scores with weights
-        return (seq_sim * 0.6 + token_sim * 0.4)
+        return name_similarity(name1, name2)
     
     @staticmethod
     def resolve_entity(
@@ -64,83 +62,17 @@ class EntityResolver:
         - name fuzzy match: up to 0.20 (based on similarity)
         """
         try:
-            candidates = []
+            # Score only profiles sharing an identifier or a similar name, via the identifier
+            # index; scan the whole table while it is being built
+            index = serving_identifier_index()
+            candidates = EntityResolver._rank_candidates(index, name, email, card_id, device_hash, face_id, student_id)
             
-            # Get all profiles for matching
-            all_profiles = supabase.table("profiles").select("*").execute()
+            # Indexed candidates carry only identifiers: load full rows for the ones returned
+            if index:
+                for candidate in candidates[:RESOLVE_RETURNED_CANDIDATES]:
+                    candidate["profile"] = DatabaseService.get_profile_by_entity_id(candidate["entity_id"]) or candidate["profile"]
             
-            for profile in all_profiles.data:
-                match_score = 0.0
-                matched_fields = []
-                evidence = []
-                
-                # Exact matches (high confidence)
-                if card_id and profile.get("card_id") == card_id:
-                    match_score += 0.25
-                    matched_fields.append("card_id")
-                    evidence.append(f"Card ID exact match: {card_id}")
-                
-                if device_hash and profile.get("device_hash") == device_hash:
-                    match_score += 0.20
-                    matched_fields.append("device_hash")
-                    evidence.append(f"Device hash exact match: {device_hash[:10]}...")
-                
-                if face_id and profile.get("face_id") == face_id:
-                    match_score += 0.20
-                    matched_fields.append("face_id")
-                    evidence.append(f"Face ID exact match: {face_id}")
-                
-                if student_id and profile.get("student_id") == student_id:
-                    match_score += 0.15
-                    matched_fields.append("student_id")
-                    evidence.append(f"Student ID exact match: {student_id}")
-                
-                if email and profile.get("email") == email:
-                    match_score += 0.15
-                    matched_fields.append("email")
-                    evidence.append(f"Email exact match: {email}")
-                
-                # Fuzzy name matching
-                if name and profile.get("name"):
-                    name_sim = EntityResolver.calculate_name_similarity(name, profile.get("name"))
-                    if name_sim >= 0.7:  # Only consider if similarity is high enough
-                        name_match_score = name_sim * 0.20
-                        match_score += name_match_score
-                        matched_fields.append("name_fuzzy")
-                        evidence.append(f"Name similarity: {name_sim:.2%} - '{name}' ≈ '{profile.get('name')}'")
-                
-                # Only add if we have some match
-                if match_score > 0:
-                    # Normalize to 0-1 range (max possible score is 1.15)
-                    confidence = min(match_score / 1.15, 1.0)
-                    
-                    candidates.append({
-                        "entity_id": profile.get("entity_id"),
-                        "profile": profile,
-                        "confidence": confidence,
-                        "matched_fields": matched_fields,
-                        "evidence": evidence,
-                        "match_score": match_score
-                    })
-            
-            # Sort by confidence score
-            candidates.sort(key=lambda x: x["confidence"], reverse=True)
-            
-            if not candidates:
-                return {
-                    "success": False,
-                    "message": "No matching entities found",
-                    "candidates": []
-                }
-            
-            # Return top candidate and alternatives
-            return {
-                "success": True,
-                "best_match": candidates[0],
-                "alternatives": candidates[1:5] if len(candidates) > 1 else [],
-                "total_candidates": len(candidates),
-                "resolution_method": "multi_identifier_fuzzy"
-            }
+            return EntityResolver._resolution(candidates)
             
         except Exception as e:
             print(f"Error in entity resolution: {e}")
@@ -150,13 +82,219 @@ class EntityResolver:
                 "candidates": []
             }
     
+    @staticmethod
+    def resolve_batch(queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Resolve many identifier tuples (RESOLVE_FIELDS dicts) against one identifier index
+        Returns one resolve_entity-shaped result per query, in input order. Repeated
+        tuples are scored once, and the full profiles of every returned candidate
+        are fetched in a single bulk lookup.
+        """
+        # While the shared index builds, take one private snapshot for the whole batch
+        index = serving_identifier_index() or EntityResolver._snapshot_index()
+        
+        ranked: Dict[tuple, Any] = {}
+        for query in queries:
+            key = tuple(query.get(field) or None for field in RESOLVE_FIELDS)
+            if key in ranked or not any(key):
+                continue
+            try:
+                ranked[key] = EntityResolver._rank_candidates(index, *key)
+            except Exception as e:
+                print(f"Error in batch entity resolution: {e}")
+                ranked[key] = e
+        
+        returned = sorted({
+            candidate["entity_id"]
+            for candidates in ranked.values() if isinstance(candidates, list)
+            for candidate in candidates[:RESOLVE_RETURNED_CANDIDATES]
+        })
+        profiles = {profile["entity_id"]: profile for profile in DatabaseService.get_profiles_by_entity_ids(returned)}
+        
+        results = []
+        for query in queries:
+            key = tuple(query.get(field) or None for field in RESOLVE_FIELDS)
+            candidates = ranked.get(key)
+            if candidates is None:
+                results.append({"success": False, "error": "At least one identifier required", "candidates": []})
+            elif isinstance(candidates, Exception):
+                results.append({"success": False, "error": str(candidates), "candidates": []})
+            else:
+                results.append(EntityResolver._resolution([
+                    {**candidate, "profile": profiles.get(candidate["entity_id"], candidate["profile"])}
+                    for candidate in candidates[:RESOLVE_RETURNED_CANDIDATES]
+                ], total=len(candidates)))
+        return results
+    
+    @staticmethod
+    def _snapshot_index():
+        """A private identifier index built now from one profile scan"""
+        index = IdentifierIndex(
+            lambda: DatabaseService.iter_profiles(columns=", ".join(INDEXED_COLUMNS)),
+            DatabaseService.get_profiles_by_entity_ids
+        )
+        index.rebuild()
+        if not index.ready:
+            raise RuntimeError("could not load profiles for resolution")
+        return index
+    
+    @staticmethod
+    def _rank_candidates(index, name: Optional[str], email: Optional[str], card_id: Optional[str],
+                         device_hash: Optional[str], face_id: Optional[str], student_id: Optional[str]) -> List[Dict[str, Any]]:
+        """Scored candidates, best first: indexed ones when index is given, else from a table scan"""
+        name_sims = None
+        if index:
+            profiles, name_sims = EntityResolver._indexed_candidates(
+                index, name, card_id=card_id, device_hash=device_hash, face_id=face_id,
+                student_id=student_id, email=email
+            )
+        else:
+            profiles = get_backend().table("profiles").select("*").execute().data
+        
+        candidates = []
+        for profile in profiles:
+            candidate = EntityResolver._score_profile(
+                profile, name, email, card_id, device_hash, face_id, student_id,
+                name_sim=name_sims.get(profile.get("entity_id"), 0.0) if name_sims is not None else None
+            )
+            if candidate:
+                candidates.append(candidate)
+        
+        # Sort by confidence score
+        candidates.sort(key=lambda x: x["confidence"], reverse=True)
+        return candidates
+    
+    @staticmethod
+    def _resolution(candidates: List[Dict[str, Any]], total: Optional[int] = None) -> Dict[str, Any]:
+        """resolve_entity response for ranked candidates (total defaults to len(candidates))"""
+        if not candidates:
+            return {
+                "success": False,
+                "message": "No matching entities found",
+                "candidates": []
+            }
+        
+        # Return top candidate and alternatives
+        return {
+            "success": True,
+            "best_match": candidates[0],
+            "alternatives": candidates[1:RESOLVE_RETURNED_CANDIDATES] if len(candidates) > 1 else [],
+            "total_candidates": total if total is not None else len(candidates),
+            "resolution_method": "multi_identifier_fuzzy"
+        }
+    
+    @staticmethod
+    def _score_profile(profile: Dict[str, Any], name: Optional[str], email: Optional[str], card_id: Optional[str],
+                       device_hash: Optional[str], face_id: Optional[str], student_id: Optional[str],
+                       name_sim: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Score one profile against the given identifiers; None when nothing matches
+        Pass name_sim when the name similarity is already known
+        """
+        match_score = 0.0
+        matched_fields = []
+        evidence = []
+        
+        # Exact matches (high confidence)
+        if card_id and profile.get("card_id") == card_id:
+            match_score += 0.25
+            matched_fields.append("card_id")
+            evidence.append(f"Card ID exact match: {card_id}")
+        
+        if device_hash and profile.get("device_hash") == device_hash:
+            match_score += 0.20
+            matched_fields.append("device_hash")
+            evidence.append(f"Device hash exact match: {device_hash[:10]}...")
+        
+        if face_id and profile.get("face_id") == face_id:
+            match_score += 0.20
+            matched_fields.append("face_id")
+            evidence.append(f"Face ID exact match: {face_id}")
+        
+        if student_id and profile.get("student_id") == student_id:
+            match_score += 0.15
+            matched_fields.append("student_id")
+            evidence.append(f"Student ID exact match: {student_id}")
+        
+        if email and profile.get("email") == email:
+            match_score += 0.15
+            matched_fields.append("email")
+            evidence.append(f"Email exact match: {email}")
+        
+        # Fuzzy name matching
+        if name and profile.get("name"):
+            if name_sim is None:
+                # Names that cannot reach 0.7 are dropped on their LCS bound without an exact ratio
+                name_sim = name_similarity(name, profile.get("name"), threshold=0.7)
+            if name_sim >= 0.7:  # Only consider if similarity is high enough
+                name_match_score = name_sim * 0.20
+                match_score += name_match_score
+                matched_fields.append("name_fuzzy")
+                evidence.append(f"Name similarity: {name_sim:.2%} - '{name}' ≈ '{profile.get('name')}'")
+        
+        # Only a candidate if we have some match
+        if match_score <= 0:
+            return None
+        
+        # Normalize to 0-1 range (max possible score is 1.15)
+        confidence = min(match_score / 1.15, 1.0)
+        
+        return {
+            "entity_id": profile.get("entity_id"),
+            "profile": profile,
+            "confidence": confidence,
+            "matched_fields": matched_fields,
+            "evidence": evidence,
+            "match_score": match_score
+        }
+    
+    @staticmethod
+    def _indexed_candidates(index, name: Optional[str], **identifiers: Optional[str]) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+        """
+        Indexed columns of profiles sharing an identifier with the query or with a similar name,
+        and entity_id -> name similarity for the names at or above 0.7
+        """
+        entity_ids = index.candidates(**identifiers)
+        name_sims: Dict[str, float] = {}
+        if name:
+            # A similarity of 0.7 needs a shared token (the sequence term alone reaches 0.6); of
+            # those names, score only the ones whose ratio bound can still reach it
+            found = index.name_candidates(name)
+            query = prepare_name(name)
+            possible = (found["ratio_bound"] * 0.6 + found["jaccard"] * 0.4 >= 0.7) | (found["names"] == query.text)
+            for entity_id, text, token_sim in zip(found["entity_ids"][possible].tolist(), found["names"][possible].tolist(),
+                                                  found["jaccard"][possible].tolist()):
+                similarity = weighted_similarity(query, text, token_sim, threshold=0.7)
+                if similarity >= 0.7:
+                    name_sims[entity_id] = similarity
+                    entity_ids.add(entity_id)
+        profiles = (index.get(entity_id) for entity_id in sorted(entity_ids))
+        return [profile for profile in profiles if profile], name_sims
+    
     @staticmethod
     def get_provenance(entity_id: str) -> Dict[str, Any]:
         """
         Get provenance information showing which data sources contributed to entity profile
         """
         try:
-            profile = DatabaseService.get_profile_by_entity_id(entity_id)
+            # Profile and per-source activity counts are independent - fetch concurrently
+            cutoff = (datetime.now() - timedelta(days=30)).isoformat()
+            
+            def count_activity(table: str):
+                def task():
+                    response = get_backend().table(table).select("identity", count="exact").eq("entity_id", entity_id).gte("timestamp", cutoff).execute()
+                    return response.count if response.count is not None else len(response.data)
+                return task
+            
+            sources, errors = fan_out({
+                "profile": lambda: DatabaseService.get_profile_by_entity_id(entity_id),
+                "swipes": count_activity("swipes"),
+                "wifi_logs": count_activity("wifi_logs")
+            }, default=0)
+            
+            if "profile" in errors:
+                raise errors["profile"]
+            profile = sources["profile"]
             if not profile:
                 return {"error": "Entity not found"}
             
@@ -201,26 +339,13 @@ class EntityResolver:
                     "confidence": "high"
                 }
             
-            # Get activity counts from different sources
-            cutoff = (datetime.now() - timedelta(days=30)).isoformat()
-            
-            try:
-                swipes = supabase.table("swipes").select("identity", count="exact").eq("entity_id", entity_id).gte("timestamp", cutoff).execute()
-                provenance["activity_sources"]["swipes"] = {
-                    "count": swipes.count if hasattr(swipes, 'count') else 0,
-                    "period": "last_30_days"
-                }
-            except:
-                provenance["activity_sources"]["swipes"] = {"count": 0, "period": "last_30_days"}
-            
-            try:
-                wifi = supabase.table("wifi_logs").select("identity", count="exact").eq("entity_id", entity_id).gte("timestamp", cutoff).execute()
-                provenance["activity_sources"]["wifi_logs"] = {
-                    "count": wifi.count if hasattr(wifi, 'count') else 0,
+            # Activity counts from different sources
+            for source in ("swipes", "wifi_logs"):
+                provenance["activity_sources"][source] = {
+                    "count": sources[source],
                     "period": "last_30_days"
                 }
-            except:
-                provenance["activity_sources"]["wifi_logs"] = {"count": 0, "period": "last_30_days"}
+            provenance["unavailable_sources"] = list(errors.keys())
             
             # Remove duplicates
             provenance["data_sources"] = list(set(provenance["data_sources"]))
@@ -247,56 +372,36 @@ class EntityResolver:
                 "linkages": []
             }
             
-            # Card -> Swipes linkage
-            if profile.get("card_id"):
-                try:
-                    swipes = supabase.table("swipes").select("*").eq("card_id", profile.get("card_id")).limit(5).order("timestamp", desc=True).execute()
-                    if swipes.data:
-                        links["linkages"].append({
-                            "type": "card_to_swipes",
-                            "identifier": profile.get("card_id"),
-                            "source_table": "profiles",
-                            "target_table": "swipes",
-                            "record_count": len(swipes.data),
-                            "confidence": 0.95,
-                            "sample_records": swipes.data[:3]
-                        })
-                except Exception as e:
-                    print(f"Error linking card to swipes: {e}")
+            # Each linkage queries a different table - fetch them concurrently
+            linkage_specs = [
+                # (type, profile field, target table, confidence)
+                ("card_to_swipes", "card_id", "swipes", 0.95),
+                ("device_to_wifi", "device_hash", "wifi_logs", 0.90),
+                ("face_to_cctv", "face_id", "cctv_frame", 0.85)
+            ]
             
-            # Device -> WiFi linkage
-            if profile.get("device_hash"):
-                try:
-                    wifi = supabase.table("wifi_logs").select("*").eq("device_hash", profile.get("device_hash")).limit(5).order("timestamp", desc=True).execute()
-                    if wifi.data:
-                        links["linkages"].append({
-                            "type": "device_to_wifi",
-                            "identifier": profile.get("device_hash"),
-                            "source_table": "profiles",
-                            "target_table": "wifi_logs",
-                            "record_count": len(wifi.data),
-                            "confidence": 0.90,
-                            "sample_records": wifi.data[:3]
-                        })
-                except Exception as e:
-                    print(f"Error linking device to wifi: {e}")
+            def sample_records(field: str, table: str, identifier: str):
+                return lambda: get_backend().table(table).select("*").eq(field, identifier).limit(5).order("timestamp", desc=True).execute().data
             
-            # Face -> CCTV linkage
-            if profile.get("face_id"):
-                try:
-                    cctv = supabase.table("cctv_frame").select("*").eq("face_id", profile.get("face_id")).limit(5).order("timestamp", desc=True).execute()
-                    if cctv.data:
-                        links["linkages"].append({
-                            "type": "face_to_cctv",
-                            "identifier": profile.get("face_id"),
-                            "source_table": "profiles",
-                            "target_table": "cctv_frame",
-                            "record_count": len(cctv.data),
-                            "confidence": 0.85,
-                            "sample_records": cctv.data[:3]
-                        })
-                except Exception as e:
-                    print(f"Error linking face to cctv: {e}")
+            samples, errors = fan_out({
+                link_type: sample_records(field, table, profile.get(field))
+                for link_type, field, table, _ in linkage_specs
+                if profile.get(field)
+            }, default=[])
+            
+            for link_type, field, table, confidence in linkage_specs:
+                records = samples.get(link_type)
+                if records:
+                    links["linkages"].append({
+                        "type": link_type,
+                        "identifier": profile.get(field),
+                        "source_table": "profiles",
+                        "target_table": table,
+                        "record_count": len(records),
+                        "confidence": confidence,
+                        "sample_records": records[:3]
+                    })
+            links["unavailable_sources"] = list(errors.keys())
             
             links["total_linkages"] = len(links["linkages"])
             links["overall_confidence"] = sum(l["confidence"] for l in links["linkages"]) / len(links["linkages"]) if links["linkages"] else 0
@@ -306,3 +411,59 @@ class EntityResolver:
         except Exception as e:
             print(f"Error getting cross-source links: {e}")
             return {"error": str(e)}
+
+
+def resolve_records(items: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Validate and resolve raw batch records (dicts, or NDJSON lines as bytes)
+    Invalid records get an error result in their position
+    """
+    queries: List[Optional[Dict[str, Any]]] = []
+    errors: Dict[int, str] = {}
+    for position, item in enumerate(items):
+        try:
+            query = ResolveQuery.model_validate_json(item) if isinstance(item, bytes) else ResolveQuery.model_validate(item)
+            queries.append(query.model_dump())
+        except ValidationError as e:
+            queries.append(None)
+            errors[position] = "; ".join(
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" if error["loc"] else error["msg"]
+                for error in e.errors()
+            )
+    resolved = iter(EntityResolver.resolve_batch([query for query in queries if query is not None]))
+    return [
+        {"success": False, "error": f"Invalid record: {errors[position]}", "candidates": []} if query is None else next(resolved)
+        for position, query in enumerate(queries)
+    ]
+
+
+async def resolve_ndjson(chunks: AsyncIterator[bytes]) -> List[Dict[str, Any]]:
+    """Resolve an NDJSON body as it streams in, RESOLVE_BATCH_ROWS records per worker call"""
+    results: List[Dict[str, Any]] = []
+    pending: List[bytes] = []
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        pending.extend(line for line in lines if line.strip())
+        while len(pending) >= RESOLVE_BATCH_ROWS:
+            batch, pending = pending[:RESOLVE_BATCH_ROWS], pending[RESOLVE_BATCH_ROWS:]
+            results += await run_db(resolve_records, batch)
+    if buffer.strip():
+        pending.append(buffer)
+    if pending:
+        results += await run_db(resolve_records, pending)
+    return results
+
+
+async def resolve_json(body: bytes) -> List[Dict[str, Any]]:
+    """Resolve a JSON array of records (or a single record object)"""
+    records = json.loads(body)
+    if isinstance(records, dict):
+        records = [records]
+    if not isinstance(records, list):
+        raise ValueError("Expected a JSON array of records")
+    results: List[Dict[str, Any]] = []
+    for start in range(0, len(records), RESOLVE_BATCH_ROWS):
+        results += await run_db(resolve_records, records[start:start + RESOLVE_BATCH_ROWS])
+    return results
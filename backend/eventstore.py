@@ -0,0 +1,202 @@
+"""
+Columnar Event Store
+Recent swipes, wifi logs, CCTV frames and lab bookings held as NumPy columns:
+int64 epoch seconds plus dictionary-encoded entity, location and source codes,
+so analytics run as vectorized scans instead of loops over row dicts
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from timeutil import DAY_SECONDS, MISSING_EPOCH, from_epoch, floor_day, now_epoch
+from incremental import EventIndex
+from rollup import ROLLUP_SOURCES
+
+# Days of events held in memory (~17 bytes per event); older windows use the rollup
+EVENT_STORE_DAYS = int(os.getenv("EVENT_STORE_DAYS", "35"))
+
+# Seconds the store may lag the event tables before a background refresh is started
+EVENT_STORE_REFRESH_SECONDS = float(os.getenv("EVENT_STORE_REFRESH_SECONDS", "30"))
+
+# Code for a missing entity or location
+NO_CODE = -1
+
+
+class Dictionary:
+    """Dictionary encoding of strings to dense int32 codes"""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def encode(self, values: Iterable[Any]) -> np.ndarray:
+        codes, table = self.codes, self.values
+        out = []
+        for value in values:
+            if value is None or value == "":
+                out.append(NO_CODE)
+                continue
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(table)
+                table.append(value)
+            out.append(code)
+        return np.array(out, dtype=np.int32)
+
+    def code(self, value: Any) -> int:
+        return self.codes.get(value, NO_CODE)
+
+    def decode(self, codes: np.ndarray, missing: str = "Unknown") -> List[str]:
+        table = self.values
+        return [table[c] if c >= 0 else missing for c in codes.tolist()]
+
+
+class ColumnarEventStore(EventIndex):
+    """
+    Append-only event columns over the last EVENT_STORE_DAYS days
+
+    Rows are appended as small chunks on refresh and concatenated lazily on the
+    next query, which also drops events that have aged out of the window.
+    Exposes the same activity / daily_activity / source_counts interface as the
+    hourly rollup, but exact and not aligned to whole hours.
+    """
+
+    name = "event store"
+
+    def __init__(self, scan: Callable[..., Iterable[Dict[str, Any]]], keys: Dict[str, str],
+                 sources: Dict[str, Tuple[str, str, str]] = ROLLUP_SOURCES,
+                 days: int = EVENT_STORE_DAYS):
+        super().__init__(scan, keys, sources, days, EVENT_STORE_REFRESH_SECONDS)
+        self.source_names = list(sources)
+        self.source_codes = {source: code for code, source in enumerate(self.source_names)}
+        self.entities = Dictionary()
+        self.locations = Dictionary()
+        self._chunks: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+        self._columns: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def _apply(self, source: str, rows: List[Dict[str, Any]], epochs: np.ndarray):
+        _, location_column, entity_column = self.sources[source]
+        keep = epochs != MISSING_EPOCH
+        entity_codes = self.entities.encode(row.get(entity_column) for row in rows)
+        location_codes = self.locations.encode(row.get(location_column) for row in rows)
+        source_codes = np.full(len(rows), self.source_codes[source], dtype=np.int8)
+        self._chunks.append((epochs[keep], entity_codes[keep], location_codes[keep], source_codes[keep]))
+        self._columns = None
+
+    def columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(epochs, entity codes, location codes, source codes), consolidated on demand"""
+        with self._lock:
+            horizon = floor_day(now_epoch()) - self.backfill_days * DAY_SECONDS
+            if self._columns is None or (self.coverage_start is not None and horizon > self.coverage_start):
+                if self._chunks:
+                    columns = tuple(np.concatenate(parts) for parts in zip(*self._chunks))
+                else:
+                    columns = (np.empty(0, np.int64), np.empty(0, np.int32),
+                               np.empty(0, np.int32), np.empty(0, np.int8))
+                # Drop events that have aged out of the window
+                if self.coverage_start is not None and horizon > self.coverage_start:
+                    keep = columns[0] >= horizon
+                    columns = tuple(column[keep] for column in columns)
+                    self.coverage_start = horizon
+                self._columns = columns
+                self._chunks = [columns]
+            return self._columns
+
+    def memory_bytes(self) -> int:
+        return sum(column.nbytes for column in self.columns())
+
+    # ---- vectorized scans ----
+
+    def _mask(self, start_epoch: Optional[int], end_epoch: Optional[int],
+              sources: Optional[Iterable[str]] = None) -> Tuple[np.ndarray, Tuple[np.ndarray, ...]]:
+        columns = self.columns()
+        epochs, _, _, source_codes = columns
+        mask = np.ones(len(epochs), dtype=bool)
+        if start_epoch is not None:
+            mask &= epochs >= start_epoch
+        if end_epoch is not None:
+            mask &= epochs <= end_epoch
+        if sources is not None:
+            mask &= np.isin(source_codes, [self.source_codes[s] for s in sources if s in self.source_codes])
+        return mask, columns
+
+    def activity(self, start_epoch: int, end_epoch: int, sources: Iterable[str]) -> Tuple[int, int]:
+        """(event count, distinct entities) over a window"""
+        mask, (_, entity_codes, _, _) = self._mask(start_epoch, end_epoch, sources)
+        entities = entity_codes[mask]
+        return int(mask.sum()), int(np.unique(entities[entities >= 0]).size)
+
+    def daily_activity(self, start_epoch: int, end_epoch: int, sources: Iterable[str]) -> Dict[int, Tuple[int, int]]:
+        """Per UTC day in the window: day epoch -> (event count, distinct entities)"""
+        first_day = floor_day(start_epoch)
+        days = (floor_day(end_epoch) - first_day) // DAY_SECONDS + 1
+        mask, (epochs, entity_codes, _, _) = self._mask(start_epoch, end_epoch, sources)
+        day_index = (epochs[mask] - first_day) // DAY_SECONDS
+        entities = entity_codes[mask]
+
+        events = np.bincount(day_index, minlength=days)
+        # Distinct (day, entity) pairs, then count them per day
+        known = entities >= 0
+        pairs = np.unique(day_index[known] * max(len(self.entities), 1) + entities[known])
+        distinct = np.bincount(pairs // max(len(self.entities), 1), minlength=days)
+        return {first_day + d * DAY_SECONDS: (int(events[d]), int(distinct[d])) for d in range(days)}
+
+    def source_counts(self, start_epoch: Optional[int] = None, end_epoch: Optional[int] = None) -> Dict[str, int]:
+        """Event count per source in a window"""
+        mask, (_, _, _, source_codes) = self._mask(start_epoch, end_epoch)
+        counts = np.bincount(source_codes[mask], minlength=len(self.source_names))
+        return {source: int(counts[code]) for source, code in self.source_codes.items()}
+
+    def entity_activity(self, entity_id: str, sources: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        One entity's events, newest first, as columns:
+        epochs (int64), location_codes (int32), source_codes (int8)
+        """
+        code = self.entities.code(entity_id)
+        mask, (epochs, entity_codes, location_codes, source_codes) = self._mask(None, None, sources)
+        mask &= (entity_codes == code) if code != NO_CODE else False
+        order = np.argsort(-epochs[mask], kind="stable")
+        return {
+            "epochs": epochs[mask][order],
+            "location_codes": location_codes[mask][order],
+            "source_codes": source_codes[mask][order],
+        }
+
+    def entity_activities(self, entity_id: str) -> List[Dict[str, Any]]:
+        """One entity's events, newest first, in the timeline activity shape"""
+        columns = self.entity_activity(entity_id)
+        locations = self.locations.decode(columns["location_codes"])
+        return [
+            {"timestamp": from_epoch(epoch).isoformat(), "location": location, "detection_type": self.source_names[source]}
+            for epoch, location, source in zip(columns["epochs"].tolist(), locations, columns["source_codes"].tolist())
+        ]
+
+
+# Global store instance (lazy loaded)
+_event_store_instance: Optional[ColumnarEventStore] = None
+_event_store_lock = threading.Lock()
+
+
+def get_event_store() -> ColumnarEventStore:
+    """Get or create the global event store, fed by DatabaseService.stream_window"""
+    global _event_store_instance
+    if _event_store_instance is None:
+        with _event_store_lock:
+            if _event_store_instance is None:
+                from database import DatabaseService, EVENT_TABLE_KEYS
+                _event_store_instance = ColumnarEventStore(DatabaseService.stream_window, EVENT_TABLE_KEYS)
+    return _event_store_instance
+
+
+def serving_event_store(start_epoch: Optional[int] = None) -> Optional[ColumnarEventStore]:
+    """
+    The global store if it is built and holds the window, else None
+    Callers fall back to the hourly rollup for older windows or while it builds
+    """
+    store = get_event_store()
+    store.ensure_fresh()
+    return store if store.covers(start_epoch) else None
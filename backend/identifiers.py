@@ -0,0 +1,363 @@
+"""
+Profile Identifier Index
+In-memory hash maps from each exact identifier (card_id, device_hash,
+face_id, student_id, email) and each name token to the profiles carrying
+it, so entity resolution looks candidates up instead of scanning the
+profiles table
+"""
+
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from storage import add_write_listener
+
+# Seconds between full rebuilds, which pick up profile changes made outside this service
+IDENTIFIER_INDEX_REFRESH_SECONDS = float(os.getenv("IDENTIFIER_INDEX_REFRESH_SECONDS", "300"))
+
+# Identifiers matched exactly during resolution
+IDENTIFIER_FIELDS = ("card_id", "device_hash", "face_id", "student_id", "email")
+
+# Columns kept per profile: enough to score a candidate without reading its row
+INDEXED_COLUMNS = ("entity_id", "name") + IDENTIFIER_FIELDS
+
+# Character histogram bins per name; characters sharing a bin only loosen the bound
+NAME_HISTOGRAM_BINS = 64
+
+
+def _normalize_name(name: str) -> str:
+    """A name as the similarity kernel compares it"""
+    return name.lower().strip()
+
+
+def _histogram(text: str) -> np.ndarray:
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32) % NAME_HISTOGRAM_BINS
+    return np.bincount(codes, minlength=NAME_HISTOGRAM_BINS)
+
+
+def _add(postings: Dict[Any, Any], value: Any, entity_id: str):
+    """value -> entity_id, or a list of them once shared (most identifiers are unique)"""
+    current = postings.get(value)
+    if current is None:
+        postings[value] = entity_id
+    elif isinstance(current, list):
+        if entity_id not in current:
+            current.append(entity_id)
+    elif current != entity_id:
+        postings[value] = [current, entity_id]
+
+
+def _discard(postings: Dict[Any, Any], value: Any, entity_id: str):
+    current = postings.get(value)
+    if current == entity_id:
+        del postings[value]
+    elif isinstance(current, list) and entity_id in current:
+        current.remove(entity_id)
+        if len(current) == 1:
+            postings[value] = current[0]
+
+
+class _NameIndex:
+    """
+    Name token -> profile slots, plus per slot the normalized name, its token
+    count, length and character histogram, so candidates sharing a token get
+    their token Jaccard and an upper bound on their character similarity
+    ratio (2 x LCS / total length) in a few vectorized operations
+    """
+
+    def __init__(self):
+        self.slots: Dict[str, int] = {}
+        self.tokens: Dict[str, List[int]] = {}
+        self.entity_ids = np.empty(0, dtype=object)
+        self.names = np.empty(0, dtype=object)
+        self.token_counts = np.zeros(0, dtype=np.int32)
+        self.lengths = np.zeros(0, dtype=np.int32)
+        self.histograms = np.zeros((0, NAME_HISTOGRAM_BINS), dtype=np.uint16)
+        self._free: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @staticmethod
+    def _tokens(name: str) -> Set[str]:
+        # Blank names share the "" token with each other only
+        return set(name.split()) or {""}
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        slot = len(self.slots)
+        if slot >= len(self.entity_ids):
+            capacity = max(1024, 2 * len(self.entity_ids))
+            self.entity_ids = np.resize(self.entity_ids, capacity)
+            self.names = np.resize(self.names, capacity)
+            self.token_counts = np.resize(self.token_counts, capacity)
+            self.lengths = np.resize(self.lengths, capacity)
+            self.histograms = np.resize(self.histograms, (capacity, NAME_HISTOGRAM_BINS))
+        return slot
+
+    def add(self, entity_id: str, name: str):
+        self.remove(entity_id)
+        name = _normalize_name(name)
+        tokens = self._tokens(name)
+        slot = self.slots[entity_id] = self._allocate()
+        self.entity_ids[slot] = entity_id
+        self.names[slot] = name
+        self.token_counts[slot] = len(tokens)
+        self.lengths[slot] = len(name)
+        self.histograms[slot] = _histogram(name)
+        for token in tokens:
+            self.tokens.setdefault(token, []).append(slot)
+
+    def remove(self, entity_id: str):
+        slot = self.slots.pop(entity_id, None)
+        if slot is None:
+            return
+        for token in self._tokens(self.names[slot]):
+            postings = self.tokens[token]
+            postings.remove(slot)
+            if not postings:
+                del self.tokens[token]
+        self._free.append(slot)
+
+    def candidates(self, name: str) -> Dict[str, np.ndarray]:
+        """
+        Columns for every name sharing a token with `name`: entity_ids, names
+        (normalized), jaccard (exact token Jaccard) and ratio_bound (at least
+        their LCS ratio against the normalized query)
+        """
+        name = _normalize_name(name)
+        tokens = self._tokens(name)
+        postings = [self.tokens[token] for token in tokens if token in self.tokens]
+        if not postings:
+            empty = np.empty(0)
+            return {"entity_ids": empty, "names": empty, "jaccard": empty, "ratio_bound": empty}
+        slots, shared = np.unique(np.concatenate([np.asarray(p, dtype=np.int64) for p in postings]), return_counts=True)
+        if tokens == {""}:
+            jaccard = np.zeros(len(slots))
+        else:
+            jaccard = shared / (len(tokens) + self.token_counts[slots] - shared)
+        # Matching characters never exceed the per-character (per-bin) minimum counts
+        common = np.minimum(self.histograms[slots], _histogram(name)).sum(axis=1)
+        total = self.lengths[slots] + len(name)
+        ratio_bound = np.where(total > 0, 2.0 * common / np.maximum(total, 1), 1.0)
+        return {"entity_ids": self.entity_ids[slots], "names": self.names[slots], "jaccard": jaccard, "ratio_bound": ratio_bound}
+
+
+class IdentifierIndex:
+    """
+    Exact-identifier lookup over every profile
+
+    Built in the background from a full profile scan. Profiles written through
+    the storage layer afterwards are re-read on the next lookup; the whole
+    index is rebuilt every IDENTIFIER_INDEX_REFRESH_SECONDS.
+    """
+
+    def __init__(self, scan: Callable[[], Iterable[Dict[str, Any]]],
+                 fetch: Callable[[List[str]], List[Dict[str, Any]]],
+                 refresh_seconds: float = IDENTIFIER_INDEX_REFRESH_SECONDS):
+        self.scan = scan
+        self.fetch = fetch
+        self.refresh_seconds = refresh_seconds
+        # entity_id -> values of INDEXED_COLUMNS
+        self._profiles: Dict[str, Tuple[Any, ...]] = {}
+        # identifier field -> value -> entity_id (or list of entity_ids)
+        self._postings: Dict[str, Dict[Any, Any]] = {field: {} for field in IDENTIFIER_FIELDS}
+        self._names = _NameIndex()
+        self._dirty: Set[str] = set()
+        # Changes applied while a rebuild runs, re-applied to the rebuilt maps
+        self._reapply: Set[str] = set()
+        self._stale = False
+        self.ready = False
+        self.built_at = 0.0
+        self.build_seconds = 0.0
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+    # ---- maintenance ----
+
+    @staticmethod
+    def _insert(profiles: Dict[str, Tuple[Any, ...]], postings: Dict[str, Dict[Any, Any]],
+                names: _NameIndex, profile: Dict[str, Any]):
+        entity_id = profile.get("entity_id")
+        if not entity_id:
+            return
+        values = tuple(profile.get(column) for column in INDEXED_COLUMNS)
+        profiles[entity_id] = values
+        for field, value in zip(INDEXED_COLUMNS[2:], values[2:]):
+            if value:
+                _add(postings[field], value, entity_id)
+        if values[1]:
+            names.add(entity_id, values[1])
+
+    def _delete(self, entity_id: str):
+        values = self._profiles.pop(entity_id, None)
+        if values is not None:
+            for field, value in zip(INDEXED_COLUMNS[2:], values[2:]):
+                if value:
+                    _discard(self._postings[field], value, entity_id)
+            self._names.remove(entity_id)
+
+    def rebuild(self):
+        """Re-read every profile and swap in fresh maps"""
+        if not self._build_lock.acquire(blocking=False):
+            return
+        try:
+            started = time.monotonic()
+            with self._lock:
+                self._stale = False
+                self._reapply = set()
+            profiles: Dict[str, Tuple[Any, ...]] = {}
+            postings: Dict[str, Dict[Any, Any]] = {field: {} for field in IDENTIFIER_FIELDS}
+            names = _NameIndex()
+            for profile in self.scan():
+                self._insert(profiles, postings, names, profile)
+            with self._lock:
+                self._profiles, self._postings, self._names = profiles, postings, names
+                # Changes applied to the old maps while the scan ran are read again
+                self._dirty |= self._reapply
+                self.ready = True
+                self.built_at = time.monotonic()
+                self.build_seconds = self.built_at - started
+        except Exception as e:
+            print(f"Error building identifier index: {e}")
+        finally:
+            self._build_lock.release()
+
+    def ensure_fresh(self) -> bool:
+        """
+        Start a background rebuild when the maps are stale or old
+        Never blocks; returns whether the index can serve lookups yet
+        """
+        due = self._stale or time.monotonic() - self.built_at >= self.refresh_seconds
+        if due and not self._build_lock.locked():
+            threading.Thread(target=self.rebuild, name="identifier-index-build", daemon=True).start()
+        return self.ready
+
+    def mark_changed(self, entity_ids: Optional[Iterable[str]] = None):
+        """Profiles changed (all of them when entity_ids is None)"""
+        with self._lock:
+            if entity_ids is None:
+                self._stale = True
+            else:
+                self._dirty.update(entity_id for entity_id in entity_ids if entity_id)
+        if entity_ids is None:
+            self.ensure_fresh()
+
+    def _apply_dirty(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = list(self._dirty), set()
+        try:
+            profiles = {profile.get("entity_id"): profile for profile in self.fetch(dirty)}
+        except Exception as e:
+            print(f"Error refreshing identifier index: {e}")
+            with self._lock:
+                self._dirty.update(dirty)
+            return
+        with self._lock:
+            if self._build_lock.locked():
+                self._reapply.update(dirty)
+            for entity_id in dirty:
+                self._delete(entity_id)
+                if entity_id in profiles:
+                    self._insert(self._profiles, self._postings, self._names, profiles[entity_id])
+
+    # ---- lookups ----
+
+    def lookup(self, field: str, value: Any) -> List[str]:
+        """entity_ids of profiles whose `field` equals value exactly"""
+        if not value:
+            return []
+        self._apply_dirty()
+        with self._lock:
+            match = self._postings[field].get(value)
+        if match is None:
+            return []
+        return list(match) if isinstance(match, list) else [match]
+
+    def candidates(self, **identifiers: Any) -> Set[str]:
+        """entity_ids matching any of the given identifiers (field=value)"""
+        found: Set[str] = set()
+        for field, value in identifiers.items():
+            if field in IDENTIFIER_FIELDS:
+                found.update(self.lookup(field, value))
+        return found
+
+    def name_candidates(self, name: str) -> Dict[str, np.ndarray]:
+        """
+        Columns (entity_ids, names, jaccard, ratio_bound) for profiles whose
+        name shares a token with `name`; see _NameIndex.candidates
+        """
+        self._apply_dirty()
+        with self._lock:
+            return self._names.candidates(name)
+
+    def get(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Indexed columns of one profile"""
+        values = self._profiles.get(entity_id)
+        return dict(zip(INDEXED_COLUMNS, values)) if values is not None else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Size and build state"""
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "profiles": len(self._profiles),
+                "identifiers": {field: len(postings) for field, postings in self._postings.items()},
+                "name_tokens": len(self._names.tokens),
+                "pending_changes": len(self._dirty),
+                "build_seconds": round(self.build_seconds, 3),
+                "age_seconds": round(time.monotonic() - self.built_at, 1) if self.ready else None
+            }
+
+
+def _on_profiles_write(table: str, verb: str, rows: Optional[list], filters: list):
+    """Storage write listener: re-read the profiles a write touched"""
+    if table != "profiles":
+        return
+    index = get_identifier_index()
+    if verb in ("insert", "upsert") and rows is not None:
+        entity_ids = [row.get("entity_id") for row in rows if isinstance(row, dict)]
+        if all(entity_ids):
+            index.mark_changed(entity_ids)
+            return
+    for name, args in filters:
+        if name == "eq" and args[0] == "entity_id":
+            index.mark_changed([args[1]])
+            return
+        if name == "in_" and args[0] == "entity_id":
+            index.mark_changed(args[1])
+            return
+    index.mark_changed()
+
+
+# Global index instance (lazy loaded)
+_identifier_index_instance: Optional[IdentifierIndex] = None
+_identifier_index_lock = threading.Lock()
+
+
+def get_identifier_index() -> IdentifierIndex:
+    """Get or create the global identifier index, fed by DatabaseService"""
+    global _identifier_index_instance
+    if _identifier_index_instance is None:
+        with _identifier_index_lock:
+            if _identifier_index_instance is None:
+                from database import DatabaseService
+                _identifier_index_instance = IdentifierIndex(
+                    lambda: DatabaseService.iter_profiles(columns=", ".join(INDEXED_COLUMNS)),
+                    DatabaseService.get_profiles_by_entity_ids
+                )
+                add_write_listener(_on_profiles_write)
+    return _identifier_index_instance
+
+
+def serving_identifier_index() -> Optional[IdentifierIndex]:
+    """
+    The global identifier index once its first build has finished, else None
+    Callers fall back to scanning the profiles table while it is being built
+    """
+    index = get_identifier_index()
+    return index if index.ensure_fresh() else None
@@ -0,0 +1,157 @@
+"""
+Incremental Event Indexes
+Base for in-memory structures fed from the event tables: each refresh
+re-reads a short overlap window behind the newest row seen per table and
+skips rows it has already applied, and rows written by the ingest path are
+merged in directly
+"""
+
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from timeutil import DAY_SECONDS, MISSING_EPOCH, to_epoch_array, from_epoch, floor_day, now_epoch
+
+# Rows handed to _apply at a time while streaming a table
+INGEST_BATCH_SIZE = 1000
+
+# Seconds behind the newest row each refresh re-reads, catching rows stored
+# late (clock skew, delayed commits); older late rows must come through merge()
+EVENT_INDEX_OVERLAP_SECONDS = int(os.getenv("EVENT_INDEX_OVERLAP_SECONDS", "600"))
+
+# Applied row keys kept per table before the first prune
+SEEN_KEYS_PRUNE_MIN = 4096
+
+
+class EventIndex:
+    """
+    Streams each source table in time order from the backfill start on the
+    first build; later refreshes start EVENT_INDEX_OVERLAP_SECONDS before the
+    newest row seen in that table. The keys of rows applied inside that window
+    are remembered, so re-read rows are never applied twice. Rows stored with
+    an older timestamp are only picked up when the writer passes them to merge().
+
+    `sources` maps table -> (time column, location column, entity column);
+    subclasses implement _apply to fold a batch of rows into their structure.
+    """
+
+    name = "index"
+
+    def __init__(self, scan: Callable[..., Iterable[Dict[str, Any]]], keys: Dict[str, str],
+                 sources: Dict[str, Tuple[str, str, str]], backfill_days: int = 0,
+                 refresh_seconds: float = 30.0, overlap_seconds: int = EVENT_INDEX_OVERLAP_SECONDS):
+        self.scan = scan
+        self.keys = keys
+        self.sources = sources
+        self.backfill_days = backfill_days
+        self.refresh_seconds = refresh_seconds
+        self.overlap_seconds = overlap_seconds
+        # table -> epoch of the newest row read by a refresh
+        self.high_water: Dict[str, int] = {}
+        # table -> key -> epoch of rows applied at or after high_water - overlap_seconds
+        self._seen: Dict[str, Dict[Any, int]] = {}
+        self._prune_at: Dict[str, int] = {}
+        self.coverage_start: Optional[int] = None
+        self.ready = False
+        self.refreshed_at = 0.0
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+
+    def _apply(self, source: str, rows: List[Dict[str, Any]], epochs: np.ndarray):
+        """Fold rows (with their int64 epochs, MISSING_EPOCH if unparseable) into the index"""
+        raise NotImplementedError
+
+    def refresh(self):
+        """Pull rows from each table's overlap window onwards into the index"""
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            if self.coverage_start is None:
+                self.coverage_start = floor_day(now_epoch() - self.backfill_days * DAY_SECONDS) if self.backfill_days else 0
+            # Go round again if new writes were announced while a pass was running
+            self._dirty = True
+            while self._dirty:
+                self._dirty = False
+                for source, (time_column, location_column, entity_column) in self.sources.items():
+                    columns = ", ".join(dict.fromkeys((time_column, location_column, entity_column)))
+                    start = from_epoch(self._floor(source)).isoformat()
+                    try:
+                        batch = []
+                        for row in self.scan(source, columns, start, time_column=time_column):
+                            batch.append(row)
+                            if len(batch) >= INGEST_BATCH_SIZE:
+                                self._ingest(source, batch)
+                                batch = []
+                        self._ingest(source, batch)
+                    except Exception as e:
+                        print(f"Error refreshing {self.name} for {source}: {e}")
+            self.ready = True
+            self.refreshed_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def _floor(self, source: str) -> int:
+        """Oldest epoch a refresh of `source` may still read"""
+        high = self.high_water.get(source)
+        return self.coverage_start if high is None else max(self.coverage_start, high - self.overlap_seconds)
+
+    def _ingest(self, source: str, rows: List[Dict[str, Any]], scanned: bool = True):
+        """Apply the rows not applied before; scanned rows also advance the table's high water mark"""
+        if not rows:
+            return
+        time_column = self.sources[source][0]
+        key_column = self.keys.get(source, "identity")
+        epochs = to_epoch_array([row.get(time_column) for row in rows])
+        with self._lock:
+            seen = self._seen.setdefault(source, {})
+            keys = [row.get(key_column) for row in rows]
+            fresh = np.fromiter((key is None or key not in seen for key in keys), dtype=bool, count=len(rows))
+            fresh &= (epochs == MISSING_EPOCH) | (epochs >= self.coverage_start)
+            if not fresh.all():
+                rows = [row for row, keep in zip(rows, fresh.tolist()) if keep]
+                keys = [key for key, keep in zip(keys, fresh.tolist()) if keep]
+                epochs = epochs[fresh]
+            if rows:
+                self._apply(source, rows, epochs)
+            if scanned and len(epochs):
+                self.high_water[source] = max(self.high_water.get(source, MISSING_EPOCH), int(epochs.max()))
+            # Remember what a later refresh may re-read, forgetting what it no longer will
+            floor = self._floor(source)
+            for key, epoch in zip(keys, epochs.tolist()):
+                if key is not None and epoch >= floor:
+                    seen[key] = epoch
+            if len(seen) > self._prune_at.get(source, SEEN_KEYS_PRUNE_MIN):
+                self._seen[source] = {key: epoch for key, epoch in seen.items() if epoch >= floor}
+                self._prune_at[source] = max(SEEN_KEYS_PRUNE_MIN, 2 * len(self._seen[source]))
+
+    def merge(self, source: str, rows: List[Dict[str, Any]]):
+        """
+        Fold rows just written to `source` (as stored, with their keys) into the index,
+        whatever their timestamp; rows a refresh has already read are skipped
+        """
+        # Before the first build starts, the build reads them from storage
+        if source in self.sources and self.coverage_start is not None:
+            self._ingest(source, rows, scanned=False)
+
+    def ensure_fresh(self) -> bool:
+        """
+        Start a background refresh when the index is older than refresh_seconds
+        Never blocks; returns whether the index can serve queries yet
+        """
+        if time.monotonic() - self.refreshed_at >= self.refresh_seconds and not self._refresh_lock.locked():
+            threading.Thread(target=self.refresh, name=f"{self.name}-refresh", daemon=True).start()
+        return self.ready
+
+    def request_refresh(self):
+        """Pick up rows written elsewhere now instead of after refresh_seconds"""
+        self._dirty = True
+        self.refreshed_at = 0.0
+        self.ensure_fresh()
+
+    def covers(self, start_epoch: Optional[int]) -> bool:
+        """Whether a window starting at start_epoch lies inside the loaded history"""
+        if not self.ready:
+            return False
+        return start_epoch is None or start_epoch >= (self.coverage_start or 0)
@@ -0,0 +1,229 @@
+"""
+Bulk Event Ingestion
+Validates batches of Swipe / WiFiLog / CCTVFrame / LabBooking records in one
+pass and writes them to storage in large batched inserts, through the
+write-behind queue for high-volume tables
+"""
+
+import os
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from pydantic import TypeAdapter, ValidationError
+from models import Swipe, WiFiLog, CCTVFrame, LabBooking
+from storage import get_backend
+from concurrency import run_db
+from bulk import lookup_in
+from rollup import get_rollup
+from lastseen import get_last_seen
+from eventstore import get_event_store
+from writebehind import WRITE_BEHIND_TABLES, get_write_queue
+from timeutil import stored_timestamp
+
+# Rows per validation pass and per insert request
+INGEST_BATCH_ROWS = int(os.getenv("INGEST_BATCH_ROWS", "5000"))
+
+# Errors echoed back per request; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# Event table -> record model
+INGEST_MODELS = {
+    "swipes": Swipe,
+    "wifi_logs": WiFiLog,
+    "cctv_frame": CCTVFrame,
+    "lab_bookings": LabBooking,
+}
+
+# Event table -> timestamp fields, stored as naive local wall time like every other row
+INGEST_TIME_FIELDS = {
+    "swipes": ("timestamp",),
+    "wifi_logs": ("timestamp",),
+    "cctv_frame": ("timestamp",),
+    "lab_bookings": ("start_time", "end_time"),
+}
+
+# Event table -> profile column used to fill in a missing entity_id
+ENTITY_LOOKUP_COLUMNS = {
+    "swipes": "card_id",
+    "wifi_logs": "device_hash",
+}
+
+_adapters = {source: TypeAdapter(List[model]) for source, model in INGEST_MODELS.items()}
+
+
+def validate_batch(source: str, payload: bytes, offset: int = 0,
+                   lines: Optional[List[bytes]] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Validate a JSON array of records for `source` in one pass
+    Returns (rows ready to insert, errors). If anything is invalid the batch is
+    re-checked record by record (`lines` are the raw NDJSON records, if any), so
+    bad records are dropped and reported by position (offset + index).
+    """
+    try:
+        return _stored_times(source, _adapters[source].dump_python(_adapters[source].validate_json(payload), mode="json")), []
+    except ValidationError:
+        pass
+    
+    if lines is None:
+        try:
+            lines = json.loads(payload)
+        except ValueError as e:
+            return [], [{"index": offset, "errors": [f"Invalid JSON: {e}"]}]
+        if not isinstance(lines, list):
+            return [], [{"index": offset, "errors": ["Expected a JSON array of records"]}]
+    
+    model = INGEST_MODELS[source]
+    rows, errors = [], []
+    for index, item in enumerate(lines):
+        try:
+            record = model.model_validate_json(item) if isinstance(item, bytes) else model.model_validate(item)
+            rows.append(record.model_dump(mode="json"))
+        except ValidationError as e:
+            errors.append({"index": offset + index, "errors": [
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" if error["loc"] else error["msg"]
+                for error in e.errors()
+            ]})
+    return _stored_times(source, rows), errors
+
+
+def _stored_times(source: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Rewrite timestamps sent with an offset or Z as naive local wall time, in place"""
+    for field in INGEST_TIME_FIELDS[source]:
+        for row in rows:
+            value = row.get(field)
+            if isinstance(value, str) and (value.endswith("Z") or "+" in value[10:] or "-" in value[10:]):
+                row[field] = stored_timestamp(value)
+    return rows
+
+
+def resolve_entity_ids(source: str, rows: List[Dict[str, Any]]):
+    """Fill in entity_id from the matching profile identifier where a record has none"""
+    lookup_column = ENTITY_LOOKUP_COLUMNS.get(source)
+    if not lookup_column:
+        return
+    missing = sorted({row[lookup_column] for row in rows if not row.get("entity_id") and row.get(lookup_column)})
+    entity_ids = {
+        profile[lookup_column]: profile["entity_id"]
+        for profile in lookup_in("profiles", lookup_column, missing, columns=f"entity_id, {lookup_column}", key="entity_id")
+    }
+    for row in rows:
+        if not row.get("entity_id") and row.get(lookup_column) in entity_ids:
+            row["entity_id"] = entity_ids[row[lookup_column]]
+
+
+def write_batch(source: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insert rows in INGEST_BATCH_ROWS-sized requests
+    Returns them as stored, with their server-assigned keys, for notify_indexes
+    """
+    stored: List[Dict[str, Any]] = []
+    for start in range(0, len(rows), INGEST_BATCH_ROWS):
+        stored += get_backend().table(source).insert(rows[start:start + INGEST_BATCH_ROWS]).execute().data
+    return stored
+
+
+def flush_rows(source: str, rows: List[Dict[str, Any]]):
+    """
+    Write-behind flush: resolve entity ids, insert, and apply the rows to the indexes
+    Only the insert can fail the flush, so a retried batch is never inserted twice
+    """
+    resolve_entity_ids(source, rows)
+    notify_indexes(source, write_batch(source, rows))
+
+
+def notify_indexes(source: str, rows: List[Dict[str, Any]]):
+    """
+    Apply rows just stored in `source` to the in-memory indexes it feeds, whatever their timestamps
+    The rows are already committed, so an index that fails is only logged; its next refresh
+    re-reads the rows that fall inside its overlap window
+    """
+    for index in (get_rollup(), get_last_seen(), get_event_store()):
+        if source in index.sources:
+            try:
+                index.merge(source, rows)
+            except Exception as e:
+                print(f"Error applying {source} rows to {type(index).__name__}: {e}")
+
+
+def ingest_batch(source: str, payload: bytes, offset: int = 0, lines: Optional[List[bytes]] = None,
+                 wait: bool = False) -> Dict[str, Any]:
+    """
+    Validate one JSON array of records and hand the valid ones to storage
+    Write-behind tables are queued unless `wait` is set; others are inserted now
+    """
+    rows, errors = validate_batch(source, payload, offset, lines)
+    inserted = queued = 0
+    if rows and source in WRITE_BEHIND_TABLES and not wait:
+        get_write_queue().put(source, rows)
+        queued = len(rows)
+    elif rows:
+        resolve_entity_ids(source, rows)
+        stored = write_batch(source, rows)
+        notify_indexes(source, stored)
+        inserted = len(stored)
+    return {"received": len(rows) + len(errors), "inserted": inserted, "queued": queued, "errors": errors}
+
+
+class IngestReport:
+    """Running totals for one ingestion request"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.received = 0
+        self.inserted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.batches = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.failure: Optional[str] = None
+
+    def add(self, result: Dict[str, Any]):
+        self.batches += 1
+        self.received += result["received"]
+        self.inserted += result["inserted"]
+        self.queued += result["queued"]
+        self.rejected += len(result["errors"])
+        self.errors.extend(result["errors"][:MAX_REPORTED_ERRORS - len(self.errors)])
+
+    def to_dict(self) -> Dict[str, Any]:
+        report = {
+            "source": self.source,
+            "received": self.received,
+            "inserted": self.inserted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "errors": self.errors
+        }
+        if self.failure:
+            report["failure"] = self.failure
+        return report
+
+
+async def ingest_ndjson(source: str, chunks: AsyncIterator[bytes], report: IngestReport, wait: bool = False):
+    """
+    Ingest an NDJSON body as it streams in
+    Lines are buffered until INGEST_BATCH_ROWS records are ready, then each batch
+    is validated and inserted in a worker thread
+    """
+    pending: List[bytes] = []
+    offset = 0
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        pending.extend(line for line in lines if line.strip())
+        while len(pending) >= INGEST_BATCH_ROWS:
+            batch, pending = pending[:INGEST_BATCH_ROWS], pending[INGEST_BATCH_ROWS:]
+            report.add(await run_db(ingest_batch, source, b"[" + b",".join(batch) + b"]", offset, batch, wait))
+            offset += len(batch)
+    if buffer.strip():
+        pending.append(buffer)
+    if pending:
+        report.add(await run_db(ingest_batch, source, b"[" + b",".join(pending) + b"]", offset, pending, wait))
+
+
+async def ingest_json(source: str, body: bytes, report: IngestReport, wait: bool = False):
+    """Ingest a JSON array (or a single JSON object) of records"""
+    if body.lstrip().startswith(b"{"):
+        body = b"[" + body + b"]"
+    report.add(await run_db(ingest_batch, source, body, wait=wait))
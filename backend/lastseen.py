@@ -0,0 +1,134 @@
+"""
+Entity Last-Seen Index
+Incrementally maintained entity_id -> latest sighting (timestamp, location,
+source), bucketed by hour so time-threshold queries touch only matching entities
+"""
+
+import os
+import threading
+from bisect import bisect_left, insort
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import numpy as np
+from timeutil import MISSING_EPOCH, floor_hour
+from incremental import EventIndex
+
+# Seconds the index may lag the event tables before a background refresh is started
+LASTSEEN_REFRESH_SECONDS = float(os.getenv("LASTSEEN_REFRESH_SECONDS", "30"))
+
+# Days of history loaded on the first build; 0 loads everything
+LASTSEEN_BACKFILL_DAYS = int(os.getenv("LASTSEEN_BACKFILL_DAYS", "0"))
+
+# Presence sources: table -> (time column, location column, entity column)
+LASTSEEN_SOURCES = {
+    "swipes": ("timestamp", "location_id", "entity_id"),
+    "wifi_logs": ("timestamp", "ap_id", "entity_id"),
+}
+
+
+class LastSeenIndex(EventIndex):
+    """Latest swipe / Wi-Fi sighting per entity"""
+
+    name = "last-seen index"
+
+    def __init__(self, scan: Callable[..., Iterable[Dict[str, Any]]], keys: Dict[str, str],
+                 sources: Dict[str, Tuple[str, str, str]] = LASTSEEN_SOURCES,
+                 backfill_days: int = LASTSEEN_BACKFILL_DAYS):
+        super().__init__(scan, keys, sources, backfill_days, LASTSEEN_REFRESH_SECONDS)
+        # entity_id -> (epoch, timestamp as stored, location, source)
+        self.latest: Dict[str, Tuple[int, Any, str, str]] = {}
+        # hour -> entities whose latest sighting falls in that hour, plus the sorted hours
+        self.hours: Dict[int, Set[str]] = {}
+        self.hour_keys: List[int] = []
+        # Bumped on every change; (since, until) -> sorted entity_ids, valid for one version
+        self.version = 0
+        self._windows: Dict[Tuple[int, Optional[int]], List[str]] = {}
+        self._windows_version = 0
+
+    def _apply(self, source: str, rows: List[Dict[str, Any]], epochs: np.ndarray):
+        time_column, location_column, entity_column = self.sources[source]
+        for row, epoch in zip(rows, epochs.tolist()):
+            entity_id = row.get(entity_column)
+            if epoch == MISSING_EPOCH or not entity_id:
+                continue
+            current = self.latest.get(entity_id)
+            if current is not None:
+                if current[0] >= epoch:
+                    continue
+                self._unbucket(entity_id, current[0])
+            self.latest[entity_id] = (epoch, row.get(time_column), row.get(location_column) or "Unknown", source)
+            hour = floor_hour(epoch)
+            if hour not in self.hours:
+                self.hours[hour] = set()
+                insort(self.hour_keys, hour)
+            self.hours[hour].add(entity_id)
+            self.version += 1
+
+    def _unbucket(self, entity_id: str, epoch: int):
+        hour = floor_hour(epoch)
+        bucket = self.hours.get(hour)
+        if bucket is not None:
+            bucket.discard(entity_id)
+            if not bucket:
+                del self.hours[hour]
+                del self.hour_keys[bisect_left(self.hour_keys, hour)]
+
+    # ---- queries ----
+
+    def get(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Latest sighting of an entity, or None if it has never been seen"""
+        entry = self.latest.get(entity_id)
+        if entry is None:
+            return None
+        return {"epoch": entry[0], "timestamp": entry[1], "location": entry[2], "source": entry[3]}
+
+    def seen_since(self, epoch: int) -> Iterator[str]:
+        """Entities whose latest sighting is at or after epoch"""
+        with self._lock:
+            start = bisect_left(self.hour_keys, floor_hour(epoch))
+            hours = self.hour_keys[start:]
+            buckets = [list(self.hours[hour]) for hour in hours]
+        for hour, entity_ids in zip(hours, buckets):
+            if hour >= epoch:
+                yield from entity_ids
+            else:
+                yield from (e for e in entity_ids if self.latest[e][0] >= epoch)
+
+    def seen_between(self, since: int, until: Optional[int] = None) -> List[str]:
+        """
+        Sorted entity_ids whose latest sighting is in [since, until)
+        Cached until the index next changes, so repeated windows cost a lookup
+        """
+        with self._lock:
+            if self._windows_version != self.version or len(self._windows) > 16:
+                self._windows = {}
+                self._windows_version = self.version
+            entity_ids = self._windows.get((since, until))
+            if entity_ids is None:
+                entity_ids = sorted(e for e in self.seen_since(since) if until is None or self.latest[e][0] < until)
+                self._windows[(since, until)] = entity_ids
+            return entity_ids
+
+
+# Global index instance (lazy loaded)
+_last_seen_instance: Optional[LastSeenIndex] = None
+_last_seen_lock = threading.Lock()
+
+
+def get_last_seen() -> LastSeenIndex:
+    """Get or create the global last-seen index, fed by DatabaseService.stream_window"""
+    global _last_seen_instance
+    if _last_seen_instance is None:
+        with _last_seen_lock:
+            if _last_seen_instance is None:
+                from database import DatabaseService, EVENT_TABLE_KEYS
+                _last_seen_instance = LastSeenIndex(DatabaseService.stream_window, EVENT_TABLE_KEYS)
+    return _last_seen_instance
+
+
+def serving_last_seen() -> Optional[LastSeenIndex]:
+    """
+    The global last-seen index once its first build has finished, else None
+    Callers fall back to scanning recent events while it is being built
+    """
+    index = get_last_seen()
+    return index if index.ensure_fresh() else None
@@ -1,15 +1,27 @@
 import os
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Path, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional, List
 from datetime import datetime
 import uvicorn
 from database import DatabaseService
+from concurrency import run_db, shutdown_fanout, get_single_flight
+from storage import close_backend
+from rollup import get_rollup
+from lastseen import get_last_seen
+from eventstore import get_event_store
+from ingest import IngestReport, ingest_json, ingest_ndjson
+from writebehind import WriteQueueFull, get_write_queue, shutdown_write_queue
+from profilecache import get_profile_cache, request_memo
+from dashboard import get_dashboard_snapshot, shutdown_dashboard_snapshot
+from search import get_search_index
+from identifiers import get_identifier_index
+from timeutil import to_epoch, to_epoch_array, newest_first
 from models import (
     Profile, Swipe, WiFiLog, LabBooking, LibraryCheckout,
     Note, CCTVFrame, FaceEmbedding, EntityResolutionResult
 )
-from entity_resolution import EntityResolver
+from entity_resolution import EntityResolver, resolve_json, resolve_ndjson
 from predictive_analytics import PredictiveMonitor
 from ml_predictor import get_predictor
 
@@ -33,6 +45,44 @@ app.add_middleware(
 
 db = DatabaseService()
 
+@app.middleware("http")
+async def profile_memo_middleware(request: Request, call_next):
+    """Serve each profile at most once per request, however many lookups ask for it"""
+    with request_memo():
+        return await call_next(request)
+
+@app.on_event("startup")
+async def startup_event():
+    """Start building the in-memory indexes and the dashboard snapshot in the background"""
+    get_rollup().ensure_fresh()
+    get_event_store().ensure_fresh()
+    get_last_seen().ensure_fresh()
+    get_search_index().ensure_fresh()
+    get_identifier_index().ensure_fresh()
+    get_dashboard_snapshot().start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued writes, then release pooled storage connections"""
+    shutdown_dashboard_snapshot()
+    shutdown_write_queue()
+    shutdown_fanout()
+    close_backend()
+
+async def from_snapshot(name: str, response: Response, fallback):
+    """
+    Serve a dashboard value from the background snapshot, reporting its age in
+    the Age header; computes it directly with `fallback` if it has never succeeded
+    """
+    snapshot = get_dashboard_snapshot()
+    try:
+        value, age = await run_db(snapshot.get, name)
+    except RuntimeError:
+        return await run_db(fallback) if fallback else None
+    response.headers["Age"] = str(int(age))
+    response.headers["Cache-Control"] = f"max-age={int(snapshot.interval)}, stale-while-revalidate={int(snapshot.max_stale)}"
+    return value
+
 # ============================================
 # HEALTH CHECK
 # ============================================
@@ -46,23 +96,53 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    """Healthy unless queued ingest rows are failing to reach storage"""
+    write_queue = get_write_queue()
+    if write_queue.healthy():
+        return {"status": "healthy"}
+    stats = write_queue.snapshot()
+    return {
+        "status": "degraded",
+        "write_behind": {key: stats[key] for key in ("pending", "failing_tables", "dead_lettered", "unwritten", "dead_letter_dir")}
+    }
 
 # ============================================
 # PROFILE ENDPOINTS
 # ============================================
 @app.get("/api/profiles", response_model=List[dict])
 async def get_profiles(
+    response: Response,
     limit: int = Query(100, ge=1, le=500),
-    offset: int = Query(0, ge=0)
+    offset: int = Query(0, ge=0),
+    after: Optional[str] = Query(None, description="Cursor: last entity_id of the previous page")
 ):
-    """Get all profiles with pagination"""
-    return db.get_all_profiles(limit=limit, offset=offset)
+    """
+    Get all profiles with pagination
+    The cursor for the next page is returned in the X-Next-Cursor header
+    """
+    profiles = await run_db(db.get_all_profiles, limit=limit, offset=offset, after=after)
+    next_cursor = db.next_cursor(profiles, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return profiles
+
+@app.get("/api/profiles/autocomplete")
+async def autocomplete_profiles(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """Ranked profile suggestions matching q in name, email, department or entity_id"""
+    return {"query": q, "results": await run_db(db.autocomplete_profiles, q, limit)}
+
+@app.get("/api/profiles/search-index")
+async def get_search_index_stats():
+    """Profile search index size and build state"""
+    return get_search_index().snapshot()
 
 @app.get("/api/profiles/{entity_id}")
 async def get_profile(entity_id: str):
     """Get a specific profile by entity_id"""
-    profile = db.get_profile_by_entity_id(entity_id)
+    profile = await run_db(db.get_profile_by_entity_id, entity_id)
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     return profile
@@ -72,28 +152,29 @@ async def search_profiles(
     query: str,
     field: str = Query("name", pattern="^(name|email|department)$")
 ):
-    """Search profiles by name, email, or department"""
-    return db.search_profiles(query, field)
+    """Search profiles by name, email, or department, best matches first"""
+    return await run_db(db.search_profiles, query, field)
 
 @app.get("/api/entities")
 async def get_entities(
     limit: int = Query(100, ge=1, le=500),
     offset: int = Query(0, ge=0),
     status: Optional[str] = Query(None, pattern="^(active|recent|inactive|all)$"),
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    after: Optional[str] = Query(None, description="Cursor: next_cursor from the previous page")
 ):
     """
     Get entities with enriched data including activity status and last seen
     Supports filtering by status and searching by name/email
     """
-    return db.get_entities_enriched(limit=limit, offset=offset, status=status, search=search)
+    return await run_db(db.get_entities_enriched, limit=limit, offset=offset, status=status, search=search, after=after)
 
 @app.get("/api/entities/{entity_id}")
 async def get_entity_details(entity_id: str):
     """
     Get detailed entity information including profile and recent activity summary
     """
-    entity = db.get_entity_details(entity_id)
+    entity = await run_db(db.get_entity_details, entity_id)
     if not entity:
         raise HTTPException(status_code=404, detail="Entity not found")
     return entity
@@ -103,7 +184,7 @@ async def get_entity_timeline(entity_id: str):
     """
     Get timeline data for a specific entity including all activities and current location
     """
-    timeline = db.get_entity_timeline(entity_id)
+    timeline = await run_db(db.get_entity_timeline, entity_id)
     if not timeline:
         raise HTTPException(status_code=404, detail="Timeline not found for entity")
     return timeline
@@ -112,12 +193,13 @@ async def get_entity_timeline(entity_id: str):
 async def get_entities_with_timeline(
     limit: int = Query(100, ge=1, le=500),
     offset: int = Query(0, ge=0),
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    after: Optional[str] = Query(None, description="Cursor: next_cursor from the previous page")
 ):
     """
     Get all entities with their timeline data (current location, last seen)
     """
-    return db.get_all_entities_with_timeline(limit=limit, offset=offset, search=search)
+    return await run_db(db.get_all_entities_with_timeline, limit=limit, offset=offset, search=search, after=after)
 
 # ============================================
 # SWIPE ENDPOINTS
@@ -128,7 +210,7 @@ async def get_swipes(
     entity_id: Optional[str] = None
 ):
     """Get recent swipe records"""
-    return db.get_recent_swipes(limit=limit, entity_id=entity_id)
+    return await run_db(db.get_recent_swipes, limit=limit, entity_id=entity_id)
 
 # ============================================
 # WIFI LOG ENDPOINTS
@@ -139,7 +221,7 @@ async def get_wifi_logs(
     entity_id: Optional[str] = None
 ):
     """Get recent WiFi logs"""
-    return db.get_recent_wifi_logs(limit=limit, entity_id=entity_id)
+    return await run_db(db.get_recent_wifi_logs, limit=limit, entity_id=entity_id)
 
 # ============================================
 # LAB BOOKING ENDPOINTS
@@ -150,7 +232,7 @@ async def get_lab_bookings(
     upcoming: bool = False
 ):
     """Get lab bookings"""
-    return db.get_lab_bookings(entity_id=entity_id, upcoming=upcoming)
+    return await run_db(db.get_lab_bookings, entity_id=entity_id, upcoming=upcoming)
 
 # ============================================
 # LIBRARY CHECKOUT ENDPOINTS
@@ -158,7 +240,7 @@ async def get_lab_bookings(
 @app.get("/api/library_checkouts")
 async def get_library_checkouts(entity_id: Optional[str] = None):
     """Get library checkouts"""
-    return db.get_library_checkouts(entity_id=entity_id)
+    return await run_db(db.get_library_checkouts, entity_id=entity_id)
 
 # ============================================
 # NOTES ENDPOINTS
@@ -169,7 +251,7 @@ async def get_notes(
     source: Optional[str] = None
 ):
     """Get notes"""
-    return db.get_notes(entity_id=entity_id, source=source)
+    return await run_db(db.get_notes, entity_id=entity_id, source=source)
 
 # ============================================
 # CCTV FRAME ENDPOINTS
@@ -180,7 +262,7 @@ async def get_cctv_frames(
     limit: int = Query(50, ge=1, le=500)
 ):
     """Get CCTV frames"""
-    return db.get_cctv_frames(location_id=location_id, limit=limit)
+    return await run_db(db.get_cctv_frames, location_id=location_id, limit=limit)
 
 # ============================================
 # FACE EMBEDDING ENDPOINTS
@@ -188,14 +270,12 @@ async def get_cctv_frames(
 @app.get("/api/face_embedding")
 async def get_face_embeddings():
     """Get all face embeddings"""
-    from database import supabase
-    response = supabase.table("face_embedding").select("*").execute()
-    return response.data
+    return await run_db(db.get_face_embeddings)
 
 @app.get("/api/face_embedding/{face_id}")
 async def get_face_embedding(face_id: str):
     """Get face embedding by face_id"""
-    embedding = db.get_face_embedding(face_id)
+    embedding = await run_db(db.get_face_embedding, face_id)
     if not embedding:
         raise HTTPException(status_code=404, detail="Face embedding not found")
     return embedding
@@ -219,7 +299,7 @@ async def resolve_entity(
             detail="At least one identifier required: card_id, device_hash, or face_id"
         )
     
-    result = db.resolve_entity(card_id=card_id, device_hash=device_hash, face_id=face_id)
+    result = await run_db(db.resolve_entity, card_id=card_id, device_hash=device_hash, face_id=face_id)
     
     if not result:
         raise HTTPException(status_code=404, detail="Entity not found")
@@ -232,11 +312,11 @@ async def get_entity_activity_timeline_endpoint(
     days: int = Query(7, ge=1, le=30)
 ):
     """Get comprehensive activity timeline for an entity"""
-    profile = db.get_profile_by_entity_id(entity_id)
+    profile = await run_db(db.get_profile_by_entity_id, entity_id)
     if not profile:
         raise HTTPException(status_code=404, detail="Entity not found")
     
-    timeline = db.get_entity_activity_timeline(entity_id, days=days)
+    timeline = await run_db(db.get_entity_activity_timeline, entity_id, days=days)
     return timeline
 
 # ============================================
@@ -262,7 +342,8 @@ async def resolve_entity_advanced(
             detail="At least one identifier required"
         )
     
-    result = EntityResolver.resolve_entity(
+    result = await run_db(
+        EntityResolver.resolve_entity,
         name=name,
         email=email,
         card_id=card_id,
@@ -273,13 +354,44 @@ async def resolve_entity_advanced(
     
     return result
 
+@app.post("/api/resolve/batch")
+async def resolve_entities_batch(request: Request):
+    """
+    Resolve many identifier tuples in one request
+
+    The body is a JSON array of objects with any of name, email, card_id,
+    device_hash, face_id and student_id, or NDJSON (one object per line) sent
+    with Content-Type application/x-ndjson, resolved in batches as it streams
+    in. Results use the /api/resolve/advanced shape and come back in input
+    order; records without any identifier or that fail validation get an
+    error result in their position.
+    """
+    try:
+        content_type = request.headers.get("content-type", "")
+        if "ndjson" in content_type or "jsonl" in content_type:
+            results = await resolve_ndjson(request.stream())
+        else:
+            results = await resolve_json(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid body: {e}")
+    return {
+        "total": len(results),
+        "resolved": sum(1 for result in results if result.get("success")),
+        "results": results
+    }
+
+@app.get("/api/resolve/index")
+async def get_identifier_index_stats():
+    """Identifier index size and build state"""
+    return get_identifier_index().snapshot()
+
 @app.get("/api/entities/{entity_id}/provenance")
 async def get_entity_provenance(entity_id: str):
     """
     Get provenance information showing which data sources contributed to entity profile
     Tracks data lineage and confidence levels
     """
-    result = EntityResolver.get_provenance(entity_id)
+    result = await run_db(EntityResolver.get_provenance, entity_id)
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
     return result
@@ -290,7 +402,7 @@ async def get_cross_source_links(entity_id: str):
     Get all cross-source linkages showing how records are connected across tables
     Demonstrates multi-modal fusion quality
     """
-    result = EntityResolver.get_cross_source_links(entity_id)
+    result = await run_db(EntityResolver.get_cross_source_links, entity_id)
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
     return result
@@ -304,7 +416,7 @@ async def predict_next_location(entity_id: str):
     Predict next likely location based on historical patterns
     Uses ML-based pattern recognition with explainability
     """
-    result = PredictiveMonitor.predict_next_location(entity_id)
+    result = await run_db(PredictiveMonitor.predict_next_location, entity_id)
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
     return result
@@ -315,7 +427,7 @@ async def detect_anomalies(entity_id: str):
     Detect anomalous behavior patterns with statistical analysis
     Provides evidence-based explanations for detected anomalies
     """
-    result = PredictiveMonitor.detect_anomalies(entity_id)
+    result = await run_db(PredictiveMonitor.detect_anomalies, entity_id)
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
     return result
@@ -326,7 +438,7 @@ async def infer_missing_data(entity_id: str):
     Infer missing data points using ML-based inference
     Provides confidence scores and justification for each inference
     """
-    result = PredictiveMonitor.infer_missing_data(entity_id)
+    result = await run_db(PredictiveMonitor.infer_missing_data, entity_id)
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
     return result
@@ -336,45 +448,113 @@ async def infer_missing_data(entity_id: str):
 # ============================================
 @app.get("/api/dashboard/stats")
 async def get_dashboard_stats(
+    response: Response,
     target_date: Optional[str] = Query(None, description="Target date in YYYY-MM-DD format"),
     target_time: Optional[str] = Query(None, description="Target time in HH:MM:SS format")
 ):
     """Get dashboard statistics for a specific date and time"""
-    return db.get_dashboard_stats(target_date=target_date, target_time=target_time)
+    if not (target_date and target_time):
+        return await from_snapshot("stats", response, db.get_dashboard_stats)
+    return await run_db(db.get_dashboard_stats, target_date=target_date, target_time=target_time)
 
 @app.get("/api/security/stats")
-async def get_security_stats():
+async def get_security_stats(response: Response):
     """Get security statistics for the Security dashboard"""
-    return db.get_security_stats()
+    return await from_snapshot("security_stats", response, db.get_security_stats)
 
 @app.get("/api/analytics/activity-heatmap")
-async def get_activity_heatmap(days: int = Query(7, ge=1, le=30)):
-    """Get activity heatmap data for analytics"""
-    # This would generate heatmap data based on swipes and wifi logs
-    # Mock implementation for now
-    return {
-        "days": days,
-        "heatmap": [
-            {"hour": i, "day": j, "count": (i + j) % 10}
-            for i in range(24) for j in range(days)
-        ]
-    }
+async def get_activity_heatmap(
+    days: int = Query(7, ge=1, le=30),
+    target_date: Optional[str] = Query(None, description="Target date in YYYY-MM-DD format"),
+    target_time: Optional[str] = Query(None, description="Target time in HH:MM:SS format")
+):
+    """Get hour-of-day x day activity heatmap from swipes, wifi logs and CCTV frames"""
+    return await run_db(db.get_activity_heatmap, days=days, target_date=target_date, target_time=target_time)
 
 @app.get("/api/analytics/weekly-activity")
 async def get_weekly_activity(
+    response: Response,
     target_date: Optional[str] = Query(None, description="Target date in YYYY-MM-DD format"),
     target_time: Optional[str] = Query(None, description="Target time in HH:MM:SS format")
 ):
     """Get weekly activity data for dashboard charts"""
-    return db.get_weekly_activity_data(target_date=target_date, target_time=target_time)
+    if not (target_date and target_time):
+        return await from_snapshot("weekly_activity", response, db.get_weekly_activity_data)
+    return await run_db(db.get_weekly_activity_data, target_date=target_date, target_time=target_time)
 
 @app.get("/api/analytics/source-distribution")
 async def get_source_distribution(
+    response: Response,
     target_date: Optional[str] = Query(None, description="Target date in YYYY-MM-DD format"),
     target_time: Optional[str] = Query(None, description="Target time in HH:MM:SS format")
 ):
     """Get data source distribution for dashboard charts"""
-    return db.get_source_distribution_data(target_date=target_date, target_time=target_time)
+    if not (target_date and target_time):
+        return await from_snapshot("source_distribution", response, db.get_source_distribution_data)
+    return await run_db(db.get_source_distribution_data, target_date=target_date, target_time=target_time)
+
+@app.get("/api/dashboard/snapshot")
+async def get_dashboard_snapshot_stats():
+    """Age of each background-refreshed dashboard value"""
+    return get_dashboard_snapshot().snapshot()
+
+# ============================================
+# BULK INGESTION ENDPOINTS
+# ============================================
+@app.post("/api/ingest/{source}")
+async def ingest_events(
+    request: Request,
+    response: Response,
+    source: str = Path(..., pattern="^(swipes|wifi_logs|cctv_frame|lab_bookings)$"),
+    wait: bool = Query(False, description="Insert before responding instead of queueing")
+):
+    """
+    Bulk-ingest Swipe / WiFiLog / CCTVFrame / LabBooking records
+
+    The body is a JSON array of records, or NDJSON (one record per line) sent
+    with Content-Type application/x-ndjson, which is validated and written batch
+    by batch as it streams in. Invalid records are rejected individually and
+    reported by position. Valid swipes, wifi logs and CCTV frames are queued for
+    write-behind insertion (503 if the queue stays full); lab bookings, or any
+    source with wait=true, are inserted before the response.
+    """
+    report = IngestReport(source)
+    try:
+        content_type = request.headers.get("content-type", "")
+        if "ndjson" in content_type or "jsonl" in content_type:
+            await ingest_ndjson(source, request.stream(), report, wait=wait)
+        else:
+            await ingest_json(source, await request.body(), report, wait=wait)
+    except WriteQueueFull as e:
+        report.failure = str(e)
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+    except Exception as e:
+        print(f"Error ingesting {source}: {e}")
+        report.failure = str(e)
+        response.status_code = 500
+    return report.to_dict()
+
+@app.get("/api/ingest/stats")
+async def get_ingest_stats():
+    """Write-behind queue depth, flush counters, failing tables and dead-lettered rows"""
+    return get_write_queue().snapshot()
+
+@app.get("/api/cache/profiles")
+async def get_profile_cache_stats():
+    """Profile cache size and hit / miss counters"""
+    return get_profile_cache().snapshot()
+
+@app.get("/api/cache/coalescing")
+async def get_coalescing_stats():
+    """Database calls executed vs. merged into an identical in-flight call"""
+    return get_single_flight().snapshot()
+
+@app.delete("/api/cache/profiles")
+async def clear_profile_cache(entity_id: Optional[str] = None):
+    """Drop one cached profile, or all of them, after an out-of-band profile change"""
+    get_profile_cache().invalidate([entity_id] if entity_id else None)
+    return get_profile_cache().snapshot()
 
 # ============================================
 # ALERTS & SECURITY ENDPOINTS
@@ -382,20 +562,27 @@ async def get_source_distribution(
 @app.post("/api/test/populate-activity")
 async def populate_test_activity():
     """Populate test activity data for demonstration"""
-    return db.populate_test_activity_data()
+    return await run_db(db.populate_test_activity_data)
 
 @app.get("/api/alerts")
 async def get_alerts(
+    response: Response,
     status: Optional[str] = Query(None, pattern="^(active|resolved|investigating)$"),
     limit: int = Query(100, ge=1, le=500)
 ):
     """Get security alerts based on entity inactivity patterns"""
-    return db.generate_security_alerts(status=status, limit=limit)
+    if status is None:
+        # Unfiltered alerts come from the dashboard snapshot's scan of up to 500 alerts;
+        # its first `limit` alerts are what a scan for `limit` would have found
+        snapshot = await from_snapshot("alerts", response, None)
+        if snapshot is not None:
+            return db.security_alerts_page(snapshot, limit)
+    return await run_db(db.generate_security_alerts, status=status, limit=limit)
 
 @app.put("/api/alerts/{entity_id}")
 async def update_alert(entity_id: str, status: str = Query(..., pattern="^(active|resolved|investigating)$")):
     """Update alert status"""
-    updated_alert = db.update_alert_status(entity_id, status)
+    updated_alert = await run_db(db.update_alert_status, entity_id, status)
     if not updated_alert:
         raise HTTPException(status_code=404, detail="Alert not found")
     return updated_alert
@@ -431,15 +618,15 @@ async def get_entity_history(
     
     end = datetime.fromisoformat(end_time.replace('Z', '+00:00')) if end_time else now
     
-    # Helper function to safely parse timestamp
-    def safe_parse_timestamp(timestamp_str):
-        try:
-            if timestamp_str:
-                return datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-        except (ValueError, AttributeError, TypeError):
-            pass
-        return None
+    # Window bounds and row timestamps are compared as UTC epoch seconds
+    start_epoch, end_epoch = to_epoch(start), to_epoch(end)
     
+    def in_window(rows, time_column):
+        """Rows whose timestamp falls inside the window, with their epochs"""
+        epochs = to_epoch_array([row.get(time_column) for row in rows])
+        return [(row, epoch) for row, epoch in zip(rows, epochs.tolist()) if start_epoch <= epoch <= end_epoch]
+    
+    activity_epochs = []
     history = {
         "entity_id": entity_id,
         "time_range": {
@@ -452,67 +639,63 @@ async def get_entity_history(
     
     # Fetch data based on asset type
     if asset_type in ["all", "swipe"]:
-        swipes = db.get_recent_swipes(limit=500, entity_id=entity_id)
-        for swipe in swipes:
-            swipe_time = safe_parse_timestamp(swipe.get('timestamp'))
-            if swipe_time and start <= swipe_time <= end:
-                history["activities"].append({
-                    "type": "swipe",
-                    "timestamp": swipe.get('timestamp'),
-                    "location": swipe.get('location', 'Unknown'),
-                    "details": {
-                        "card_id": swipe.get('card_id'),
-                        "access_granted": swipe.get('access_granted', True)
-                    }
-                })
+        swipes = await run_db(db.get_recent_swipes, limit=500, entity_id=entity_id)
+        for swipe, epoch in in_window(swipes, 'timestamp'):
+            activity_epochs.append(epoch)
+            history["activities"].append({
+                "type": "swipe",
+                "timestamp": swipe.get('timestamp'),
+                "location": swipe.get('location', 'Unknown'),
+                "details": {
+                    "card_id": swipe.get('card_id'),
+                    "access_granted": swipe.get('access_granted', True)
+                }
+            })
     
     if asset_type in ["all", "wifi"]:
-        wifi_logs = db.get_recent_wifi_logs(limit=500, entity_id=entity_id)
-        for log in wifi_logs:
-            log_time = safe_parse_timestamp(log.get('timestamp'))
-            if log_time and start <= log_time <= end:
-                history["activities"].append({
-                    "type": "wifi",
-                    "timestamp": log.get('timestamp'),
-                    "location": log.get('location', 'Unknown'),
-                    "details": {
-                        "device_hash": log.get('device_hash'),
-                        "ssid": log.get('ssid')
-                    }
-                })
+        wifi_logs = await run_db(db.get_recent_wifi_logs, limit=500, entity_id=entity_id)
+        for log, epoch in in_window(wifi_logs, 'timestamp'):
+            activity_epochs.append(epoch)
+            history["activities"].append({
+                "type": "wifi",
+                "timestamp": log.get('timestamp'),
+                "location": log.get('location', 'Unknown'),
+                "details": {
+                    "device_hash": log.get('device_hash'),
+                    "ssid": log.get('ssid')
+                }
+            })
     
     if asset_type in ["all", "lab"]:
-        lab_bookings = db.get_lab_bookings(entity_id=entity_id)
-        for booking in lab_bookings:
-            booking_time = safe_parse_timestamp(booking.get('booking_time'))
-            if booking_time and start <= booking_time <= end:
-                history["activities"].append({
-                    "type": "lab_booking",
-                    "timestamp": booking.get('booking_time'),
-                    "location": booking.get('lab_name', 'Unknown Lab'),
-                    "details": {
-                        "duration": booking.get('duration_hours'),
-                        "purpose": booking.get('purpose')
-                    }
-                })
+        lab_bookings = await run_db(db.get_lab_bookings, entity_id=entity_id)
+        for booking, epoch in in_window(lab_bookings, 'start_time'):
+            activity_epochs.append(epoch)
+            history["activities"].append({
+                "type": "lab_booking",
+                "timestamp": booking.get('start_time'),
+                "location": booking.get('lab_id') or booking.get('lab_name', 'Unknown Lab'),
+                "details": {
+                    "duration": booking.get('duration_hours'),
+                    "purpose": booking.get('purpose')
+                }
+            })
     
     if asset_type in ["all", "library"]:
-        checkouts = db.get_library_checkouts(entity_id=entity_id)
-        for checkout in checkouts:
-            checkout_time = safe_parse_timestamp(checkout.get('checkout_time'))
-            if checkout_time and start <= checkout_time <= end:
-                history["activities"].append({
-                    "type": "library",
-                    "timestamp": checkout.get('checkout_time'),
-                    "location": "Library",
-                    "details": {
-                        "book_title": checkout.get('book_title'),
-                        "due_date": checkout.get('due_date')
-                    }
-                })
+        checkouts = await run_db(db.get_library_checkouts, entity_id=entity_id)
+        for checkout, epoch in in_window(checkouts, 'checkout_time'):
+            activity_epochs.append(epoch)
+            history["activities"].append({
+                "type": "library",
+                "timestamp": checkout.get('checkout_time'),
+                "location": "Library",
+                "details": {
+                    "book_title": checkout.get('book_title'),
+                    "due_date": checkout.get('due_date')
+                }
+            })
     
-    # Sort activities by timestamp
-    history["activities"].sort(key=lambda x: x["timestamp"], reverse=True)
+    # Sort activities by time
+    history["activities"] = newest_first(history["activities"], activity_epochs)
     history["total_activities"] = len(history["activities"])
     
     return history
@@ -526,92 +709,7 @@ async def get_inactive_entities(
     Detect entities that have not been observed in any logs for the specified hours
     Generates alerts for entities missing from all systems
     """
-    from datetime import datetime, timedelta
-    
-    cutoff_time = datetime.now() - timedelta(hours=hours)
-    
-    # Get all profiles
-    all_profiles = db.get_all_profiles(limit=1000)
-    
-    # Get recent activities
-    recent_swipes = db.get_recent_swipes(limit=1000)
-    recent_wifi = db.get_recent_wifi_logs(limit=1000)
-    recent_labs = db.get_lab_bookings()
-    recent_library = db.get_library_checkouts()
-    
-    # Track entities with recent activity
-    active_entities = set()
-    
-    # Helper function to safely parse timestamp
-    def safe_parse_timestamp(timestamp_str):
-        try:
-            if timestamp_str:
-                return datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-        except (ValueError, AttributeError, TypeError):
-            pass
-        return None
-    
-    for swipe in recent_swipes:
-        swipe_time = safe_parse_timestamp(swipe.get('timestamp'))
-        if swipe_time and swipe_time >= cutoff_time:
-            active_entities.add(swipe.get('identity'))
-    
-    for log in recent_wifi:
-        log_time = safe_parse_timestamp(log.get('timestamp'))
-        if log_time and log_time >= cutoff_time:
-            active_entities.add(log.get('identity'))
-    
-    for booking in recent_labs:
-        booking_time = safe_parse_timestamp(booking.get('booking_time'))
-        if booking_time and booking_time >= cutoff_time:
-            active_entities.add(booking.get('identity'))
-    
-    for checkout in recent_library:
-        checkout_time = safe_parse_timestamp(checkout.get('checkout_time'))
-        if checkout_time and checkout_time >= cutoff_time:
-            active_entities.add(checkout.get('identity'))
-    
-    # Find inactive entities
-    inactive_entities = []
-    for profile in all_profiles[:limit]:
-        entity_id = profile.get('entity_id')
-        if entity_id not in active_entities:
-            # Get last known activity
-            last_activity = None
-            last_location = "Unknown"
-            
-            # Check all sources for last activity
-            entity_swipes = [s for s in recent_swipes if s.get('identity') == entity_id]
-            entity_wifi = [w for w in recent_wifi if w.get('identity') == entity_id]
-            
-            all_activities = []
-            if entity_swipes:
-                all_activities.extend([(s['timestamp'], s.get('location', 'Unknown')) for s in entity_swipes])
-            if entity_wifi:
-                all_activities.extend([(w['timestamp'], w.get('location', 'Unknown')) for w in entity_wifi])
-            
-            if all_activities:
-                all_activities.sort(reverse=True)
-                last_activity = all_activities[0][0]
-                last_location = all_activities[0][1]
-            
-            inactive_entities.append({
-                "entity_id": entity_id,
-                "name": profile.get('name', 'Unknown'),
-                "email": profile.get('email'),
-                "department": profile.get('department'),
-                "last_seen": last_activity,
-                "last_location": last_location,
-                "hours_inactive": hours if not last_activity else int((datetime.now() - datetime.fromisoformat(last_activity.replace('Z', '+00:00'))).total_seconds() / 3600),
-                "alert_severity": "high" if hours >= 24 else "medium"
-            })
-    
-    return {
-        "cutoff_time": cutoff_time.isoformat(),
-        "hours_threshold": hours,
-        "total_inactive": len(inactive_entities),
-        "inactive_entities": inactive_entities[:limit]
-    }
+    return await run_db(db.get_inactive_entities, hours=hours, limit=limit)
 
 # ============================================
 # SPACEFLOW ML ENDPOINTS
@@ -19,6 +19,7 @@ class Profile(BaseModel):
 # Swipe Models
 class Swipe(BaseModel):
     identity: str
+    entity_id: Optional[str] = None
     card_id: str
     location_id: str
     timestamp: datetime
@@ -27,6 +28,7 @@ class Swipe(BaseModel):
 # WiFi Log Models
 class WiFiLog(BaseModel):
     identity: str
+    entity_id: Optional[str] = None
     device_hash: str
     ap_id: str
     timestamp: datetime
@@ -94,6 +96,15 @@ class EntityResolutionResult(BaseModel):
     profile: Optional[Profile] = None
     recent_activities: Optional[Dict[str, Any]] = None
 
+# Entity Resolution Query (one record of a batch resolution)
+class ResolveQuery(BaseModel):
+    name: Optional[str] = None
+    email: Optional[str] = None
+    card_id: Optional[str] = None
+    device_hash: Optional[str] = None
+    face_id: Optional[str] = None
+    student_id: Optional[str] = None
+
 # Timeline Models
 class TimelineEntry(BaseModel):
     entity_id: str
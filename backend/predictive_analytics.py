@@ -3,88 +3,130 @@ Predictive Monitoring & Explainability Module
 Implements ML-based inference for missing data points with evidence-based reasoning
 """
 
-from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta
-from collections import defaultdict, Counter
-import statistics
-from database import supabase, DatabaseService
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime
+from collections import defaultdict
+import numpy as np
+from database import DatabaseService
+from eventstore import get_event_store
+from timeutil import HOUR_SECONDS, DAY_SECONDS, MISSING_EPOCH, from_epoch
+
+
+def _ranked(codes: np.ndarray, k: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    (code, count) pairs by descending count, ties in order of first occurrence
+    (the same order Counter.most_common gives)
+    """
+    if codes.size == 0:
+        return []
+    values, first, counts = np.unique(codes, return_index=True, return_counts=True)
+    order = np.lexsort((first, -counts))[:k]
+    return list(zip(values[order].tolist(), counts[order].tolist()))
 
 
 class PredictiveMonitor:
     """ML-based predictive monitoring with explainability"""
     
+    @staticmethod
+    def _activity_columns(entity_id: str) -> Optional[Dict[str, Any]]:
+        """
+        An entity's activity, newest first, as columns: epochs (int64), hours,
+        location and detection-type codes with their names, from the epochs the
+        timeline parsed; entities without a timeline row are read from the event store
+        """
+        timeline = DatabaseService.get_entity_timeline(entity_id)
+        if timeline and timeline.get("activities"):
+            activities = timeline["activities"]
+            epochs = np.array([MISSING_EPOCH if a.get("epoch") is None else a["epoch"] for a in activities], dtype=np.int64)
+            keep = epochs != MISSING_EPOCH
+            locations = np.array([str(a["location"]) for a in activities], dtype=object)[keep]
+            types = np.array([str(a["detection_type"]) for a in activities], dtype=object)[keep]
+            epochs = epochs[keep]
+            location_names, location_codes = np.unique(locations, return_inverse=True)
+            type_names, type_codes = np.unique(types, return_inverse=True)
+            location_names, type_names = location_names.tolist(), type_names.tolist()
+            current_location = timeline["current_location"]
+            timestamps = [a["timestamp"] for a, k in zip(activities, keep.tolist()) if k]
+            start, end = (timestamps[-1], timestamps[0]) if timestamps else (None, None)
+        else:
+            store = get_event_store()
+            if not store.ready:
+                return None
+            columns = store.entity_activity(entity_id)
+            epochs = columns["epochs"]
+            codes, location_codes = np.unique(columns["location_codes"], return_inverse=True)
+            location_names = store.locations.decode(codes)
+            type_codes, type_names = columns["source_codes"].astype(np.int64), store.source_names
+            current_location = location_names[location_codes[0]] if epochs.size else "Unknown"
+            start = from_epoch(int(epochs[-1])).isoformat() if epochs.size else None
+            end = from_epoch(int(epochs[0])).isoformat() if epochs.size else None
+        
+        if epochs.size == 0:
+            return None
+        return {
+            "epochs": epochs,
+            "hours": (epochs % DAY_SECONDS) // HOUR_SECONDS,
+            "location_codes": np.asarray(location_codes, dtype=np.int64).ravel(),
+            "location_names": location_names,
+            "type_codes": np.asarray(type_codes, dtype=np.int64).ravel(),
+            "type_names": list(type_names),
+            "current_location": current_location,
+            "start": start,
+            "end": end
+        }
+    
     @staticmethod
     def predict_next_location(entity_id: str) -> Dict[str, Any]:
         """
         Predict next likely location based on historical patterns
         """
         try:
-            timeline = DatabaseService.get_entity_timeline(entity_id)
-            if not timeline or not timeline.get("activities"):
+            activity = PredictiveMonitor._activity_columns(entity_id)
+            if not activity:
                 return {"error": "Insufficient data for prediction"}
             
-            activities = timeline["activities"]
-            
-            # Extract patterns from recent activities
-            location_frequency = Counter()
-            time_location_patterns = defaultdict(list)
-            location_transitions = defaultdict(Counter)
-            
-            for i, activity in enumerate(activities):
-                location = activity["location"]
-                timestamp = datetime.fromisoformat(activity["timestamp"].replace('Z', '+00:00'))
-                hour = timestamp.hour
-                day_of_week = timestamp.weekday()
-                
-                location_frequency[location] += 1
-                time_location_patterns[hour].append(location)
-                
-                # Track location transitions
-                if i > 0:
-                    prev_location = activities[i-1]["location"]
-                    location_transitions[prev_location][location] += 1
+            codes = activity["location_codes"]
+            names = activity["location_names"]
+            total = int(codes.size)
             
             # Get current time context
             now = datetime.now()
             current_hour = now.hour
-            current_day = now.weekday()
             
             # Calculate prediction scores
             predictions = []
-            current_location = timeline["current_location"]
+            current_location = activity["current_location"]
             
             # Based on time patterns
-            if current_hour in time_location_patterns:
-                time_based_locations = Counter(time_location_patterns[current_hour])
-                for loc, count in time_based_locations.most_common(5):
-                    prob = count / len(time_location_patterns[current_hour])
-                    predictions.append({
-                        "location": loc,
-                        "probability": prob,
-                        "method": "time_pattern",
-                        "evidence": f"Visited {count} times at hour {current_hour}"
-                    })
+            at_hour = codes[activity["hours"] == current_hour]
+            for code, count in _ranked(at_hour, 5):
+                predictions.append({
+                    "location": names[code],
+                    "probability": count / at_hour.size,
+                    "method": "time_pattern",
+                    "evidence": f"Visited {count} times at hour {current_hour}"
+                })
             
-            # Based on location transitions
-            if current_location in location_transitions:
-                for loc, count in location_transitions[current_location].most_common(3):
-                    total_transitions = sum(location_transitions[current_location].values())
-                    prob = count / total_transitions
+            # Based on location transitions (each activity to the one listed after it)
+            if current_location in names and total > 1:
+                following = codes[1:][codes[:-1] == names.index(current_location)]
+                for code, count in _ranked(following, 3):
+                    total_transitions = int(following.size)
                     predictions.append({
-                        "location": loc,
-                        "probability": prob,
+                        "location": names[code],
+                        "probability": count / total_transitions,
                         "method": "transition_pattern",
-                        "evidence": f"{count}/{total_transitions} times moved from {current_location} to {loc}"
+                        "evidence": f"{count}/{total_transitions} times moved from {current_location} to {names[code]}"
                     })
             
             # Based on overall frequency
-            for loc, count in location_frequency.most_common(5):
-                prob = count / len(activities)
+            for code, count in _ranked(codes, 5):
+                prob = count / total
                 predictions.append({
-                    "location": loc,
+                    "location": names[code],
                     "probability": prob * 0.5,  # Lower weight for general frequency
                     "method": "frequency",
-                    "evidence": f"Most frequent location ({count}/{len(activities)} visits)"
+                    "evidence": f"Most frequent location ({count}/{total} visits)"
                 })
             
             # Aggregate predictions for same location
@@ -113,7 +155,7 @@ class PredictiveMonitor:
                 "current_location": current_location,
                 "predicted_next_locations": final_predictions[:5],
                 "prediction_time": now.isoformat(),
-                "data_points_analyzed": len(activities),
+                "data_points_analyzed": total,
                 "explainability": {
                     "model_type": "pattern_based_ml",
                     "features_used": ["time_patterns", "location_transitions", "frequency_analysis"],
@@ -125,39 +167,34 @@ class PredictiveMonitor:
             print(f"Error predicting next location: {e}")
             return {"error": str(e)}
     
+    
     @staticmethod
     def detect_anomalies(entity_id: str) -> Dict[str, Any]:
         """
         Detect anomalous behavior patterns with explanations
         """
         try:
-            timeline = DatabaseService.get_entity_timeline(entity_id)
-            if not timeline or not timeline.get("activities"):
+            activity = PredictiveMonitor._activity_columns(entity_id)
+            if not activity:
                 return {"error": "Insufficient data for anomaly detection"}
             
-            activities = timeline["activities"]
+            location_names = activity["location_names"]
+            total_activities = int(activity["epochs"].size)
             anomalies = []
             
-            # Build baseline patterns
-            hour_activity = defaultdict(int)
-            location_frequency = Counter()
-            detection_type_frequency = Counter()
-            
-            for activity in activities:
-                timestamp = datetime.fromisoformat(activity["timestamp"].replace('Z', '+00:00'))
-                hour = timestamp.hour
-                hour_activity[hour] += 1
-                location_frequency[activity["location"]] += 1
-                detection_type_frequency[activity["detection_type"]] += 1
+            # Build baseline patterns: activity count per hour the entity was seen in
+            hour_activity = np.bincount(activity["hours"], minlength=24)
+            active_hours = np.flatnonzero(hour_activity)
+            hourly_counts = hour_activity[active_hours]
             
             # Calculate statistics
-            avg_hourly_activity = statistics.mean(hour_activity.values()) if hour_activity else 0
-            std_hourly_activity = statistics.stdev(hour_activity.values()) if len(hour_activity) > 1 else 0
+            avg_hourly_activity = float(hourly_counts.mean()) if hourly_counts.size else 0
+            std_hourly_activity = float(hourly_counts.std(ddof=1)) if hourly_counts.size > 1 else 0
             
             # Detect unusual time patterns
-            for hour, count in hour_activity.items():
-                if std_hourly_activity > 0:
-                    z_score = (count - avg_hourly_activity) / std_hourly_activity
+            if std_hourly_activity > 0:
+                z_scores = (hourly_counts - avg_hourly_activity) / std_hourly_activity
+                for hour, count, z_score in zip(active_hours.tolist(), hourly_counts.tolist(), z_scores.tolist()):
                     if abs(z_score) > 2:  # More than 2 standard deviations
                         anomalies.append({
                             "type": "unusual_time_pattern",
@@ -169,53 +206,46 @@ class PredictiveMonitor:
                         })
             
             # Detect rare locations
-            total_activities = len(activities)
-            for location, count in location_frequency.items():
+            location_frequency = _ranked(activity["location_codes"])
+            for code, count in location_frequency:
                 frequency = count / total_activities
                 if frequency < 0.05 and count > 1:  # Less than 5% but more than once
                     anomalies.append({
                         "type": "rare_location",
                         "severity": "low",
-                        "description": f"Infrequent visits to {location}",
+                        "description": f"Infrequent visits to {location_names[code]}",
                         "evidence": f"Only {count}/{total_activities} visits ({frequency:.1%})",
                         "explanation": "This location is rarely visited compared to usual patterns"
                     })
             
             # Detect missing expected patterns (gap detection)
-            if len(activities) > 1:
-                timestamps = [datetime.fromisoformat(a["timestamp"].replace('Z', '+00:00')) for a in activities]
-                timestamps.sort()
-                
-                gaps = []
-                for i in range(len(timestamps) - 1):
-                    gap = (timestamps[i] - timestamps[i + 1]).total_seconds() / 3600  # hours
-                    gaps.append(abs(gap))
-                
-                if gaps:
-                    avg_gap = statistics.mean(gaps)
-                    for i, gap in enumerate(gaps):
-                        if gap > avg_gap * 3:  # More than 3x average gap
-                            anomalies.append({
-                                "type": "unusual_gap",
-                                "severity": "medium",
-                                "description": f"Unusually long gap in activity",
-                                "evidence": f"Gap of {gap:.1f} hours, expected ~{avg_gap:.1f} hours",
-                                "explanation": "Extended period without any recorded activity"
-                            })
+            if total_activities > 1:
+                gaps = np.diff(np.sort(activity["epochs"])) / HOUR_SECONDS  # hours
+                avg_gap = float(gaps.mean())
+                for gap in gaps[gaps > avg_gap * 3].tolist():  # More than 3x average gap
+                    anomalies.append({
+                        "type": "unusual_gap",
+                        "severity": "medium",
+                        "description": f"Unusually long gap in activity",
+                        "evidence": f"Gap of {gap:.1f} hours, expected ~{avg_gap:.1f} hours",
+                        "explanation": "Extended period without any recorded activity"
+                    })
             
             return {
                 "entity_id": entity_id,
                 "anomalies_detected": len(anomalies),
                 "anomalies": anomalies,
                 "analysis_period": {
-                    "start": activities[-1]["timestamp"] if activities else None,
-                    "end": activities[0]["timestamp"] if activities else None,
-                    "total_activities": len(activities)
+                    "start": activity["start"],
+                    "end": activity["end"],
+                    "total_activities": total_activities
                 },
                 "baseline_stats": {
                     "avg_hourly_activity": avg_hourly_activity,
-                    "most_common_locations": [loc for loc, _ in location_frequency.most_common(3)],
-                    "most_common_detection_types": [dt for dt, _ in detection_type_frequency.most_common(3)]
+                    "most_common_locations": [location_names[code] for code, _ in location_frequency[:3]],
+                    "most_common_detection_types": [
+                        activity["type_names"][code] for code, _ in _ranked(activity["type_codes"], 3)
+                    ]
                 }
             }
             
@@ -230,7 +260,6 @@ class PredictiveMonitor:
         """
         try:
             profile = DatabaseService.get_profile_by_entity_id(entity_id)
-            timeline = DatabaseService.get_entity_timeline(entity_id)
             
             if not profile:
                 return {"error": "Entity not found"}
@@ -257,49 +286,42 @@ class PredictiveMonitor:
                         "evidence": f"Email domain contains 'sci': {email}"
                     })
             
-            # Infer typical schedule from timeline
-            if timeline and timeline.get("activities"):
-                activities = timeline["activities"]
-                hour_counts = defaultdict(int)
-                
-                for activity in activities:
-                    timestamp = datetime.fromisoformat(activity["timestamp"].replace('Z', '+00:00'))
-                    hour = timestamp.hour
-                    hour_counts[hour] += 1
-                
-                peak_hours = sorted(hour_counts.items(), key=lambda x: x[1], reverse=True)[:3]
+            # Infer typical schedule from activity
+            activity = PredictiveMonitor._activity_columns(entity_id)
+            if activity:
+                total_activities = int(activity["epochs"].size)
+                peak_hours = _ranked(activity["hours"], 3)
                 if peak_hours:
                     inferences.append({
                         "field": "typical_active_hours",
                         "inferred_value": [f"{h:02d}:00-{(h+1)%24:02d}:00" for h, _ in peak_hours],
                         "confidence": 0.85,
                         "method": "activity_pattern_analysis",
-                        "evidence": f"Peak activity hours based on {len(activities)} data points"
+                        "evidence": f"Peak activity hours based on {total_activities} data points"
                     })
                 
                 # Infer primary locations
-                location_counts = Counter([a["location"] for a in activities])
-                primary_locations = location_counts.most_common(2)
+                primary_locations = _ranked(activity["location_codes"], 2)
                 if primary_locations:
                     inferences.append({
                         "field": "primary_locations",
-                        "inferred_value": [loc for loc, _ in primary_locations],
+                        "inferred_value": [activity["location_names"][code] for code, _ in primary_locations],
                         "confidence": 0.9,
                         "method": "location_frequency_analysis",
                         "evidence": f"Based on {sum(count for _, count in primary_locations)} visits"
                     })
-            
-            # Infer role from activity patterns
-            if timeline and timeline.get("activities"):
-                detection_types = Counter([a["detection_type"] for a in timeline["activities"]])
                 
-                if detection_types.get("lab_bookings", 0) > len(timeline["activities"]) * 0.3:
+                # Infer role from activity patterns
+                type_names = activity["type_names"]
+                lab_bookings = int(np.count_nonzero(activity["type_codes"] == type_names.index("lab_bookings"))) \
+                    if "lab_bookings" in type_names else 0
+                if lab_bookings > total_activities * 0.3:
                     inferences.append({
                         "field": "likely_role_activity",
                         "inferred_value": "Research/Lab-based",
                         "confidence": 0.75,
                         "method": "activity_type_analysis",
-                        "evidence": f"{detection_types['lab_bookings']} lab bookings out of {len(timeline['activities'])} activities"
+                        "evidence": f"{lab_bookings} lab bookings out of {total_activities} activities"
                     })
             
             return {
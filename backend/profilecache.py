@@ -0,0 +1,217 @@
+"""
+Profile Cache
+Process-wide TTL + LRU cache of profile rows keyed by entity_id, bounded by
+entry count and approximate size, with a per-request memo on top so one
+request never fetches the same profile twice
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+from storage import add_write_listener
+
+# Seconds a cached profile is served before it is fetched again; 0 disables the cache
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "60"))
+# Most profiles held at once
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+# Approximate bytes of profile data held at once
+PROFILE_CACHE_MAX_BYTES = int(os.getenv("PROFILE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# entity_id -> profile (or None) for the request being served, if any
+_request_memo: ContextVar[Optional[Dict[str, Any]]] = ContextVar("profile_request_memo", default=None)
+
+
+def _profile_size(profile: Dict[str, Any]) -> int:
+    """Rough in-memory footprint of a profile row"""
+    return 64 + sum(len(str(key)) + len(str(value)) + 16 for key, value in profile.items())
+
+
+class ProfileCache:
+    """
+    Least-recently-used profiles, each served for at most `ttl` seconds
+
+    Entries are evicted oldest-use first once either `max_entries` or
+    `max_bytes` is exceeded. Lookups of entities that have no profile are not
+    cached, so newly created profiles show up immediately. A profile loaded
+    while its entry was invalidated is returned but not cached, since the read
+    may predate the write.
+    """
+
+    def __init__(self, ttl: float = PROFILE_CACHE_TTL_SECONDS,
+                 max_entries: int = PROFILE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = PROFILE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # entity_id -> (expires at, size, profile), least recently used first
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        # Bumped by every full invalidation
+        self._epoch = 0
+        # entity_id -> [loads in flight, invalidations since the first of them started]
+        self._loads: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "memo_hits": 0, "evictions": 0, "expirations": 0, "invalidations": 0,
+                      "stale_loads": 0}
+
+    def get(self, entity_id: str, load: Callable[[str, Tuple[int, int]], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """
+        The profile for entity_id, calling load(entity_id, generation) on a miss; callers get their own copy
+        `generation` changes whenever entity_id is invalidated: loads that coalesce
+        concurrent reads must key on it, so no caller joins a read older than a write.
+        """
+        memo = _request_memo.get()
+        if memo is not None and entity_id in memo:
+            self.stats["memo_hits"] += 1
+            profile = memo[entity_id]
+            return dict(profile) if profile is not None else None
+
+        profile = self._lookup(entity_id)
+        if profile is None:
+            generation = self._begin_load(entity_id)
+            try:
+                profile = load(entity_id, generation)
+            finally:
+                current = self._end_load(entity_id, generation)
+            if profile is not None and current:
+                self.put(entity_id, profile)
+        if memo is not None:
+            memo[entity_id] = profile
+        return dict(profile) if profile is not None else None
+
+    def _lookup(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(entity_id)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(entity_id)
+                    self.stats["hits"] += 1
+                    return entry[2]
+                self._remove(entity_id)
+                self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            return None
+
+    def _begin_load(self, entity_id: str) -> Tuple[int, int]:
+        with self._lock:
+            loads = self._loads.setdefault(entity_id, [0, 0])
+            loads[0] += 1
+            return self._epoch, loads[1]
+
+    def _end_load(self, entity_id: str, generation: Tuple[int, int]) -> bool:
+        """Whether entity_id is still at `generation` (no invalidation since the load began)"""
+        with self._lock:
+            loads = self._loads[entity_id]
+            loads[0] -= 1
+            current = (self._epoch, loads[1]) == generation
+            if not loads[0]:
+                del self._loads[entity_id]
+            if not current:
+                self.stats["stale_loads"] += 1
+            return current
+
+    def put(self, entity_id: str, profile: Dict[str, Any]):
+        """Cache a profile row fetched elsewhere"""
+        if self.ttl <= 0:
+            return
+        size = _profile_size(profile)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(entity_id)
+            self._entries[entity_id] = (time.monotonic() + self.ttl, size, dict(profile))
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def _remove(self, entity_id: str):
+        entry = self._entries.pop(entity_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def invalidate(self, entity_ids: Optional[Iterable[str]] = None):
+        """Drop the given profiles, or every profile when entity_ids is None"""
+        entity_ids = None if entity_ids is None else list(entity_ids)
+        with self._lock:
+            if entity_ids is None:
+                self._entries.clear()
+                self._bytes = 0
+                self._epoch += 1
+            else:
+                for entity_id in entity_ids:
+                    self._remove(entity_id)
+                    loads = self._loads.get(entity_id)
+                    if loads is not None:
+                        loads[1] += 1
+            self.stats["invalidations"] += 1
+        memo = _request_memo.get()
+        if memo is not None:
+            if entity_ids is None:
+                memo.clear()
+            else:
+                for entity_id in entity_ids:
+                    memo.pop(entity_id, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Size and counters"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl
+            }
+
+
+@contextmanager
+def request_memo() -> Iterator[Dict[str, Any]]:
+    """Scope for a per-request profile memo (worker threads started via run_db share it)"""
+    token = _request_memo.set({})
+    try:
+        yield _request_memo.get()
+    finally:
+        _request_memo.reset(token)
+
+
+def _on_profiles_write(table: str, verb: str, rows: Optional[list], filters: list):
+    """Storage write listener: drop cached profiles a write may have changed"""
+    if table != "profiles":
+        return
+    if verb in ("insert", "upsert") and rows is not None:
+        entity_ids = [row.get("entity_id") for row in rows if isinstance(row, dict)]
+        if all(entity_ids):
+            get_profile_cache().invalidate(entity_ids)
+            return
+    for name, args in filters:
+        if name == "eq" and args[0] == "entity_id":
+            get_profile_cache().invalidate([args[1]])
+            return
+        if name == "in_" and args[0] == "entity_id":
+            get_profile_cache().invalidate(args[1])
+            return
+    get_profile_cache().invalidate()
+
+
+# Global cache instance (lazy loaded)
+_profile_cache_instance: Optional[ProfileCache] = None
+_profile_cache_lock = threading.Lock()
+
+
+def get_profile_cache() -> ProfileCache:
+    """Get or create the global profile cache, invalidated by every profiles write"""
+    global _profile_cache_instance
+    if _profile_cache_instance is None:
+        with _profile_cache_lock:
+            if _profile_cache_instance is None:
+                _profile_cache_instance = ProfileCache()
+                add_write_listener(_on_profiles_write)
+    return _profile_cache_instance
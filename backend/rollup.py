@@ -0,0 +1,199 @@
+"""
+Hourly Activity Rollup
+Incrementally maintained (hour, location, source) -> event count and
+distinct-entity sketch, so analytics windows are answered without
+rescanning the raw event tables
+"""
+
+import os
+import threading
+from hashlib import blake2b
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from timeutil import HOUR_SECONDS, DAY_SECONDS, MISSING_EPOCH, floor_hour, floor_day, now_epoch
+from incremental import EventIndex
+
+# Seconds a rollup may lag the event tables before a background refresh is started
+ROLLUP_REFRESH_SECONDS = float(os.getenv("ROLLUP_REFRESH_SECONDS", "30"))
+
+# Days of history loaded on the first build; 0 loads everything
+ROLLUP_BACKFILL_DAYS = int(os.getenv("ROLLUP_BACKFILL_DAYS", "0"))
+
+# Event sources: table -> (time column, location column, entity column)
+ROLLUP_SOURCES = {
+    "swipes": ("timestamp", "location_id", "entity_id"),
+    "wifi_logs": ("timestamp", "ap_id", "entity_id"),
+    "cctv_frame": ("timestamp", "location_id", "identity"),
+    "lab_bookings": ("start_time", "lab_id", "entity_id"),
+}
+
+# HyperLogLog precision: 2^10 registers, about 3% standard error
+SKETCH_PRECISION = 10
+SKETCH_REGISTERS = 1 << SKETCH_PRECISION
+# Registers kept in a dict until this many are set, then stored densely
+SKETCH_SPARSE_LIMIT = 64
+
+
+def _sketch_position(value: str) -> Tuple[int, int]:
+    """Register index and rank for a value (stable across processes, unlike hash())"""
+    h = int.from_bytes(blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+    remaining_bits = 64 - SKETCH_PRECISION
+    rest = h & ((1 << remaining_bits) - 1)
+    return h >> remaining_bits, remaining_bits - rest.bit_length() + 1
+
+
+def estimate_distinct(registers: np.ndarray) -> int:
+    """HyperLogLog cardinality estimate with the small-range correction"""
+    m = SKETCH_REGISTERS
+    zeros = int(np.count_nonzero(registers == 0))
+    if zeros == m:
+        return 0
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -registers.astype(np.int32))))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+class EntitySketch:
+    """Distinct-entity counter; sparse while small, a dense register array once it grows"""
+
+    __slots__ = ("sparse", "dense")
+
+    def __init__(self):
+        self.sparse: Dict[int, int] = {}
+        self.dense: Optional[np.ndarray] = None
+
+    def add(self, value: str):
+        index, rank = _sketch_position(value)
+        if self.dense is not None:
+            if rank > self.dense[index]:
+                self.dense[index] = rank
+            return
+        if rank > self.sparse.get(index, 0):
+            self.sparse[index] = rank
+            if len(self.sparse) > SKETCH_SPARSE_LIMIT:
+                self.dense = np.zeros(SKETCH_REGISTERS, dtype=np.uint8)
+                self.merge_into(self.dense)
+                self.sparse = {}
+
+    def merge_into(self, registers: np.ndarray):
+        """Fold this sketch into a dense register array in place"""
+        if self.dense is not None:
+            np.maximum(registers, self.dense, out=registers)
+        elif self.sparse:
+            index = np.fromiter(self.sparse.keys(), dtype=np.intp, count=len(self.sparse))
+            ranks = np.fromiter(self.sparse.values(), dtype=np.uint8, count=len(self.sparse))
+            registers[index] = np.maximum(registers[index], ranks)
+
+
+class RollupCell:
+    """Event count and distinct-entity sketch for one (hour, location, source)"""
+
+    __slots__ = ("count", "sketch")
+
+    def __init__(self):
+        self.count = 0
+        self.sketch = EntitySketch()
+
+
+class HourlyRollup(EventIndex):
+    """In-memory hourly activity cube"""
+
+    name = "rollup"
+
+    def __init__(self, scan: Callable[..., Iterable[Dict[str, Any]]], keys: Dict[str, str],
+                 sources: Dict[str, Tuple[str, str, str]] = ROLLUP_SOURCES,
+                 backfill_days: int = ROLLUP_BACKFILL_DAYS):
+        super().__init__(scan, keys, sources, backfill_days, ROLLUP_REFRESH_SECONDS)
+        self.hours: Dict[int, Dict[Tuple[str, str], RollupCell]] = {}
+        self.totals: Dict[str, int] = {source: 0 for source in sources}
+
+    def _apply(self, source: str, rows: List[Dict[str, Any]], epochs: np.ndarray):
+        _, location_column, entity_column = self.sources[source]
+        hours = (epochs - epochs % HOUR_SECONDS).tolist()
+        for row, hour, epoch in zip(rows, hours, epochs.tolist()):
+            if epoch == MISSING_EPOCH:
+                continue
+            bucket = self.hours.setdefault(hour, {})
+            cell_key = (row.get(location_column) or "unknown", source)
+            cell = bucket.get(cell_key)
+            if cell is None:
+                cell = bucket[cell_key] = RollupCell()
+            cell.count += 1
+            if row.get(entity_column):
+                cell.sketch.add(str(row[entity_column]))
+            self.totals[source] += 1
+
+    # ---- queries (windows are aligned to whole hours, both ends inclusive) ----
+
+    def _cells(self, start_epoch: int, end_epoch: int, sources: Iterable[str]):
+        wanted = set(sources)
+        for hour in range(floor_hour(start_epoch), floor_hour(end_epoch) + 1, HOUR_SECONDS):
+            bucket = self.hours.get(hour)
+            if bucket:
+                for (location, source), cell in bucket.items():
+                    if source in wanted:
+                        yield hour, location, source, cell
+
+    def activity(self, start_epoch: int, end_epoch: int, sources: Iterable[str]) -> Tuple[int, int]:
+        """(event count, approximate distinct entities) over a window"""
+        registers = np.zeros(SKETCH_REGISTERS, dtype=np.uint8)
+        events = 0
+        with self._lock:
+            for _, _, _, cell in self._cells(start_epoch, end_epoch, sources):
+                events += cell.count
+                cell.sketch.merge_into(registers)
+        return events, estimate_distinct(registers)
+
+    def daily_activity(self, start_epoch: int, end_epoch: int, sources: Iterable[str]) -> Dict[int, Tuple[int, int]]:
+        """Per UTC day in the window: day epoch -> (event count, approximate distinct entities)"""
+        result = {}
+        for day in range(floor_day(start_epoch), floor_day(end_epoch) + 1, DAY_SECONDS):
+            result[day] = self.activity(max(day, start_epoch), min(day + DAY_SECONDS - 1, end_epoch), sources)
+        return result
+
+    def source_counts(self, start_epoch: Optional[int] = None, end_epoch: Optional[int] = None) -> Dict[str, int]:
+        """Event count per source in a window, or all time when unbounded"""
+        with self._lock:
+            if start_epoch is None and end_epoch is None:
+                return dict(self.totals)
+            counts = {source: 0 for source in self.sources}
+            for _, _, source, cell in self._cells(start_epoch or 0, end_epoch or now_epoch(), self.sources):
+                counts[source] += cell.count
+        return counts
+
+    def hourly_counts(self, start_epoch: int, end_epoch: int, sources: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(hour epochs, event counts) as int64 arrays over a window, one entry per cell"""
+        hours, counts = [], []
+        with self._lock:
+            for hour, _, _, cell in self._cells(start_epoch, end_epoch, sources):
+                hours.append(hour)
+                counts.append(cell.count)
+        return np.array(hours, dtype=np.int64), np.array(counts, dtype=np.int64)
+
+
+# Global rollup instance (lazy loaded)
+_rollup_instance: Optional[HourlyRollup] = None
+_rollup_lock = threading.Lock()
+
+
+def get_rollup() -> HourlyRollup:
+    """Get or create the global rollup, fed by DatabaseService.stream_window"""
+    global _rollup_instance
+    if _rollup_instance is None:
+        with _rollup_lock:
+            if _rollup_instance is None:
+                from database import DatabaseService, EVENT_TABLE_KEYS
+                _rollup_instance = HourlyRollup(DatabaseService.stream_window, EVENT_TABLE_KEYS)
+    return _rollup_instance
+
+
+def serving_rollup(start_epoch: Optional[int] = None) -> Optional[HourlyRollup]:
+    """
+    The global rollup if it is built and covers the window, else None
+    Callers fall back to scanning the raw tables while the first build runs
+    """
+    rollup = get_rollup()
+    rollup.ensure_fresh()
+    return rollup if rollup.covers(start_epoch) else None
@@ -0,0 +1,436 @@
+"""
+Profile Search Index
+In-memory trigram, word and value-prefix inverted index over profile name, email,
+department and entity_id, so substring search and autocomplete never scan
+the profiles table
+"""
+
+import os
+import re
+import time
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from storage import add_write_listener
+
+# Seconds between full rebuilds, which pick up profile changes made outside this service
+PROFILE_SEARCH_REFRESH_SECONDS = float(os.getenv("PROFILE_SEARCH_REFRESH_SECONDS", "300"))
+
+# Indexed fields and their ranking weights
+SEARCH_FIELDS = ("name", "email", "department", "entity_id")
+FIELD_WEIGHTS = {"name": 1.0, "entity_id": 0.9, "email": 0.8, "department": 0.5}
+
+# Match quality, best first: whole value, value prefix, word prefix, anywhere inside
+MATCH_SCORES = {"exact": 4, "prefix": 3, "word": 2, "substring": 1}
+
+# Changed profiles held outside the arrays before a rebuild is started
+MAX_DELTA = 5000
+
+_WORD = re.compile(r"[0-9a-z]+")
+_EMPTY = np.empty(0, dtype=np.int32)
+
+
+def _normalize(value: Any) -> str:
+    return str(value).strip().lower() if value is not None else ""
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def match_quality(query: str, value: str) -> Optional[str]:
+    """How a lower-cased value matches a lower-cased query, or None if it does not"""
+    if not value:
+        return None
+    if value == query:
+        return "exact"
+    if value.startswith(query):
+        return "prefix"
+    if any(word.startswith(query) for word in _WORD.findall(value)):
+        return "word"
+    if query in value:
+        return "substring"
+    return None
+
+
+class _Postings:
+    """
+    Terms -> sorted int32 document numbers, frozen into one CSR array pair
+    Terms are kept sorted so a prefix maps to one contiguous range
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._term_ids, self._doc_ids = array("i"), array("i")
+
+    def add(self, term: str, doc: int):
+        term_id = self._ids.get(term)
+        if term_id is None:
+            term_id = self._ids[term] = len(self._ids)
+        self._term_ids.append(term_id)
+        self._doc_ids.append(doc)
+
+    def freeze(self):
+        self.vocabulary = sorted(self._ids)
+        rank = np.empty(len(self.vocabulary), dtype=np.int32)
+        rank[[self._ids[term] for term in self.vocabulary]] = np.arange(len(self.vocabulary), dtype=np.int32)
+        term_ranks = rank[np.frombuffer(self._term_ids, dtype=np.int32)]
+        self.docs = np.frombuffer(self._doc_ids, dtype=np.int32)[np.argsort(term_ranks, kind="stable")]
+        self.offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ranks, minlength=len(self.vocabulary)), out=self.offsets[1:])
+        del self._ids, self._term_ids, self._doc_ids
+
+    def exact(self, term: str) -> np.ndarray:
+        i = bisect_left(self.vocabulary, term)
+        if i < len(self.vocabulary) and self.vocabulary[i] == term:
+            return self.docs[self.offsets[i]:self.offsets[i + 1]]
+        return _EMPTY
+
+    def prefix(self, prefix: str) -> np.ndarray:
+        """Documents of every term starting with prefix (may repeat)"""
+        lo = bisect_left(self.vocabulary, prefix)
+        hi = bisect_left(self.vocabulary, prefix + "\uffff")
+        return self.docs[self.offsets[lo]:self.offsets[hi]]
+
+    def containing(self, fragment: str) -> np.ndarray:
+        """Documents of every term containing fragment (may repeat); scans the vocabulary"""
+        ranges = [(self.offsets[i], self.offsets[i + 1]) for i, term in enumerate(self.vocabulary) if fragment in term]
+        if not ranges:
+            return _EMPTY
+        return np.concatenate([self.docs[lo:hi] for lo, hi in ranges])
+
+    def nbytes(self) -> int:
+        return self.docs.nbytes + self.offsets.nbytes
+
+
+class _Segment:
+    """
+    Immutable index over a batch of profiles: per field, whole values, words and
+    trigrams, plus the documents whose value is too short to have a trigram
+    """
+
+    def __init__(self, profiles: Iterable[Dict[str, Any]]):
+        entity_ids: List[str] = []
+        self.values: List[Tuple[str, ...]] = []
+        self.lowered: List[List[str]] = [[] for _ in SEARCH_FIELDS]
+        self.whole = [_Postings() for _ in SEARCH_FIELDS]
+        self.words = [_Postings() for _ in SEARCH_FIELDS]
+        self.trigrams = [_Postings() for _ in SEARCH_FIELDS]
+        short: List[List[int]] = [[] for _ in SEARCH_FIELDS]
+
+        for doc, profile in enumerate(profiles):
+            entity_ids.append(profile.get("entity_id"))
+            values = tuple("" if profile.get(field) is None else str(profile.get(field)) for field in SEARCH_FIELDS)
+            self.values.append(values)
+            for field_index, value in enumerate(values):
+                text = _normalize(value)
+                self.lowered[field_index].append(text)
+                if not text:
+                    continue
+                self.whole[field_index].add(text, doc)
+                for word in set(_WORD.findall(text)):
+                    self.words[field_index].add(word, doc)
+                add = self.trigrams[field_index].add
+                for trigram in _trigrams(text):
+                    add(trigram, doc)
+                if len(text) < 3:
+                    short[field_index].append(doc)
+
+        for postings in (*self.whole, *self.words, *self.trigrams):
+            postings.freeze()
+        self.short = [np.array(docs, dtype=np.int32) for docs in short]
+        self.entity_ids = np.array(entity_ids, dtype=object)
+        self.name_lengths = np.array([len(values[0]) for values in self.values], dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.entity_ids)
+
+    def score(self, query: str, field_indexes: Sequence[int]) -> np.ndarray:
+        """Best match score per document (0 = no match), one vectorized pass per field and match kind"""
+        scores = np.zeros(len(self), dtype=np.int32)
+        for field_index in field_indexes:
+            weight = FIELD_WEIGHTS[SEARCH_FIELDS[field_index]]
+            word_docs = self.words[field_index].prefix(query)
+            tiers = [
+                (self.whole[field_index].exact(query), "exact"),
+                (self.whole[field_index].prefix(query), "prefix"),
+                (word_docs, "word"),
+            ]
+            if len(query) >= 3:
+                postings = sorted((self.trigrams[field_index].exact(t) for t in _trigrams(query)), key=len)
+                docs = postings[0]
+                for posting in postings[1:]:
+                    if not docs.size:
+                        break
+                    docs = np.intersect1d(docs, posting, assume_unique=True)
+                if docs.size and len(query) > 3:
+                    # Trigrams can match out of order: confirm the ones not already matched at a word start
+                    matched = np.zeros(len(self), dtype=bool)
+                    matched[word_docs] = True
+                    lowered = self.lowered[field_index]
+                    docs = docs[~matched[docs]]
+                    docs = np.array([doc for doc in docs.tolist() if query in lowered[doc]], dtype=np.int32)
+            else:
+                # Shorter queries: every trigram containing them, and the values too short for a trigram
+                lowered = self.lowered[field_index]
+                short = [doc for doc in self.short[field_index].tolist() if query in lowered[doc]]
+                docs = np.concatenate([self.trigrams[field_index].containing(query), np.array(short, dtype=np.int32)])
+            tiers.append((docs, "substring"))
+            for docs, kind in tiers:
+                if docs.size:
+                    scores[docs] = np.maximum(scores[docs], int(MATCH_SCORES[kind] * 100 * weight))
+        return scores
+
+    def nbytes(self) -> int:
+        return (sum(postings.nbytes() for postings in (*self.whole, *self.words, *self.trigrams))
+                + sum(docs.nbytes for docs in self.short))
+
+
+class ProfileSearchIndex:
+    """
+    Substring / prefix search over profiles
+
+    Built in the background from a full profile scan into immutable numpy
+    posting arrays. Profiles written through the storage layer afterwards are
+    re-read on the next search and kept in a small delta that is scanned
+    directly; the arrays are rebuilt every PROFILE_SEARCH_REFRESH_SECONDS or
+    once the delta grows past MAX_DELTA.
+
+    Queries match anywhere in a field, like the ilike fallback. Those of three
+    or more characters intersect trigram postings; shorter ones collect the
+    postings of every trigram containing them.
+    """
+
+    def __init__(self, scan: Callable[[], Iterable[Dict[str, Any]]],
+                 fetch: Callable[[List[str]], List[Dict[str, Any]]],
+                 refresh_seconds: float = PROFILE_SEARCH_REFRESH_SECONDS):
+        self.scan = scan
+        self.fetch = fetch
+        self.refresh_seconds = refresh_seconds
+        self._segment: Optional[_Segment] = None
+        self._alive: Optional[np.ndarray] = None
+        self._positions: Dict[str, int] = {}
+        # entity_id -> (values, lowered) for profiles changed since the build; None if deleted
+        self._delta: Dict[str, Optional[Tuple[Tuple[str, ...], Tuple[str, ...]]]] = {}
+        self._dirty: Set[str] = set()
+        self._stale = False
+        self.ready = False
+        self.built_at = 0.0
+        self.build_seconds = 0.0
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+    # ---- maintenance ----
+
+    def rebuild(self):
+        """Re-read every profile and swap in fresh arrays"""
+        if not self._build_lock.acquire(blocking=False):
+            return
+        try:
+            started = time.monotonic()
+            with self._lock:
+                self._stale = False
+                self._dirty.clear()
+                pending = set(self._delta)
+            segment = _Segment(self.scan())
+            with self._lock:
+                self._segment = segment
+                self._alive = np.ones(len(segment), dtype=bool)
+                self._positions = {entity_id: doc for doc, entity_id in enumerate(segment.entity_ids.tolist())}
+                # Changes announced while the scan ran are fetched again on the next search
+                self._dirty |= set(self._delta) - pending
+                self._delta = {}
+                self.ready = True
+                self.built_at = time.monotonic()
+                self.build_seconds = self.built_at - started
+        except Exception as e:
+            print(f"Error building profile search index: {e}")
+        finally:
+            self._build_lock.release()
+
+    def ensure_fresh(self) -> bool:
+        """
+        Start a background rebuild when the arrays are stale or old
+        Never blocks; returns whether the index can serve queries yet
+        """
+        due = self._stale or time.monotonic() - self.built_at >= self.refresh_seconds or len(self._delta) > MAX_DELTA
+        if due and not self._build_lock.locked():
+            threading.Thread(target=self.rebuild, name="profile-search-build", daemon=True).start()
+        return self.ready
+
+    def mark_changed(self, entity_ids: Optional[Iterable[str]] = None):
+        """Profiles changed (all of them when entity_ids is None)"""
+        with self._lock:
+            if entity_ids is None:
+                self._stale = True
+            else:
+                self._dirty.update(entity_id for entity_id in entity_ids if entity_id)
+        if entity_ids is None:
+            self.ensure_fresh()
+
+    def _apply_dirty(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = list(self._dirty), set()
+        try:
+            profiles = {profile.get("entity_id"): profile for profile in self.fetch(dirty)}
+        except Exception as e:
+            print(f"Error refreshing profile search index: {e}")
+            with self._lock:
+                self._dirty.update(dirty)
+            return
+        with self._lock:
+            for entity_id in dirty:
+                doc = self._positions.get(entity_id)
+                if doc is not None:
+                    self._alive[doc] = False
+                profile = profiles.get(entity_id)
+                if profile is None:
+                    self._delta[entity_id] = None
+                else:
+                    values = tuple("" if profile.get(field) is None else str(profile.get(field)) for field in SEARCH_FIELDS)
+                    self._delta[entity_id] = (values, tuple(_normalize(value) for value in values))
+
+    # ---- queries ----
+
+    def _matches(self, query: str, fields: Sequence[str]):
+        """
+        (segment, per-document scores, delta matches) for a lower-cased query;
+        delta matches are entity_id -> (field values, score)
+        """
+        self._apply_dirty()
+        field_indexes = [SEARCH_FIELDS.index(field) for field in fields if field in SEARCH_FIELDS]
+        with self._lock:
+            segment, alive, delta = self._segment, self._alive, list(self._delta.items())
+
+        scores = segment.score(query, field_indexes)
+        scores[~alive] = 0
+
+        delta_matches: Dict[str, Tuple[Tuple[str, ...], int]] = {}
+        for entity_id, entry in delta:
+            if entry is None:
+                continue
+            values, lowered = entry
+            best = 0
+            for field_index in field_indexes:
+                quality = match_quality(query, lowered[field_index])
+                if quality:
+                    best = max(best, int(MATCH_SCORES[quality] * 100 * FIELD_WEIGHTS[SEARCH_FIELDS[field_index]]))
+            if best:
+                delta_matches[entity_id] = (values, best)
+        return segment, scores, delta_matches
+
+    def search_ids(self, query: str, fields: Sequence[str] = SEARCH_FIELDS) -> List[str]:
+        """entity_ids of every profile matching query in any of fields, in entity_id order"""
+        query = _normalize(query)
+        if not query:
+            return []
+        segment, scores, delta_matches = self._matches(query, fields)
+        entity_ids = segment.entity_ids[np.flatnonzero(scores)].tolist()
+        return sorted(set(entity_ids).union(delta_matches)) if delta_matches else sorted(entity_ids)
+
+    def search(self, query: str, fields: Sequence[str] = SEARCH_FIELDS, limit: Optional[int] = 10) -> List[Dict[str, Any]]:
+        """
+        Best `limit` matches (all when None), ranked by match quality and field
+        weight, then shorter names, then entity_id
+        """
+        query = _normalize(query)
+        if not query:
+            return []
+        segment, scores, delta_matches = self._matches(query, fields)
+        docs = np.flatnonzero(scores)
+        if limit is not None and docs.size > limit:
+            # Only documents scoring at least the limit-th best score can make the cut
+            cutoff = np.partition(scores[docs], docs.size - limit)[docs.size - limit]
+            docs = docs[scores[docs] >= cutoff]
+        docs = docs[np.lexsort((docs, segment.name_lengths[docs], -scores[docs]))]
+        if limit is not None:
+            docs = docs[:limit]
+
+        ranked = [
+            (-int(scores[doc]), len(segment.values[doc][0]), segment.entity_ids[doc], segment.values[doc])
+            for doc in docs.tolist()
+        ]
+        ranked += [(-score, len(values[0]), entity_id, values) for entity_id, (values, score) in delta_matches.items()]
+        ranked.sort(key=lambda item: item[:3])
+        return [
+            {**dict(zip(SEARCH_FIELDS, values)), "score": -negative_score}
+            for negative_score, _, _, values in ranked[:limit]
+        ]
+
+    def existing(self, entity_ids: Iterable[str]) -> List[str]:
+        """The given entity_ids that currently have a profile, in the order given"""
+        self._apply_dirty()
+        with self._lock:
+            positions, alive, delta = self._positions, self._alive, self._delta
+            return [
+                entity_id for entity_id in entity_ids
+                if (delta[entity_id] is not None if entity_id in delta
+                    else entity_id in positions and alive[positions[entity_id]])
+            ]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Size and build state"""
+        with self._lock:
+            segment = self._segment
+            return {
+                "ready": self.ready,
+                "profiles": int(self._alive.sum()) + sum(1 for entry in self._delta.values() if entry) if segment else 0,
+                "delta": len(self._delta),
+                "pending_changes": len(self._dirty),
+                "index_bytes": segment.nbytes() if segment else 0,
+                "build_seconds": round(self.build_seconds, 3),
+                "age_seconds": round(time.monotonic() - self.built_at, 1) if self.ready else None
+            }
+
+
+def _on_profiles_write(table: str, verb: str, rows: Optional[list], filters: list):
+    """Storage write listener: re-read the profiles a write touched"""
+    if table != "profiles":
+        return
+    index = get_search_index()
+    if verb in ("insert", "upsert") and rows is not None:
+        entity_ids = [row.get("entity_id") for row in rows if isinstance(row, dict)]
+        if all(entity_ids):
+            index.mark_changed(entity_ids)
+            return
+    for name, args in filters:
+        if name == "eq" and args[0] == "entity_id":
+            index.mark_changed([args[1]])
+            return
+        if name == "in_" and args[0] == "entity_id":
+            index.mark_changed(args[1])
+            return
+    index.mark_changed()
+
+
+# Global index instance (lazy loaded)
+_search_index_instance: Optional[ProfileSearchIndex] = None
+_search_index_lock = threading.Lock()
+
+
+def get_search_index() -> ProfileSearchIndex:
+    """Get or create the global profile search index, fed by DatabaseService"""
+    global _search_index_instance
+    if _search_index_instance is None:
+        with _search_index_lock:
+            if _search_index_instance is None:
+                from database import DatabaseService
+                _search_index_instance = ProfileSearchIndex(
+                    lambda: DatabaseService.iter_profiles(columns=", ".join(SEARCH_FIELDS)),
+                    DatabaseService.get_profiles_by_entity_ids
+                )
+                add_write_listener(_on_profiles_write)
+    return _search_index_instance
+
+
+def serving_search_index() -> Optional[ProfileSearchIndex]:
+    """
+    The global search index once its first build has finished, else None
+    Callers fall back to ilike queries while it is being built
+    """
+    index = get_search_index()
+    return index if index.ensure_fresh() else None
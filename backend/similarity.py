@@ -0,0 +1,92 @@
+"""
+Name Similarity Kernel
+Names normalized, tokenized and compiled to per-character bitmasks once.
+A bit-parallel LCS ratio (Hyyrö) bounds SequenceMatcher's ratio from above,
+so names that cannot reach a threshold are dropped without running
+SequenceMatcher; the rest are scored exactly as before
+"""
+
+import math
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, FrozenSet
+
+# Weights of the character-level ratio and the token Jaccard in a name similarity
+SEQUENCE_WEIGHT = 0.6
+TOKEN_WEIGHT = 0.4
+
+# Prepared names kept for repeated comparisons (queries, hot profiles)
+PREPARED_NAME_CACHE_SIZE = 4096
+
+
+class PreparedName:
+    """A name lower-cased and stripped, with its token set and LCS pattern bitmasks"""
+
+    __slots__ = ("text", "tokens", "masks", "full_mask")
+
+    def __init__(self, name: str):
+        self.text = name.lower().strip()
+        self.tokens: FrozenSet[str] = frozenset(self.text.split())
+        # character -> bit i set where text[i] is that character
+        self.masks: Dict[str, int] = {}
+        for i, char in enumerate(self.text):
+            self.masks[char] = self.masks.get(char, 0) | (1 << i)
+        self.full_mask = (1 << len(self.text)) - 1
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+
+@lru_cache(maxsize=PREPARED_NAME_CACHE_SIZE)
+def prepare_name(name: str) -> PreparedName:
+    """Cached PreparedName for a raw name"""
+    return PreparedName(name)
+
+
+def lcs_length(pattern: PreparedName, text: str, minimum: int = 0) -> int:
+    """
+    Length of the longest common subsequence of pattern and text
+    Bit-parallel over the pattern, one step per character of text; returns -1
+    as soon as the result can no longer reach `minimum`
+    """
+    masks, full, size = pattern.masks, pattern.full_mask, len(pattern)
+    v = full
+    remaining = len(text)
+    for char in text:
+        u = v & masks.get(char, 0)
+        v = ((v + u) | (v - u)) & full
+        remaining -= 1
+        if minimum and size - v.bit_count() + remaining < minimum:
+            return -1
+    return size - v.bit_count()
+
+
+def weighted_similarity(query: PreparedName, text: str, token_sim: float, threshold: float = 0.0) -> float:
+    """
+    SEQUENCE_WEIGHT * SequenceMatcher ratio + TOKEN_WEIGHT * token_sim between
+    a prepared query and a normalized name, 1.0 when they are equal.
+    Names whose LCS bound cannot reach `threshold` come back as 0.0 early.
+    """
+    if query.text == text:
+        return 1.0
+    total = len(query) + len(text)
+    minimum = 0
+    if threshold:
+        # One below the exact requirement, so rounding never drops a name at the threshold
+        minimum = max(0, math.ceil((threshold - token_sim * TOKEN_WEIGHT) / SEQUENCE_WEIGHT * total / 2) - 1)
+        if minimum > min(len(query), len(text)):
+            return 0.0
+    length = lcs_length(query, text, minimum)
+    if length < 0:
+        return 0.0
+    # SequenceMatcher's matching blocks are a common subsequence, so its ratio is at most the LCS ratio
+    if threshold and (2.0 * length / total) * SEQUENCE_WEIGHT + token_sim * TOKEN_WEIGHT < threshold - 1e-9:
+        return 0.0
+    return SequenceMatcher(None, query.text, text).ratio() * SEQUENCE_WEIGHT + token_sim * TOKEN_WEIGHT
+
+
+def name_similarity(name1: str, name2: str, threshold: float = 0.0) -> float:
+    """Similarity between two raw names, between 0 and 1; both are prepared once and cached"""
+    a, b = prepare_name(name1), prepare_name(name2)
+    token_sim = len(a.tokens & b.tokens) / len(a.tokens | b.tokens) if a.tokens and b.tokens else 0.0
+    return weighted_similarity(a, b.text, token_sim, threshold)
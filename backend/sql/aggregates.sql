@@ -0,0 +1,37 @@
+-- Server-side aggregates used by DatabaseService via RPC
+-- Apply once in the Supabase SQL editor. The local SQLite engine ships
+-- equivalent queries in storage.LOCAL_FUNCTIONS.
+
+-- Dashboard stats: profile total plus activity rows and distinct active
+-- entities across swipes and wifi_logs in [start_ts, end_ts]
+create or replace function dashboard_activity_stats(start_ts timestamptz, end_ts timestamptz)
+returns table(total_entities bigint, total_activities bigint, active_entities bigint)
+language sql stable as $$
+  with events as (
+    select entity_id from swipes where "timestamp" >= start_ts and "timestamp" <= end_ts
+    union all
+    select entity_id from wifi_logs where "timestamp" >= start_ts and "timestamp" <= end_ts
+  )
+  select (select count(*) from profiles), count(*), count(distinct entity_id) from events;
+$$;
+
+-- Source distribution: row counts per source table in [start_ts, end_ts];
+-- pass null bounds for all-time totals
+create or replace function source_distribution_counts(start_ts timestamptz default null, end_ts timestamptz default null)
+returns table(swipes bigint, wifi_logs bigint, cctv_frame bigint, lab_bookings bigint)
+language sql stable as $$
+  select
+    (select count(*) from swipes
+      where (start_ts is null or "timestamp" >= start_ts) and (end_ts is null or "timestamp" <= end_ts)),
+    (select count(*) from wifi_logs
+      where (start_ts is null or "timestamp" >= start_ts) and (end_ts is null or "timestamp" <= end_ts)),
+    (select count(*) from cctv_frame
+      where (start_ts is null or "timestamp" >= start_ts) and (end_ts is null or "timestamp" <= end_ts)),
+    (select count(*) from lab_bookings
+      where (start_ts is null or start_time >= start_ts) and (end_ts is null or start_time <= end_ts));
+$$;
+
+create index if not exists idx_swipes_timestamp on swipes ("timestamp");
+create index if not exists idx_wifi_logs_timestamp on wifi_logs ("timestamp");
+create index if not exists idx_cctv_frame_timestamp on cctv_frame ("timestamp");
+create index if not exists idx_lab_bookings_start_time on lab_bookings (start_time);
@@ -0,0 +1,747 @@
+"""
+Storage Backend Module
+Pluggable storage backends behind DatabaseService: Supabase (PostgREST) or a local SQLite engine
+"""
+
+import os
+import re
+import json
+import sqlite3
+import threading
+from typing import Callable, Optional, Dict, Any, List, Tuple
+from datetime import datetime, date
+from dotenv import load_dotenv
+
+load_dotenv("creds.env")
+
+# Shared connection pool size; also bounds concurrent data-access threads
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "64"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "30"))
+
+
+# Verbs that change rows; write listeners are told about each one that succeeds
+WRITE_VERBS = ("insert", "upsert", "update", "delete")
+
+# Callbacks run after every successful write: (table, verb, rows or None, filters)
+_write_listeners: List[Callable[[str, str, Optional[List[Dict[str, Any]]], List[Tuple[str, tuple]]], None]] = []
+
+
+def add_write_listener(listener: Callable[[str, str, Optional[List[Dict[str, Any]]], List[Tuple[str, tuple]]], None]):
+    """Register a callback run after every successful insert / upsert / update / delete"""
+    if listener not in _write_listeners:
+        _write_listeners.append(listener)
+
+
+class StorageError(Exception):
+    """Raised when a storage backend rejects a query"""
+
+
+class QueryResult:
+    """Result of an executed query (mirrors the supabase APIResponse shape)"""
+
+    def __init__(self, data: List[Dict[str, Any]], count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class Query:
+    """
+    Backend-neutral query builder
+    Records the same fluent calls as the supabase client so every backend can
+    compile them to its own dialect (PostgREST requests or SQL)
+    """
+
+    VERBS = ("select", "insert", "upsert", "update", "delete")
+    FILTERS = ("eq", "neq", "gt", "gte", "lt", "lte", "in_", "ilike", "is_", "or_")
+    MODIFIERS = ("order", "limit", "range")
+
+    def __init__(self, backend: "StorageBackend", table: str):
+        self.backend = backend
+        self.table = table
+        self.calls: List[Tuple[str, tuple, dict]] = []
+
+    def _record(self, name: str, *args, **kwargs) -> "Query":
+        self.calls.append((name, args, kwargs))
+        return self
+
+    def select(self, columns: str = "*", count: Optional[str] = None) -> "Query":
+        return self._record("select", columns, count=count)
+
+    def insert(self, rows, returning: str = "representation") -> "Query":
+        return self._record("insert", rows, returning=returning)
+
+    def upsert(self, rows, on_conflict: str = "", returning: str = "representation") -> "Query":
+        return self._record("upsert", rows, on_conflict=on_conflict, returning=returning)
+
+    def update(self, values: Dict[str, Any]) -> "Query":
+        return self._record("update", values)
+
+    def delete(self) -> "Query":
+        return self._record("delete")
+
+    def eq(self, column: str, value) -> "Query":
+        return self._record("eq", column, value)
+
+    def neq(self, column: str, value) -> "Query":
+        return self._record("neq", column, value)
+
+    def gt(self, column: str, value) -> "Query":
+        return self._record("gt", column, value)
+
+    def gte(self, column: str, value) -> "Query":
+        return self._record("gte", column, value)
+
+    def lt(self, column: str, value) -> "Query":
+        return self._record("lt", column, value)
+
+    def lte(self, column: str, value) -> "Query":
+        return self._record("lte", column, value)
+
+    def in_(self, column: str, values) -> "Query":
+        return self._record("in_", column, list(values))
+
+    def ilike(self, column: str, pattern: str) -> "Query":
+        return self._record("ilike", column, pattern)
+
+    def is_(self, column: str, value) -> "Query":
+        return self._record("is_", column, value)
+
+    def or_(self, filters: str) -> "Query":
+        return self._record("or_", filters)
+
+    def order(self, column: str, desc: bool = False) -> "Query":
+        return self._record("order", column, desc=desc)
+
+    def limit(self, size: int) -> "Query":
+        return self._record("limit", size)
+
+    def range(self, start: int, end: int) -> "Query":
+        return self._record("range", start, end)
+
+    def execute(self) -> QueryResult:
+        result = self.backend.execute(self)
+        verb = self.calls[0][0] if self.calls else None
+        if verb in WRITE_VERBS and _write_listeners:
+            rows = self.calls[0][1][0] if verb in ("insert", "upsert") else None
+            rows = [rows] if isinstance(rows, dict) else rows
+            filters = [(name, args) for name, args, _ in self.calls if name in self.FILTERS]
+            for listener in list(_write_listeners):
+                listener(self.table, verb, rows, filters)
+        return result
+
+
+class StorageBackend:
+    """Interface every storage backend implements"""
+
+    name = "base"
+
+    def table(self, name: str) -> Query:
+        return Query(self, name)
+
+    def execute(self, query: Query) -> QueryResult:
+        raise NotImplementedError
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> QueryResult:
+        """Call a server-side function (see sql/aggregates.sql)"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release connections held by the backend"""
+
+
+# ============================================
+# SUPABASE BACKEND
+# ============================================
+_POSTGREST_OPERATORS = {"eq": "eq", "neq": "neq", "gt": "gt", "gte": "gte", "lt": "lt",
+                        "lte": "lte", "ilike": "ilike", "is_": "is"}
+
+
+def _postgrest_value(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _postgrest_list_item(value) -> str:
+    text = _postgrest_value(value)
+    if any(c in text for c in ',()"'):
+        return '"' + text.replace('"', '\\"') + '"'
+    return text
+
+
+class SupabaseBackend(StorageBackend):
+    """
+    Supabase (PostgREST) backend
+    Compiles recorded queries to PostgREST requests over one shared, pooled HTTP client
+    """
+
+    name = "supabase"
+
+    def __init__(self, url: str, key: str, pool_size: int = DB_MAX_CONCURRENCY,
+                 timeout: float = DB_TIMEOUT_SECONDS):
+        import httpx
+        self.client = httpx.Client(
+            base_url=f"{url.rstrip('/')}/rest/v1",
+            headers={
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=timeout,
+        )
+
+    def close(self):
+        self.client.close()
+
+    @staticmethod
+    def _compile_params(query: Query) -> List[Tuple[str, str]]:
+        params, order = [], []
+        for name, args, kwargs in query.calls:
+            if name == "select":
+                params.append(("select", "".join(args[0].split())))
+            elif name in _POSTGREST_OPERATORS:
+                params.append((args[0], f"{_POSTGREST_OPERATORS[name]}.{_postgrest_value(args[1])}"))
+            elif name == "in_":
+                params.append((args[0], f"in.({','.join(_postgrest_list_item(v) for v in args[1])})"))
+            elif name == "or_":
+                params.append(("or", f"({args[0]})"))
+            elif name == "order":
+                order.append(f"{args[0]}.{'desc' if kwargs.get('desc') else 'asc'}")
+            elif name == "limit":
+                params.append(("limit", str(args[0])))
+            elif name == "range":
+                params.append(("offset", str(args[0])))
+                params.append(("limit", str(args[1] - args[0] + 1)))
+            elif name == "upsert" and kwargs.get("on_conflict"):
+                params.append(("on_conflict", kwargs["on_conflict"]))
+        if order:
+            params.append(("order", ",".join(order)))
+        return params
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> QueryResult:
+        response = self.client.post(f"/rpc/{name}", content=json.dumps(params or {}, default=str))
+        if response.status_code >= 400:
+            raise StorageError(f"{response.status_code} rpc/{name}: {response.text}")
+        data = response.json() if response.content else []
+        return QueryResult(data if isinstance(data, list) else [data])
+
+    def execute(self, query: Query) -> QueryResult:
+        verb, verb_args, verb_kwargs = next(
+            ((n, a, k) for n, a, k in query.calls if n in Query.VERBS), ("select", ("*",), {})
+        )
+        params = self._compile_params(query)
+        headers = {}
+        body = None
+        if verb == "select":
+            method = "GET"
+            if verb_kwargs.get("count"):
+                headers["Prefer"] = f"count={verb_kwargs['count']}"
+        elif verb == "insert":
+            method, body = "POST", verb_args[0]
+            headers["Prefer"] = f"return={verb_kwargs.get('returning', 'representation')}"
+        elif verb == "upsert":
+            method, body = "POST", verb_args[0]
+            headers["Prefer"] = f"resolution=merge-duplicates,return={verb_kwargs.get('returning', 'representation')}"
+        elif verb == "update":
+            method, body = "PATCH", verb_args[0]
+            headers["Prefer"] = "return=representation"
+        else:
+            method = "DELETE"
+            headers["Prefer"] = "return=representation"
+
+        response = self.client.request(
+            method, f"/{query.table}", params=params, headers=headers,
+            content=json.dumps(body, default=str) if body is not None else None,
+        )
+        if response.status_code >= 400:
+            raise StorageError(f"{response.status_code} {query.table}: {response.text}")
+
+        data = response.json() if response.content else []
+        count = None
+        content_range = response.headers.get("content-range", "")
+        if "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            count = int(total) if total.isdigit() else None
+        return QueryResult(data, count)
+
+
+# ============================================
+# LOCAL SQLITE BACKEND
+# ============================================
+# Column definitions for the local engine. JSON columns are stored as text and
+# decoded on read; unknown columns are added on first insert.
+LOCAL_SCHEMA: Dict[str, List[Tuple[str, str]]] = {
+    "profiles": [
+        ("entity_id", "TEXT PRIMARY KEY"), ("name", "TEXT"), ("role", "TEXT"),
+        ("email", "TEXT"), ("department", "TEXT"), ("student_id", "TEXT"),
+        ("staff_id", "TEXT"), ("card_id", "TEXT"), ("device_hash", "TEXT"),
+        ("face_id", "TEXT"), ("metadata_json", "JSON"),
+    ],
+    "swipes": [
+        ("swipe_id", "INTEGER PRIMARY KEY"), ("identity", "TEXT"), ("entity_id", "TEXT"),
+        ("card_id", "TEXT"), ("location_id", "TEXT"), ("timestamp", "TEXT"),
+        ("raw_record_json", "JSON"),
+    ],
+    "wifi_logs": [
+        ("log_id", "INTEGER PRIMARY KEY"), ("identity", "TEXT"), ("entity_id", "TEXT"),
+        ("device_hash", "TEXT"), ("ap_id", "TEXT"), ("timestamp", "TEXT"),
+        ("raw_record_json", "JSON"),
+    ],
+    "lab_bookings": [
+        ("booking_id", "TEXT"), ("identity", "TEXT"), ("entity_id", "TEXT"),
+        ("lab_id", "TEXT"), ("room_id", "TEXT"), ("start_time", "TEXT"),
+        ("end_time", "TEXT"), ("booking_time", "TEXT"), ("attended_flag", "BOOLEAN"),
+        ("metadata", "JSON"),
+    ],
+    "library_checkouts": [
+        ("checkout_id", "TEXT"), ("identity", "TEXT"), ("entity_id", "TEXT"),
+        ("book_id", "TEXT"), ("timestamp", "TEXT"),
+    ],
+    "notes": [
+        ("identity", "TEXT"), ("entity_id", "TEXT"), ("source", "TEXT"),
+        ("text", "TEXT"), ("timestamp", "TEXT"),
+    ],
+    "cctv_frame": [
+        ("frame_id", "TEXT"), ("identity", "TEXT"), ("location_id", "TEXT"),
+        ("timestamp", "TEXT"), ("face_id", "TEXT"),
+    ],
+    "face_embedding": [
+        ("identity", "TEXT"), ("face_id", "TEXT"), ("embedding", "TEXT"),
+    ],
+    "timeline": [
+        ("entity_id", "TEXT PRIMARY KEY"), ("detection_types", "JSON"),
+        ("locations", "JSON"), ("timestamps", "JSON"),
+    ],
+    "alerts": [
+        ("id", "TEXT"), ("entity_id", "TEXT"), ("alert_type", "TEXT"),
+        ("severity", "TEXT"), ("description", "TEXT"), ("location", "TEXT"),
+        ("timestamp", "TEXT"), ("status", "TEXT"), ("resolved_at", "TEXT"),
+        ("resolved_by", "TEXT"),
+    ],
+}
+
+LOCAL_INDEXES = [
+    ("profiles", ("card_id",)), ("profiles", ("device_hash",)),
+    ("profiles", ("face_id",)), ("profiles", ("email",)),
+    ("swipes", ("timestamp",)), ("swipes", ("entity_id", "timestamp")),
+    ("swipes", ("identity", "timestamp")), ("swipes", ("card_id",)),
+    ("wifi_logs", ("timestamp",)), ("wifi_logs", ("entity_id", "timestamp")),
+    ("wifi_logs", ("identity", "timestamp")), ("wifi_logs", ("device_hash",)),
+    ("lab_bookings", ("entity_id", "start_time")), ("lab_bookings", ("start_time",)),
+    ("library_checkouts", ("entity_id", "timestamp")),
+    ("notes", ("entity_id", "timestamp")),
+    ("cctv_frame", ("timestamp",)), ("cctv_frame", ("face_id",)),
+    ("cctv_frame", ("location_id", "timestamp")),
+    ("face_embedding", ("face_id",)),
+    ("alerts", ("entity_id",)),
+]
+
+# Local equivalents of the server-side functions in sql/aggregates.sql,
+# as (SQL, parameter defaults)
+LOCAL_FUNCTIONS: Dict[str, Tuple[str, Dict[str, Any]]] = {
+    "dashboard_activity_stats": ("""
+        SELECT (SELECT COUNT(*) FROM profiles) AS total_entities,
+               COUNT(*) AS total_activities,
+               COUNT(DISTINCT entity_id) AS active_entities
+        FROM (
+            SELECT entity_id FROM swipes WHERE "timestamp" >= :start_ts AND "timestamp" <= :end_ts
+            UNION ALL
+            SELECT entity_id FROM wifi_logs WHERE "timestamp" >= :start_ts AND "timestamp" <= :end_ts
+        )
+    """, {}),
+    "source_distribution_counts": ("""
+        SELECT
+            (SELECT COUNT(*) FROM swipes WHERE (:start_ts IS NULL OR "timestamp" >= :start_ts)
+                AND (:end_ts IS NULL OR "timestamp" <= :end_ts)) AS swipes,
+            (SELECT COUNT(*) FROM wifi_logs WHERE (:start_ts IS NULL OR "timestamp" >= :start_ts)
+                AND (:end_ts IS NULL OR "timestamp" <= :end_ts)) AS wifi_logs,
+            (SELECT COUNT(*) FROM cctv_frame WHERE (:start_ts IS NULL OR "timestamp" >= :start_ts)
+                AND (:end_ts IS NULL OR "timestamp" <= :end_ts)) AS cctv_frame,
+            (SELECT COUNT(*) FROM lab_bookings WHERE (:start_ts IS NULL OR start_time >= :start_ts)
+                AND (:end_ts IS NULL OR start_time <= :end_ts)) AS lab_bookings
+    """, {"start_ts": None, "end_ts": None}),
+}
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_COMPARISONS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+def _ident(name: str) -> str:
+    """Validate and quote a column/table identifier"""
+    name = name.strip()
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Invalid identifier: {name!r}")
+    return f'"{name}"'
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split a PostgREST logic string on commas that are not inside parentheses or quotes"""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif char == "(" and not quoted:
+            depth += 1
+        elif char == ")" and not quoted:
+            depth -= 1
+        if char == "," and depth == 0 and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    if current:
+        parts.append("".join(current))
+    return [p.strip() for p in parts if p.strip()]
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Embedded SQLite backend for local serving and benchmarking
+    Compiles recorded queries to SQL against a single shared connection
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = "campusflow.db"):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.columns: Dict[str, Dict[str, str]] = {}
+        self._create_schema()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _create_schema(self):
+        with self.lock:
+            for table, columns in LOCAL_SCHEMA.items():
+                column_sql = ", ".join(f"{_ident(col)} {col_type}" for col, col_type in columns)
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {_ident(table)} ({column_sql})")
+            for table, columns in LOCAL_INDEXES:
+                index_name = f"idx_{table}_{'_'.join(columns)}"
+                self.conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {_ident(index_name)} ON {_ident(table)} "
+                    f"({', '.join(_ident(c) for c in columns)})"
+                )
+            self.conn.commit()
+            for table in LOCAL_SCHEMA:
+                self._load_columns(table)
+
+    def _load_columns(self, table: str) -> Dict[str, str]:
+        rows = self.conn.execute(f"PRAGMA table_info({_ident(table)})").fetchall()
+        self.columns[table] = {row["name"]: (row["type"] or "").upper() for row in rows}
+        return self.columns[table]
+
+    def _table_columns(self, table: str) -> Dict[str, str]:
+        if table not in self.columns:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {_ident(table)} (_rowid INTEGER PRIMARY KEY)")
+            self._load_columns(table)
+        return self.columns[table]
+
+    def _ensure_columns(self, table: str, rows: List[Dict[str, Any]]):
+        """Add any columns present in the rows but missing from the table"""
+        known = self._table_columns(table)
+        for row in rows:
+            for column, value in row.items():
+                if column not in known:
+                    col_type = "JSON" if isinstance(value, (dict, list)) else "TEXT"
+                    self.conn.execute(f"ALTER TABLE {_ident(table)} ADD COLUMN {_ident(column)} {col_type}")
+                    known[column] = col_type
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, default=str)
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        if isinstance(value, bool):
+            return int(value)
+        return value
+
+    def _decode_row(self, table: str, row: sqlite3.Row) -> Dict[str, Any]:
+        columns = self.columns.get(table, {})
+        result = {}
+        for key in row.keys():
+            value = row[key]
+            col_type = columns.get(key, "")
+            if value is not None and col_type == "JSON" and isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            elif value is not None and col_type == "BOOLEAN":
+                value = bool(value)
+            result[key] = value
+        return result
+
+    # ---------- filter compilation ----------
+    def _compile_condition(self, op: str, column: str, value) -> Tuple[str, list]:
+        col = _ident(column)
+        if op in _COMPARISONS:
+            return f"{col} {_COMPARISONS[op]} ?", [self._encode(value)]
+        if op == "in_":
+            values = list(value)
+            if not values:
+                return "0", []
+            return f"{col} IN ({', '.join('?' for _ in values)})", [self._encode(v) for v in values]
+        if op == "ilike":
+            return f"{col} LIKE ?", [str(value).replace("*", "%")]
+        if op == "is_":
+            if value is None or str(value).lower() == "null":
+                return f"{col} IS NULL", []
+            return f"{col} IS ?", [1 if str(value).lower() == "true" else 0]
+        raise ValueError(f"Unsupported filter operator: {op}")
+
+    def _compile_logic(self, expression: str, joiner: str) -> Tuple[str, list]:
+        """Compile a PostgREST or/and logic string such as 'name.ilike.%a%,and(x.gt.1,y.eq.2)'"""
+        clauses, params = [], []
+        for part in _split_top_level(expression):
+            nested = re.match(r"^(and|or)\((.*)\)$", part)
+            if nested:
+                sql, part_params = self._compile_logic(nested.group(2), nested.group(1).upper())
+            else:
+                column, op, value = part.split(".", 2)
+                if op == "in":
+                    value = [v.strip().strip('"') for v in value.strip("()").split(",")]
+                    op = "in_"
+                elif op == "is":
+                    op = "is_"
+                elif op == "like":
+                    op = "ilike"
+                if isinstance(value, str) and len(value) > 1 and value[0] == value[-1] == '"':
+                    value = value[1:-1]
+                sql, part_params = self._compile_condition(op, column, value)
+            clauses.append(f"({sql})")
+            params.extend(part_params)
+        return f" {joiner} ".join(clauses) or "1", params
+
+    def _compile_where(self, query: Query) -> Tuple[str, list]:
+        clauses, params = [], []
+        for name, args, _ in query.calls:
+            if name == "or_":
+                sql, part_params = self._compile_logic(args[0], "OR")
+            elif name in Query.FILTERS:
+                sql, part_params = self._compile_condition(name, args[0], args[1])
+            else:
+                continue
+            clauses.append(f"({sql})")
+            params.extend(part_params)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    # ---------- execution ----------
+    def execute(self, query: Query) -> QueryResult:
+        verb, verb_args, verb_kwargs = next(
+            ((n, a, k) for n, a, k in query.calls if n in Query.VERBS), ("select", ("*",), {})
+        )
+        with self.lock:
+            self._table_columns(query.table)
+            try:
+                if verb == "select":
+                    result = self._select(query, verb_args[0], verb_kwargs.get("count"))
+                elif verb in ("insert", "upsert"):
+                    result = self._insert(query.table, verb_args[0], upsert=verb == "upsert",
+                                          returning=verb_kwargs.get("returning", "representation"))
+                elif verb == "update":
+                    result = self._update(query, verb_args[0])
+                else:
+                    result = self._delete(query)
+                self.conn.commit()
+                return result
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> QueryResult:
+        if name not in LOCAL_FUNCTIONS:
+            raise StorageError(f"Unknown function: {name}")
+        sql, defaults = LOCAL_FUNCTIONS[name]
+        bound = {**defaults, **{k: self._encode(v) for k, v in (params or {}).items()}}
+        with self.lock:
+            rows = self.conn.execute(sql, bound).fetchall()
+        return QueryResult([dict(row) for row in rows])
+
+    def _select(self, query: Query, columns: str, count: Optional[str]) -> QueryResult:
+        table = _ident(query.table)
+        if columns.strip() == "*":
+            column_sql = "*"
+        else:
+            column_sql = ", ".join(_ident(c) for c in columns.split(","))
+        where, params = self._compile_where(query)
+
+        order_parts, limit, offset = [], None, None
+        for name, args, kwargs in query.calls:
+            if name == "order":
+                order_parts.append(f"{_ident(args[0])} {'DESC' if kwargs.get('desc') else 'ASC'}")
+            elif name == "limit":
+                limit = args[0]
+            elif name == "range":
+                offset, limit = args[0], args[1] - args[0] + 1
+
+        sql = f"SELECT {column_sql} FROM {table}{where}"
+        if order_parts:
+            sql += " ORDER BY " + ", ".join(order_parts)
+        if limit is not None or offset is not None:
+            sql += " LIMIT ? OFFSET ?"
+            rows = self.conn.execute(sql, params + [limit if limit is not None else -1, offset or 0]).fetchall()
+        else:
+            rows = self.conn.execute(sql, params).fetchall()
+
+        total = None
+        if count:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+        return QueryResult([self._decode_row(query.table, row) for row in rows], total)
+
+    def _insert(self, table_name: str, rows, upsert: bool = False, returning: str = "representation") -> QueryResult:
+        rows = [rows] if isinstance(rows, dict) else list(rows)
+        if not rows:
+            return QueryResult([])
+        self._ensure_columns(table_name, rows)
+        table = _ident(table_name)
+        verb = "INSERT OR REPLACE" if upsert else "INSERT"
+        if returning == "minimal":
+            # Bulk path: one prepared statement per distinct column set, nothing read back
+            groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+            for row in rows:
+                groups.setdefault(tuple(row.keys()), []).append(row)
+            for columns, group in groups.items():
+                self.conn.executemany(
+                    f"{verb} INTO {table} ({', '.join(_ident(c) for c in columns)}) "
+                    f"VALUES ({', '.join('?' for _ in columns)})",
+                    [[self._encode(row[c]) for c in columns] for row in group],
+                )
+            return QueryResult([])
+        inserted = []
+        for row in rows:
+            columns = list(row.keys())
+            cursor = self.conn.execute(
+                f"{verb} INTO {table} ({', '.join(_ident(c) for c in columns)}) "
+                f"VALUES ({', '.join('?' for _ in columns)})",
+                [self._encode(row[c]) for c in columns],
+            )
+            inserted.append(cursor.lastrowid)
+        stored = self.conn.execute(
+            f"SELECT * FROM {table} WHERE rowid IN ({', '.join('?' for _ in inserted)})", inserted
+        ).fetchall()
+        return QueryResult([self._decode_row(table_name, row) for row in stored])
+
+    def _matching_rowids(self, query: Query) -> List[int]:
+        where, params = self._compile_where(query)
+        return [row[0] for row in self.conn.execute(f"SELECT rowid FROM {_ident(query.table)}{where}", params)]
+
+    def _update(self, query: Query, values: Dict[str, Any]) -> QueryResult:
+        self._ensure_columns(query.table, [values])
+        rowids = self._matching_rowids(query)
+        if not rowids or not values:
+            return QueryResult([])
+        table = _ident(query.table)
+        placeholders = ", ".join("?" for _ in rowids)
+        assignments = ", ".join(f"{_ident(c)} = ?" for c in values)
+        self.conn.execute(
+            f"UPDATE {table} SET {assignments} WHERE rowid IN ({placeholders})",
+            [self._encode(v) for v in values.values()] + rowids,
+        )
+        rows = self.conn.execute(f"SELECT * FROM {table} WHERE rowid IN ({placeholders})", rowids).fetchall()
+        return QueryResult([self._decode_row(query.table, row) for row in rows])
+
+    def _delete(self, query: Query) -> QueryResult:
+        rowids = self._matching_rowids(query)
+        if not rowids:
+            return QueryResult([])
+        table = _ident(query.table)
+        placeholders = ", ".join("?" for _ in rowids)
+        rows = self.conn.execute(f"SELECT * FROM {table} WHERE rowid IN ({placeholders})", rowids).fetchall()
+        self.conn.execute(f"DELETE FROM {table} WHERE rowid IN ({placeholders})", rowids)
+        return QueryResult([self._decode_row(query.table, row) for row in rows])
+
+
+# ============================================
+# BACKEND SELECTION
+# ============================================
+def create_backend(kind: Optional[str] = None) -> StorageBackend:
+    """
+    Create a storage backend
+    kind: "supabase" (default) or "sqlite"; falls back to the STORAGE_BACKEND env var
+    """
+    kind = (kind or os.getenv("STORAGE_BACKEND", "supabase")).lower()
+    if kind == "sqlite":
+        return SQLiteBackend(os.getenv("SQLITE_PATH", "campusflow.db"))
+    if kind == "supabase":
+        url = os.getenv("SUPABASE_URL")
+        key = os.getenv("SUPABASE_KEY")
+        if not url or not key:
+            raise RuntimeError("Missing SUPABASE_URL or SUPABASE_KEY in environment variables.")
+        return SupabaseBackend(url, key)
+    raise RuntimeError(f"Unknown STORAGE_BACKEND: {kind}")
+
+
+# Global backend instance (lazy loaded)
+_backend_instance: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StorageBackend:
+    """Get or create global storage backend instance"""
+    global _backend_instance
+    if _backend_instance is None:
+        with _backend_lock:
+            if _backend_instance is None:
+                _backend_instance = create_backend()
+    return _backend_instance
+
+
+def close_backend():
+    """Close the global storage backend if one was created"""
+    global _backend_instance
+    if _backend_instance is not None:
+        _backend_instance.close()
+        _backend_instance = None
+
+
+def set_backend(backend: StorageBackend):
+    """Replace the global storage backend (e.g. with an in-memory SQLite engine)"""
+    global _backend_instance
+    _backend_instance = backend
+
+
+def copy_tables(source: StorageBackend, target: StorageBackend,
+                tables: Optional[List[str]] = None, page_size: int = 1000) -> Dict[str, int]:
+    """Copy tables page by page from one backend to another (e.g. Supabase -> local SQLite)"""
+    copied = {}
+    for table in tables or list(LOCAL_SCHEMA.keys()):
+        offset, total = 0, 0
+        while True:
+            try:
+                rows = source.table(table).select("*").range(offset, offset + page_size - 1).execute().data
+            except Exception as e:
+                print(f"Error copying table {table}: {e}")
+                break
+            if not rows:
+                break
+            target.table(table).upsert(rows).execute()
+            total += len(rows)
+            offset += page_size
+            if len(rows) < page_size:
+                break
+        copied[table] = total
+    return copied
+
+
+if __name__ == "__main__":
+    # Snapshot Supabase into the local engine: python storage.py [sqlite_path]
+    import sys
+    local_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("SQLITE_PATH", "campusflow.db")
+    counts = copy_tables(create_backend("supabase"), SQLiteBackend(local_path))
+    for table_name, rows_copied in counts.items():
+        print(f"{table_name}: {rows_copied} rows")
@@ -0,0 +1,115 @@
+"""
+Timestamp Utilities
+Conversion between stored ISO timestamps and UTC epoch seconds
+
+Stored timestamps are naive local wall time, as written by datetime.now().
+Epochs read that wall time as if it were UTC, and now_epoch() reads the
+current time the same way, so every comparison uses one clock. Values that
+carry an offset are converted to local wall time on the way in (stored_timestamp).
+"""
+
+from typing import Any, List, Optional, Sequence
+from datetime import datetime, timezone
+import numpy as np
+
+HOUR_SECONDS = 3600
+DAY_SECONDS = 86400
+
+# Placeholder for unparseable values in epoch arrays
+MISSING_EPOCH = np.iinfo(np.int64).min
+
+
+def to_epoch(value) -> Optional[int]:
+    """
+    Convert an ISO string, datetime or number to UTC epoch seconds
+    Naive values are taken as UTC; unparseable values return None
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+def to_epoch_array(values: Sequence) -> np.ndarray:
+    """
+    Convert many timestamps to an int64 array of UTC epoch seconds in one pass
+    UTC and naive ISO strings are parsed together by NumPy; other offsets and
+    datetimes go through to_epoch. Unparseable values become MISSING_EPOCH.
+    """
+    epochs = np.full(len(values), MISSING_EPOCH, dtype=np.int64)
+    utc_positions, utc_strings = [], []
+    for i, value in enumerate(values):
+        if isinstance(value, str):
+            if value.endswith("Z"):
+                value = value[:-1]
+            elif value.endswith("+00:00"):
+                value = value[:-6]
+            if "+" not in value[10:] and "-" not in value[10:]:
+                utc_positions.append(i)
+                utc_strings.append(value)
+                continue
+        epoch = to_epoch(value)
+        if epoch is not None:
+            epochs[i] = epoch
+    
+    if utc_strings:
+        try:
+            epochs[utc_positions] = np.array(utc_strings, dtype="datetime64[s]").astype(np.int64)
+        except ValueError:
+            for i, value in zip(utc_positions, utc_strings):
+                epoch = to_epoch(value)
+                if epoch is not None:
+                    epochs[i] = epoch
+    return epochs
+
+
+def now_epoch() -> int:
+    """
+    Current time in epoch seconds on the same scale as stored timestamps, which
+    are written from the naive local clock and so read back as UTC wall time
+    """
+    return to_epoch(datetime.now())
+
+
+def stored_timestamp(value: str) -> str:
+    """
+    An ISO timestamp as stored timestamps are written: naive local wall time
+    Values with a UTC offset or Z are converted to the local zone and lose the offset
+    """
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (ValueError, AttributeError, TypeError):
+        return value
+    if parsed.tzinfo is None:
+        return value
+    return parsed.astimezone().replace(tzinfo=None).isoformat()
+
+
+def newest_first(items: Sequence[Any], epochs: Sequence[int]) -> List[Any]:
+    """
+    Order items by their parallel epochs, most recent first
+    Ties keep their original order; MISSING_EPOCH sorts last
+    """
+    epochs = epochs.tolist() if isinstance(epochs, np.ndarray) else list(epochs)
+    return [items[i] for i in sorted(range(len(items)), key=epochs.__getitem__, reverse=True)]
+
+
+def from_epoch(epoch: int) -> datetime:
+    """Convert UTC epoch seconds to an aware UTC datetime"""
+    return datetime.fromtimestamp(epoch, tz=timezone.utc)
+
+
+def floor_hour(epoch: int) -> int:
+    return epoch - epoch % HOUR_SECONDS
+
+
+def floor_day(epoch: int) -> int:
+    return epoch - epoch % DAY_SECONDS
@@ -0,0 +1,290 @@
+"""
+Write-Behind Queue
+Buffers event rows in process and flushes them to storage in bulk inserts,
+by batch size or age, so ingestion requests do not wait on their own insert
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+# Rows per flushed insert
+WRITE_BEHIND_BATCH_ROWS = int(os.getenv("WRITE_BEHIND_BATCH_ROWS", "2000"))
+# Longest a row waits before its table is flushed
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "0.5"))
+# Rows buffered (queued or being written) before producers are made to wait
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "200000"))
+# How long a producer waits for room before giving up
+WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT", "5"))
+# Attempts per batch before it is set aside in the dead-letter directory;
+# failed batches go back to the head of their table's buffer between attempts
+WRITE_BEHIND_RETRIES = int(os.getenv("WRITE_BEHIND_RETRIES", "8"))
+# Longest wait between attempts (the wait doubles from 0.5s after each failure)
+WRITE_BEHIND_MAX_BACKOFF_SECONDS = float(os.getenv("WRITE_BEHIND_MAX_BACKOFF_SECONDS", "60"))
+# Rows that could not be written, one NDJSON file per table, re-ingestable through /api/ingest
+WRITE_BEHIND_DEAD_LETTER_DIR = os.getenv("WRITE_BEHIND_DEAD_LETTER_DIR", "dead_letter")
+
+# Tables written through the queue
+WRITE_BEHIND_TABLES = ("swipes", "wifi_logs", "cctv_frame")
+
+
+class WriteQueueFull(Exception):
+    """The queue stayed full for the whole put timeout"""
+
+
+class WriteQueueClosed(Exception):
+    """The queue is shutting down and no longer accepts rows"""
+
+
+class WriteBehindQueue:
+    """
+    Per-table row buffers drained by one flusher thread
+
+    A table is flushed when it holds `batch_rows` rows or its oldest row is
+    `flush_seconds` old. Rows count against `max_rows` until their insert
+    finishes, so memory stays bounded while storage is slow; `put` blocks for
+    up to `timeout` seconds for room and then raises WriteQueueFull.
+
+    A batch whose insert fails is put back at the head of its table's buffer
+    and the table is retried with exponential backoff. After `retries`
+    attempts (or at once while closing) its rows are appended to
+    `dead_letter_dir`/<table>.ndjson; rows are never discarded.
+    """
+
+    def __init__(self, write: Callable[[str, List[Dict[str, Any]]], Any],
+                 batch_rows: int = WRITE_BEHIND_BATCH_ROWS,
+                 flush_seconds: float = WRITE_BEHIND_FLUSH_SECONDS,
+                 max_rows: int = WRITE_BEHIND_MAX_ROWS,
+                 retries: int = WRITE_BEHIND_RETRIES,
+                 dead_letter_dir: str = WRITE_BEHIND_DEAD_LETTER_DIR):
+        self.write = write
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.max_rows = max_rows
+        self.retries = retries
+        self.dead_letter_dir = dead_letter_dir
+        self._buffers: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._oldest: Dict[str, float] = {}
+        # table -> consecutive failed attempts, when it may be retried, and the last error
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._pending = 0
+        self._flush_requested = False
+        self._closing = False
+        self._cond = threading.Condition()
+        self.stats = {"enqueued": 0, "written": 0, "dead_lettered": 0, "unwritten": 0, "flushes": 0, "failed_attempts": 0}
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    # ---- producers ----
+
+    def put(self, table: str, rows: List[Dict[str, Any]], timeout: float = WRITE_BEHIND_PUT_TIMEOUT):
+        """Queue rows for `table`, waiting up to timeout seconds while the queue is full"""
+        if not rows:
+            return
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # An oversized put is let through once the queue is empty
+            while self._pending and self._pending + len(rows) > self.max_rows and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WriteQueueFull(f"write-behind queue full ({self._pending} rows pending)")
+                self._cond.wait(remaining)
+            if self._closing:
+                raise WriteQueueClosed("write-behind queue is shut down")
+            buffer = self._buffers.setdefault(table, deque())
+            if not buffer:
+                self._oldest[table] = time.monotonic()
+            buffer.extend(rows)
+            self._pending += len(rows)
+            self.stats["enqueued"] += len(rows)
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Write out (or dead-letter) everything queued so far; returns False if timeout passed first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = None) -> Dict[str, int]:
+        """
+        Stop accepting rows, drain what is queued and stop the flusher
+        Returns the rows written, dead-lettered and left unwritten (still in
+        memory when the timeout passed, or not even dead-lettered) by the drain
+        """
+        with self._cond:
+            self._closing = True
+            before = dict(self.stats)
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            if self._thread.is_alive():
+                self.stats["unwritten"] += self._pending
+            return {key: self.stats[key] - before[key] for key in ("written", "dead_lettered", "unwritten")}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Queue depth, counters and the tables whose inserts are failing"""
+        now = time.monotonic()
+        with self._cond:
+            return {
+                **self.stats,
+                "pending": self._pending,
+                "queued_by_table": {table: len(buffer) for table, buffer in self._buffers.items() if buffer},
+                "failing_tables": {
+                    table: {
+                        "failed_attempts": failures,
+                        "retry_in_seconds": round(max(self._retry_at.get(table, now) - now, 0), 3),
+                        "last_error": self._errors.get(table)
+                    }
+                    for table, failures in self._failures.items() if failures
+                },
+                "dead_letter_dir": self.dead_letter_dir,
+                "max_rows": self.max_rows
+            }
+
+    def healthy(self) -> bool:
+        """False while a table's inserts are failing or once rows have been dead-lettered or lost"""
+        with self._cond:
+            return not any(self._failures.values()) and not self.stats["dead_lettered"] and not self.stats["unwritten"]
+
+    # ---- flusher ----
+
+    def _due(self, now: float) -> List[str]:
+        if self._closing:
+            return [table for table, buffer in self._buffers.items() if buffer]
+        ready = [table for table, buffer in self._buffers.items() if buffer and self._retry_at.get(table, 0) <= now]
+        if self._flush_requested:
+            return ready
+        return [
+            table for table in ready
+            if len(self._buffers[table]) >= self.batch_rows or now - self._oldest[table] >= self.flush_seconds
+        ]
+
+    def _next_wait(self, now: float) -> Optional[float]:
+        times = [max(self._oldest[table] + self.flush_seconds, self._retry_at.get(table, 0))
+                 for table, buffer in self._buffers.items() if buffer]
+        return max(min(times) - now, 0) if times else None
+
+    def _take(self, tables: Iterable[str]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        batches = []
+        for table in tables:
+            buffer = self._buffers[table]
+            batches.append((table, [buffer.popleft() for _ in range(min(self.batch_rows, len(buffer)))]))
+        return batches
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    due = self._due(now)
+                    if due or (self._closing and not self._pending):
+                        break
+                    self._cond.wait(self._next_wait(now))
+                if not due:
+                    return
+                batches = self._take(due)
+                if not any(self._buffers.values()):
+                    self._flush_requested = False
+
+            for table, rows in batches:
+                if not self._write(table, rows) and not self._set_aside(table, rows):
+                    continue
+                with self._cond:
+                    self._pending -= len(rows)
+                    self._cond.notify_all()
+
+    def _write(self, table: str, rows: List[Dict[str, Any]]) -> bool:
+        try:
+            self.write(table, rows)
+        except Exception as e:
+            with self._cond:
+                self.stats["failed_attempts"] += 1
+                failures = self._failures[table] = self._failures.get(table, 0) + 1
+                self._errors[table] = str(e)
+            print(f"Error flushing {len(rows)} {table} rows (attempt {failures}): {e}")
+            return False
+        with self._cond:
+            self.stats["written"] += len(rows)
+            self.stats["flushes"] += 1
+            self._failures.pop(table, None)
+            self._retry_at.pop(table, None)
+            self._errors.pop(table, None)
+        return True
+
+    def _set_aside(self, table: str, rows: List[Dict[str, Any]]) -> bool:
+        """
+        Requeue a failed batch for a later attempt, or dead-letter it once out of attempts
+        Returns whether the rows left the queue
+        """
+        with self._cond:
+            failures = self._failures.get(table, 0)
+            if not self._closing and failures < self.retries:
+                self._requeue(table, rows, min(0.5 * 2 ** (failures - 1), WRITE_BEHIND_MAX_BACKOFF_SECONDS))
+                return False
+        path = os.path.join(self.dead_letter_dir, f"{table}.ndjson")
+        try:
+            os.makedirs(self.dead_letter_dir, exist_ok=True)
+            with open(path, "a") as f:
+                f.writelines(json.dumps(row, default=str) + "\n" for row in rows)
+        except Exception as e:
+            print(f"Error dead-lettering {len(rows)} {table} rows to {path}: {e}")
+            with self._cond:
+                if self._closing:
+                    self.stats["unwritten"] += len(rows)
+                    return True
+                self._requeue(table, rows, WRITE_BEHIND_MAX_BACKOFF_SECONDS)
+            return False
+        print(f"Dead-lettered {len(rows)} {table} rows to {path} after {failures} failed attempts")
+        with self._cond:
+            self.stats["dead_lettered"] += len(rows)
+            self._failures[table] = 0
+        return True
+
+    def _requeue(self, table: str, rows: List[Dict[str, Any]], delay: float):
+        """Put rows back at the head of their buffer, untouched for `delay` seconds (caller holds the lock)"""
+        buffer = self._buffers.setdefault(table, deque())
+        if not buffer:
+            self._oldest[table] = time.monotonic()
+        buffer.extendleft(reversed(rows))
+        self._retry_at[table] = time.monotonic() + delay
+        self._cond.notify_all()
+
+
+# Global queue instance (lazy loaded)
+_write_queue_instance: Optional[WriteBehindQueue] = None
+_write_queue_lock = threading.Lock()
+
+
+def get_write_queue() -> WriteBehindQueue:
+    """Get or create the global write-behind queue"""
+    global _write_queue_instance
+    if _write_queue_instance is None:
+        with _write_queue_lock:
+            if _write_queue_instance is None:
+                from ingest import flush_rows
+                _write_queue_instance = WriteBehindQueue(flush_rows)
+    return _write_queue_instance
+
+
+def shutdown_write_queue(timeout: Optional[float] = None) -> Optional[Dict[str, int]]:
+    """Drain and stop the global queue, if it was started; returns the drain report"""
+    global _write_queue_instance
+    if _write_queue_instance is None:
+        return None
+    report = _write_queue_instance.close(timeout)
+    _write_queue_instance = None
+    if report["dead_lettered"] or report["unwritten"]:
+        print(f"Write-behind drain: {report['dead_lettered']} rows dead-lettered, {report['unwritten']} rows unwritten")
+    return report